@@ -1,12 +1,61 @@
+import asyncio
+import io
+
 from aiogram import types
+from aiogram.utils import exceptions
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime
 import logging
 
-PAGE_SIZE = 20
+from helpers import format_access, fit_message, message_length, pack_pages
+from database import SEGMENTS
+from broadcast import format_progress
+from metrics import metrics
+
+# Запас под номера страниц в заголовке при расчёте места под строки
+MAX_PAGES = 99999
+
+# Списки админки → сегменты со счётчиками (списки по каналу считаются по самим себе)
+TITLE_SEGMENTS = {
+    "all_users": "all",
+    "active_users": "active",
+    "full_users": "full",
+    "expired_users": "expired",
+}
+
+
+# Сколько последних событий подписки показывать в /user
+USER_EVENTS = 15
+
+EVENT_TITLES = {
+    "paid": "💳 оплата",
+    "rejoined": "🔁 вернулся",
+    "extended": "⏩ продление админом",
+    "reminded": "🔔 напоминание",
+    "expired": "⛔ истекла",
+    "imported": "📥 перенесена из старой БД",
+}
+
+
+def format_event(kind, created_at, expiry, full_access, status, details):
+    """Строка истории подписки для /user"""
+    date = created_at.strftime("%d.%m.%Y") if created_at else "??.??.????"
+    title = EVENT_TITLES.get(kind, kind)
+    if kind == "reminded":
+        return f"{date} {title} ({details.get('stage')})"
+    return f"{date} {title} → {format_access(full_access, expiry)}"
+
+
+def format_counts(counts):
+    """Строка-сводка по счётчикам сегментов"""
+    return (
+        f"🟢 Активных: {counts['active']} · 📚 Полный: {counts['full']} · "
+        f"⛔ Истекших: {counts['expired']} · ⏳ Истекают за 7 дн.: {counts['expiring']}"
+    )
 
 
-def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
+def register_admin_handlers(
+    dp, db, support_user_id, dev_user_id, bot, broadcaster, catalog, reload_access
+):
     """Регистрация всех админ-хэндлеров"""
 
     # Правильная проверка админа
@@ -16,62 +65,74 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
         return user_id in admin_ids
 
     # -------------------- Пользователи --------------------
-    async def send_users_page(chat_id, page, users, title="Пользователи"):
+    async def show_page(chat_id, text, kb, message=None):
+        """Новое сообщение или (при навигации) правка уже показанной страницы"""
+        text = fit_message(text)
+        if message is None:
+            await bot.send_message(chat_id, text, reply_markup=kb)
+            return
+        try:
+            await bot.edit_message_text(
+                text, chat_id, message.message_id, reply_markup=kb
+            )
+        except exceptions.MessageNotModified:
+            pass  # повторный клик по той же странице
+
+    def nav_keyboard(prefix, page, pages):
+        kb = InlineKeyboardMarkup()
+        if page > 0:
+            kb.add(
+                InlineKeyboardButton("⬅ Назад", callback_data=f"{prefix}_page_{page-1}")
+            )
+        if page < pages - 1:
+            kb.add(
+                InlineKeyboardButton(
+                    "Вперёд ➡", callback_data=f"{prefix}_page_{page+1}"
+                )
+            )
+        return kb
+
+    def users_header(title, page, pages, total_users, counts):
+        text = (
+            f"📊 {title.replace('_', ' ').capitalize()} (стр. {page+1}/{pages})\n"
+            f"━━━━━━━━━━━━━━━\n"
+            f"👥 Всего пользователей: {total_users}\n"
+        )
+        if counts:
+            text += format_counts(counts) + "\n"
+        return text + "\n"
+
+    async def send_users_page(chat_id, page, users, title="Пользователи", message=None):
         try:
             total = len(users)
+            counts = await asyncio.to_thread(db.get_segment_counts)
+            segment = TITLE_SEGMENTS.get(title)
+            total_users = counts[segment] if counts and segment else total
 
             if total == 0:
-                await bot.send_message(chat_id, "Нет пользователей.")
-                return
-
-            pages = (total - 1) // PAGE_SIZE + 1
-            offset = page * PAGE_SIZE
-            slice_users = users[offset : offset + PAGE_SIZE]
-
-            if not slice_users:
-                await bot.send_message(chat_id, "Нет пользователей на этой странице.")
+                await show_page(chat_id, "Нет пользователей.", None, message)
                 return
 
-            text = (
-                f"📊 {title.replace('_', ' ').capitalize()} (стр. {page+1}/{pages})\n"
-                f"━━━━━━━━━━━━━━━\n"
-                f"👥 Всего пользователей: {total}\n\n"
-            )
-
-            for u in slice_users:
-                uid, username, expiry, full_access = u
-                username_display = f"@{username}" if username else f"(без username)"
-
-                if full_access:
-                    access = "бессрочно (полный)"
-                elif expiry:
-                    try:
-                        exp_date = datetime.fromisoformat(expiry).strftime("%d.%m.%Y")
-                        access = f"до {exp_date}"
-                    except (ValueError, TypeError):
-                        access = "ошибка даты"
-                else:
-                    access = "нет подписки"
-
-                text += f"👤 ID: {uid}\n" f"  {username_display}\n" f"  ✅ {access}\n\n"
-
-            kb = InlineKeyboardMarkup()
-
-            if page > 0:
-                kb.add(
-                    InlineKeyboardButton(
-                        "⬅ Назад", callback_data=f"{title}_page_{page-1}"
-                    )
+            blocks = []
+            for u in users:
+                username_display = f"@{u.username}" if u.username else f"(без username)"
+                access = format_access(u.full_access, u.expiry_date)
+                blocks.append(
+                    f"👤 ID: {u.user_id}\n" f"  {username_display}\n" f"  ✅ {access}\n\n"
                 )
 
-            if page < pages - 1:
-                kb.add(
-                    InlineKeyboardButton(
-                        "Вперёд ➡", callback_data=f"{title}_page_{page+1}"
-                    )
-                )
+            # Страница — столько строк, сколько влезает в сообщение
+            reserved = message_length(
+                users_header(title, MAX_PAGES, MAX_PAGES, total_users, counts)
+            )
+            pages = pack_pages(blocks, reserved)
+            page = min(page, len(pages) - 1)
+            first, last = pages[page]
 
-            await bot.send_message(chat_id, text, reply_markup=kb)
+            text = users_header(title, page, len(pages), total_users, counts)
+            text += "".join(blocks[first:last])
+            kb = nav_keyboard(title, page, len(pages))
+            await show_page(chat_id, text, kb, message)
 
         except Exception as e:
             logging.error(
@@ -86,7 +147,7 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
             if not is_admin(message.from_user.id):
                 return
 
-            users = db.get_all_users()
+            users = await asyncio.to_thread(db.get_all_users)
             await send_users_page(message.chat.id, 0, users, title="all_users")
         except Exception as e:
             logging.error(f"❌ Ошибка в admin_users: {e}", exc_info=True)
@@ -98,7 +159,7 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
             if not is_admin(message.from_user.id):
                 return
 
-            users = db.get_active_users()
+            users = await asyncio.to_thread(db.get_active_users)
             await send_users_page(message.chat.id, 0, users, title="active_users")
         except Exception as e:
             logging.error(f"❌ Ошибка в admin_active: {e}", exc_info=True)
@@ -110,7 +171,7 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
             if not is_admin(message.from_user.id):
                 return
 
-            users = db.get_full_access_users()
+            users = await asyncio.to_thread(db.get_full_access_users)
             await send_users_page(message.chat.id, 0, users, title="full_users")
         except Exception as e:
             logging.error(f"❌ Ошибка в admin_full: {e}", exc_info=True)
@@ -124,12 +185,47 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
             if not is_admin(message.from_user.id):
                 return
 
-            users = db.get_expired_users()
+            users = await asyncio.to_thread(db.get_expired_users)
             await send_users_page(message.chat.id, 0, users, title="expired_users")
         except Exception as e:
             logging.error(f"❌ Ошибка в admin_expired: {e}", exc_info=True)
             await message.answer("⚠️ Ошибка получения списка истёкших пользователей.")
 
+    @dp.message_handler(commands=["admin_not_joined"])
+    async def admin_not_joined(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            users = await asyncio.to_thread(db.get_not_joined_users)
+            await send_users_page(message.chat.id, 0, users, title="not_joined_users")
+
+            # Без статуса — не «не вступили»: могли вступить до начала отслеживания
+            unknown = await asyncio.to_thread(db.get_unknown_channel_users)
+            if unknown:
+                await message.answer(
+                    f"❔ Ещё {len(unknown)} активных подписчиков без данных о канале "
+                    f"(вступили до начала отслеживания или ещё не вступали): "
+                    f"/admin_channel_unknown"
+                )
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_not_joined: {e}", exc_info=True)
+            await message.answer("⚠️ Ошибка получения списка не вступивших.")
+
+    @dp.message_handler(commands=["admin_channel_unknown"])
+    async def admin_channel_unknown(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            users = await asyncio.to_thread(db.get_unknown_channel_users)
+            await send_users_page(
+                message.chat.id, 0, users, title="unknown_channel_users"
+            )
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_channel_unknown: {e}", exc_info=True)
+            await message.answer("⚠️ Ошибка получения списка без статуса в канале.")
+
     # -------------------- Детальный просмотр пользователя --------------------
     @dp.message_handler(commands=["user"])
     async def admin_user(message: types.Message):
@@ -149,104 +245,80 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
                 await message.answer("⚠️ ID должен быть числом.")
                 return
 
-            user = db.get_user(uid)
+            user = await asyncio.to_thread(db.get_user, uid)
 
             if not user:
                 await message.answer("Пользователь не найден.")
                 return
 
-            uid, username, expiry, full_access = user
-
-            if full_access:
-                access = "бессрочно (полный)"
-            elif expiry:
-                try:
-                    exp_date = datetime.fromisoformat(expiry).strftime("%d.%m.%Y")
-                    access = f"до {exp_date}"
-                except (ValueError, TypeError):
-                    access = "ошибка даты"
-            else:
-                access = "нет подписки"
+            access = format_access(user.full_access, user.expiry_date)
+            payments = await asyncio.to_thread(
+                db.get_user_payments, uid, full_history=True
+            )
+            paid = sum(p.amount for p in payments) / 100
+            events = await asyncio.to_thread(db.get_user_events, uid, USER_EVENTS)
 
-            await message.answer(
-                f"👤 ID: {uid}\n" f"@{username}\n" f"✅ Статус: {access}"
+            text = (
+                f"👤 ID: {user.user_id}\n"
+                f"@{user.username}\n"
+                f"✅ Статус: {access}\n"
+                f"💳 Оплат: {len(payments)} на {paid:.2f} ₽"
             )
+            if events:
+                text += "\n\n🗂 История подписки:\n" + "\n".join(
+                    format_event(*event) for event in events
+                )
+            await message.answer(fit_message(text))
 
         except Exception as e:
             logging.error(f"❌ Ошибка в admin_user: {e}", exc_info=True)
             await message.answer("⚠️ Ошибка получения информации о пользователе.")
 
     # -------------------- История оплат --------------------
-    async def send_payments_page(chat_id, page, payments):
+    async def send_payments_page(chat_id, page, payments, message=None):
         try:
-            total = len(payments)
-
-            if total == 0:
-                await bot.send_message(chat_id, "Нет оплат.")
+            if not payments:
+                await show_page(chat_id, "Нет оплат.", None, message)
                 return
 
-            total_sum = sum(p[2] for p in payments)  # p[2] — amount (в копейках)
-            total_sum_rub = total_sum / 100
-            pages = (total - 1) // PAGE_SIZE + 1
-            offset = page * PAGE_SIZE
-            slice_payments = payments[offset : offset + PAGE_SIZE]
-
-            if not slice_payments:
-                await bot.send_message(chat_id, "Нет оплат на этой странице.")
-                return
-
-            text = f"📊 История оплат (страница {page+1}/{pages})\n\n"
-
-            for p in slice_payments:
-                uid, username, amount, currency, date_str, expiry, full = p
-
-                try:
-                    date = datetime.fromisoformat(date_str).strftime("%d.%m.%Y %H:%M")
-                except (ValueError, TypeError):
-                    date = "ошибка даты"
-                username_display = f"@{username}" if username else "без username"
-
-                if full:
-                    access = "бессрочно (полный)"
-                elif expiry:
-                    try:
-                        exp_date = datetime.fromisoformat(expiry).strftime("%d.%m.%Y")
-                        access = f"до {exp_date}"
-                    except (ValueError, TypeError):
-                        access = "ошибка даты"
-                else:
-                    access = "нет подписки"
-
-                text += (
-                    f"👤 ID: {uid}\n"
-                    f"  @{username}\n"
-                    f"  💳 {amount/100:.2f} {currency}\n"
-                    f"  ⏰ {date}\n"
-                    f"  ✅ {access}\n\n"
-                )
-            text += (
+            # Итоги за всё время, включая архив, — без чтения архивных строк
+            all_count, all_sum = await asyncio.to_thread(db.get_payment_totals)
+            total_sum_rub = all_sum / 100  # в копейках
+            footer = (
                 f"━━━━━━━━━━━━━━\n"
-                f"📦 Всего оплат: {total}\n"
+                f"📦 Всего оплат: {all_count}\n"
                 f"💰 Общая сумма: {total_sum_rub:.2f} ₽"
             )
 
-            kb = InlineKeyboardMarkup()
-
-            if page > 0:
-                kb.add(
-                    InlineKeyboardButton(
-                        "⬅ Назад", callback_data=f"payments_page_{page-1}"
-                    )
+            blocks = []
+            for p in payments:
+                date = (
+                    p.payment_date.strftime("%d.%m.%Y %H:%M")
+                    if p.payment_date
+                    else "ошибка даты"
                 )
-
-            if page < pages - 1:
-                kb.add(
-                    InlineKeyboardButton(
-                        "Вперёд ➡", callback_data=f"payments_page_{page+1}"
-                    )
+                access = format_access(p.full_access, p.expiry_date)
+                blocks.append(
+                    f"👤 ID: {p.user_id}\n"
+                    f"  @{p.username}\n"
+                    f"  💳 {p.amount/100:.2f} {p.currency}\n"
+                    f"  ⏰ {date}\n"
+                    f"  ✅ {access}\n\n"
                 )
 
-            await bot.send_message(chat_id, text, reply_markup=kb)
+            header = "📊 История оплат (страница {}/{})\n\n"
+            reserved = message_length(header.format(MAX_PAGES, MAX_PAGES) + footer)
+            pages = pack_pages(blocks, reserved)
+            page = min(page, len(pages) - 1)
+            first, last = pages[page]
+
+            text = (
+                header.format(page + 1, len(pages))
+                + "".join(blocks[first:last])
+                + footer
+            )
+            kb = nav_keyboard("payments", page, len(pages))
+            await show_page(chat_id, text, kb, message)
 
         except Exception as e:
             logging.error(f"❌ Ошибка отправки страницы платежей: {e}", exc_info=True)
@@ -258,12 +330,221 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
             if not is_admin(message.from_user.id):
                 return
 
-            payments = db.get_payments(offset=0, limit=1000)
+            payments = await asyncio.to_thread(db.get_payments, offset=0, limit=1000)
             await send_payments_page(message.chat.id, 0, payments)
         except Exception as e:
             logging.error(f"❌ Ошибка в admin_payments: {e}", exc_info=True)
             await message.answer("⚠️ Ошибка получения истории оплат.")
 
+    # -------------------- Массовое продление --------------------
+    @dp.message_handler(commands=["admin_extend"])
+    async def admin_extend(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            parts = message.text.split(maxsplit=3)
+            if len(parts) < 3 or parts[1] not in SEGMENTS or not parts[2].isdigit():
+                await message.answer(
+                    "Использование: /admin_extend <сегмент> <дни> [комментарий]\n"
+                    f"Сегменты: {', '.join(SEGMENTS)}\n"
+                    "Продлеваются только активные месячные подписки."
+                )
+                return
+
+            segment, days = parts[1], int(parts[2])
+            if not 1 <= days <= 365:
+                await message.answer("⚠️ Количество дней: от 1 до 365.")
+                return
+
+            count = await asyncio.to_thread(
+                db.extend_subscriptions,
+                segment,
+                days,
+                message.from_user.id,
+                parts[3] if len(parts) > 3 else None,
+                message.message_id,
+            )
+            logging.info(
+                f"⏩ Админ {message.from_user.id} продлил {count} подписок ({segment}) на {days} дн."
+            )
+            await message.answer(f"✅ Продлено подписок: {count} (+{days} дн.)")
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_extend: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось продлить подписки.")
+
+    def format_users(user_ids, limit=20):
+        shown = ", ".join(map(str, user_ids[:limit]))
+        return shown + (
+            f" и ещё {len(user_ids) - limit}" if len(user_ids) > limit else ""
+        )
+
+    @dp.message_handler(commands=["admin_rebuild_subscriptions"])
+    async def admin_rebuild_subscriptions(message: types.Message):
+        """Сначала сверка с журналом; применить — той же командой с кодом сверки"""
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            parts = message.text.split()
+            token = parts[1] if len(parts) > 1 else None
+            diff = await asyncio.to_thread(db.rebuild_subscriptions, token=token)
+            fixes = len(diff["changed"]) + len(diff["missing"])
+
+            if diff["applied"]:
+                logging.info(
+                    f"🔄 Админ {message.from_user.id} пересобрал подписки из журнала: "
+                    f"{fixes} исправлено"
+                )
+                # Полный доступ и доступ к материалам в памяти — по новым строкам
+                await asyncio.to_thread(reload_access)
+                await message.answer(
+                    f"✅ Подписки исправлены по журналу событий: {fixes}\n"
+                    f"без событий (не тронуты): {len(diff['orphaned'])}"
+                )
+                return
+
+            lines = []
+            if token:
+                lines.append(
+                    "⚠️ С момента сверки расхождения изменились — ничего не применено.\n"
+                )
+            lines.append("🔍 Сверка подписок с журналом событий:")
+            if diff["changed"]:
+                lines.append(
+                    f"отличаются ({len(diff['changed'])}): {format_users(diff['changed'])}"
+                )
+            if diff["missing"]:
+                lines.append(
+                    f"нет в подписках ({len(diff['missing'])}): {format_users(diff['missing'])}"
+                )
+            if diff["orphaned"]:
+                lines.append(
+                    f"без событий, не тронем ({len(diff['orphaned'])}): "
+                    f"{format_users(diff['orphaned'])}"
+                )
+            if fixes:
+                lines.append(
+                    f"\nПрименить: /admin_rebuild_subscriptions {diff['token']}"
+                )
+            else:
+                lines.append("✅ Исправлять нечего.")
+            await message.answer(fit_message("\n".join(lines)))
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_rebuild_subscriptions: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось пересобрать подписки.")
+
+    # -------------------- Рассылки --------------------
+    @dp.message_handler(commands=["broadcast"])
+    async def admin_broadcast(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            # html_text сохраняет форматирование исходного сообщения
+            parts = message.html_text.split(maxsplit=2)
+            if len(parts) < 3 or parts[1] not in SEGMENTS:
+                await message.answer(
+                    "Использование: /broadcast <сегмент> <текст>\n"
+                    f"Сегменты: {', '.join(SEGMENTS)}"
+                )
+                return
+
+            job_id = await broadcaster.start(
+                parts[1], parts[2], message.chat.id, message.message_id
+            )
+            logging.info(
+                f"📣 Админ {message.from_user.id} запустил рассылку #{job_id} ({parts[1]})"
+            )
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_broadcast: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось запустить рассылку.")
+
+    @dp.message_handler(commands=["broadcast_status", "broadcast_cancel"])
+    async def admin_broadcast_control(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            parts = message.text.split()
+            if len(parts) < 2 or not parts[1].isdigit():
+                await message.answer(f"Укажи ID рассылки: {parts[0]} <id>")
+                return
+
+            job_id = int(parts[1])
+            if parts[0].startswith("/broadcast_cancel"):
+                if broadcaster.cancel(job_id):
+                    await message.answer(f"⛔ Рассылка #{job_id} будет остановлена.")
+                else:
+                    await message.answer(f"Рассылка #{job_id} сейчас не выполняется.")
+                return
+
+            job = await asyncio.to_thread(db.get_broadcast, job_id)
+            if not job:
+                await message.answer("Рассылка не найдена.")
+                return
+            await message.answer(format_progress(job))
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_broadcast_control: {e}", exc_info=True)
+            await message.answer("⚠️ Ошибка получения статуса рассылки.")
+
+    # -------------------- Тарифы --------------------
+    def format_plans():
+        lines = ["💳 Тарифы:"]
+        for plan in catalog.plans.values():
+            kind = "полный доступ" if plan.full_access else f"{plan.months} мес."
+            state = "✅" if plan.active else "⛔"
+            lines.append(
+                f"{state} {plan.code}: {plan.title} ({kind}) — {plan.price_text}"
+            )
+        return "\n".join(lines)
+
+    @dp.message_handler(commands=["admin_plans"])
+    async def admin_plans(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+            await message.answer(format_plans())
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_plans: {e}", exc_info=True)
+            await message.answer("⚠️ Ошибка получения тарифов.")
+
+    @dp.message_handler(commands=["admin_reload_plans"])
+    async def admin_reload_plans(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+            catalog.load()
+            await message.answer("✅ Каталог перезагружен.\n\n" + format_plans())
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_reload_plans: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось перезагрузить тарифы.")
+
+    # -------------------- Метрики --------------------
+    @dp.message_handler(commands=["admin_metrics"])
+    async def admin_metrics(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            # Счётчики сегментов — одно чтение по ключу, снимаем прямо перед отчётом
+            counts = await asyncio.to_thread(db.get_segment_counts)
+            for segment, count in (counts or {}).items():
+                metrics.set(f"subscribers.{db.tenant_id}.{segment}", count)
+
+            parts = message.text.split()
+            report = metrics.render(prefix=parts[1] if len(parts) > 1 else "")
+
+            if len(report) > 4000:
+                await message.answer_document(
+                    types.InputFile(io.BytesIO(report.encode()), filename="metrics.txt")
+                )
+            else:
+                await message.answer(report)
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_metrics: {e}", exc_info=True)
+            await message.answer("⚠️ Ошибка получения метрик.")
+
     # -------------------- Callback постранично --------------------
     @dp.callback_query_handler(lambda c: "_page_" in c.data)
     async def page_callback(call: types.CallbackQuery):
@@ -272,6 +553,8 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
                 return
 
             data = call.data
+            # Сразу гасим «часики» на кнопке — страница придёт правкой сообщения
+            await call.answer()
 
             # Пользователи
             if any(
@@ -281,6 +564,8 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
                     "active_users",
                     "full_users",
                     "expired_users",
+                    "not_joined_users",
+                    "unknown_channel_users",
                 ]
             ):
                 title, _, page_str = data.rpartition("_page_")
@@ -288,39 +573,43 @@ def register_admin_handlers(dp, db, support_user_id, dev_user_id, bot):
                 try:
                     page = int(page_str)
                 except ValueError:
-                    await call.answer("⚠️ Ошибка: неверный номер страницы")
                     return
 
                 if title == "all_users":
-                    users = db.get_all_users()
+                    users = await asyncio.to_thread(db.get_all_users)
                 elif title == "active_users":
-                    users = db.get_active_users()
+                    users = await asyncio.to_thread(db.get_active_users)
                 elif title == "full_users":
-                    users = db.get_full_access_users()
+                    users = await asyncio.to_thread(db.get_full_access_users)
+                elif title == "not_joined_users":
+                    users = await asyncio.to_thread(db.get_not_joined_users)
+                elif title == "unknown_channel_users":
+                    users = await asyncio.to_thread(db.get_unknown_channel_users)
                 else:
-                    users = db.get_expired_users()
+                    users = await asyncio.to_thread(db.get_expired_users)
 
-                await call.message.delete()
-                await send_users_page(call.message.chat.id, page, users, title=title)
+                await send_users_page(
+                    call.message.chat.id, page, users, title=title, message=call.message
+                )
 
             # Платежи
             elif data.startswith("payments_page_"):
                 parts = data.split("_")
 
                 if len(parts) < 3:
-                    await call.answer("⚠️ Ошибка: неверный формат")
                     return
 
                 try:
                     page = int(parts[-1])
                 except ValueError:
-                    await call.answer("⚠️ Ошибка: неверный номер страницы")
                     return
 
-                payments = db.get_payments(offset=0, limit=1000)
-                await call.message.delete()
-                await send_payments_page(call.message.chat.id, page, payments)
+                payments = await asyncio.to_thread(
+                    db.get_payments, offset=0, limit=1000
+                )
+                await send_payments_page(
+                    call.message.chat.id, page, payments, message=call.message
+                )
 
         except Exception as e:
             logging.error(f"❌ Ошибка в page_callback: {e}", exc_info=True)
-            await call.answer("⚠️ Произошла ошибка", show_alert=True)
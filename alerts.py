@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from helpers import fit_message
+from lifecycle import lifecycle
+from metrics import metrics
+
+ALERT_WINDOW = int(os.getenv("ALERT_WINDOW", "300"))  # сек. — период сводки
+ALERT_MAX_PER_HOUR = int(os.getenv("ALERT_MAX_PER_HOUR", "20"))
+# Ошибка, не встречавшаяся столько времени, снова считается новой
+ALERT_ESCALATE_AFTER = 6 * 3600
+ALERT_SAMPLES = 5  # примеров (user_id и т.п.) на ошибку в сводке
+
+
+class Alerter:
+    """
+    Уведомления админа об ошибках без лавины сообщений.
+
+    Ошибки группируются по отпечатку (источник + тип исключения). Новый
+    отпечаток сообщается сразу, повторы копятся и раз в window секунд уходят
+    одной сводкой: сколько раз и на ком. Всего не больше max_per_hour
+    сообщений в час; что не отправлено, переносится в следующую сводку.
+    """
+
+    def __init__(
+        self,
+        bot,
+        chat_id,
+        name="",
+        window=ALERT_WINDOW,
+        max_per_hour=ALERT_MAX_PER_HOUR,
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.name = name
+        self.window = window
+        self.max_per_hour = max_per_hour
+        self.pending = {}  # отпечаток → [сколько, примеры, последняя ошибка]
+        self.last_seen = {}  # отпечаток → когда встречался (monotonic)
+        self._sent = deque()  # время отправленных сообщений за последний час
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = lifecycle.spawn(self._run(), name=f"alerts:{self.name}")
+
+    def report(self, source, error, sample=None):
+        """Учесть ошибку; отправка — сразу (если она новая) или в сводке"""
+        fingerprint = f"{source} / {type(error).__name__}"
+        metrics.inc("alerts.reported")
+
+        now = time.monotonic()
+        last = self.last_seen.get(fingerprint)
+        self.last_seen[fingerprint] = now
+        # При остановке — сразу в сводку: её отправит последний flush()
+        new = last is None or now - last > ALERT_ESCALATE_AFTER
+        if new and not lifecycle.stopping.is_set():
+            lifecycle.spawn(
+                self._escalate(fingerprint, error, sample),
+                name=f"alerts:{self.name}:escalate",
+            )
+        else:
+            self._add(fingerprint, error, sample)
+
+    def _add(self, fingerprint, error, sample):
+        entry = self.pending.setdefault(fingerprint, [0, [], ""])
+        entry[0] += 1
+        if sample is not None and len(entry[1]) < ALERT_SAMPLES:
+            entry[1].append(sample)
+        entry[2] = str(error)
+
+    async def _escalate(self, fingerprint, error, sample):
+        metrics.inc("alerts.escalated")
+        text = f"🚨 Новая ошибка{self._club()}: {fingerprint}\n"
+        if sample is not None:
+            text += f"Пример: {sample}\n"
+        text += f"{error}"
+        try:
+            sent = await self._send(text)
+        except asyncio.CancelledError:
+            self._add(fingerprint, error, sample)  # отменили при остановке — в сводку
+            raise
+        if not sent:
+            self._add(fingerprint, error, sample)  # попадёт в ближайшую сводку
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"❌ Ошибка отправки сводки ошибок: {e}", exc_info=True)
+
+    async def flush(self):
+        """Отправить сводку накопленного (если лимит позволяет)"""
+        if not self.pending:
+            return
+        # Ошибки, пришедшие во время отправки, копятся уже в новой сводке
+        pending, self.pending = self.pending, {}
+
+        lines = [f"📟 Сводка ошибок{self._club()} за {self.window // 60} мин:"]
+        for fingerprint, (count, samples, last_error) in sorted(
+            pending.items(), key=lambda item: -item[1][0]
+        ):
+            line = f"• {fingerprint} — {count} раз"
+            if samples:
+                line += f", напр. {', '.join(map(str, samples))}"
+            lines.append(f"{line}\n  {last_error[:200]}")
+
+        if not await self._send("\n".join(lines)):
+            for fingerprint, (count, samples, last_error) in pending.items():
+                entry = self.pending.setdefault(fingerprint, [0, [], last_error])
+                entry[0] += count
+                entry[1] = (samples + entry[1])[:ALERT_SAMPLES]
+
+    async def _send(self, text):
+        """Отправить с учётом лимита в час; False — лимит исчерпан или ошибка"""
+        now = time.monotonic()
+        while self._sent and now - self._sent[0] > 3600:
+            self._sent.popleft()
+        if len(self._sent) >= self.max_per_hour:
+            metrics.inc("alerts.suppressed")
+            return False
+
+        self._sent.append(now)
+        try:
+            await self.bot.send_message(self.chat_id, fit_message(text))
+            metrics.inc("alerts.sent")
+            return True
+        except Exception as e:
+            logging.error(f"❌ Не удалось отправить уведомление админу: {e}")
+            return False
+
+    def _club(self):
+        return f" ({self.name})" if self.name else ""
@@ -0,0 +1,204 @@
+import os
+import hmac
+import json
+import time
+import asyncio
+import logging
+
+from aiohttp import web
+
+from database import SEGMENTS
+from metrics import metrics
+
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+ADMIN_API_HOST = os.getenv("ADMIN_API_HOST", "127.0.0.1")
+ADMIN_API_PORT = int(os.getenv("ADMIN_API_PORT", "8080"))
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10000
+CHUNK_SIZE = 500  # строк за одно обращение к БД при потоковой отдаче
+
+# Отличает ETag разных запусков: счётчик записей после рестарта начинается заново
+BOOT_ID = f"{int(time.time()):x}"
+
+
+def user_json(u):
+    return {
+        "user_id": u.user_id,
+        "username": u.username,
+        "expiry_date": u.expiry_date.isoformat() if u.expiry_date else None,
+        "full_access": u.full_access,
+    }
+
+
+def payment_json(payment_id, p):
+    return {
+        "id": payment_id,
+        "user_id": p.user_id,
+        "amount": p.amount,
+        "currency": p.currency,
+        "payment_date": p.payment_date.isoformat() if p.payment_date else None,
+        "expiry_date": p.expiry_date.isoformat() if p.expiry_date else None,
+        "full_access": p.full_access,
+    }
+
+
+def int_param(request, name, default=None):
+    value = request.query.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} должен быть числом")
+
+
+class AdminApi:
+    """
+    Read-only HTTP API для дашбордов: подписчики, оплаты, сводка по клубу.
+
+    Все ответы помечаются ETag по счётчику записей в БД: пока данные не
+    менялись, повторный запрос с If-None-Match получает 304 без обращения к БД.
+    Списки отдаются потоком, постранично по ключу (курсор next), без OFFSET.
+    """
+
+    def __init__(self, db, tenant_ids, token=ADMIN_API_TOKEN):
+        self.db = db
+        self.views = {tenant_id: db.for_tenant(tenant_id) for tenant_id in tenant_ids}
+        self.token = token
+        self.runner = None
+
+        self.app = web.Application(middlewares=[self._auth])
+        self.app.router.add_get(
+            "/api/{tenant}/subscribers", self.subscribers, name="subscribers"
+        )
+        self.app.router.add_get(
+            "/api/{tenant}/payments", self.payments, name="payments"
+        )
+        self.app.router.add_get("/api/{tenant}/stats", self.stats, name="stats")
+
+    async def start(self, host=ADMIN_API_HOST, port=ADMIN_API_PORT):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logging.info(f"🌐 Admin API слушает http://{host}:{port}/api/")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    # ---------- Общее ----------
+    @web.middleware
+    async def _auth(self, request, handler):
+        header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(header.encode(), f"Bearer {self.token}".encode()):
+            metrics.inc("api.unauthorized")
+            raise web.HTTPUnauthorized(
+                text="нужен заголовок Authorization: Bearer <token>"
+            )
+
+        started = time.monotonic()
+        try:
+            return await handler(request)
+        finally:
+            route = request.match_info.route.name or "unknown"
+            metrics.observe(f"api.{route}", time.monotonic() - started)
+
+    def _tenant(self, request):
+        view = self.views.get(request.match_info["tenant"])
+        if view is None:
+            raise web.HTTPNotFound(text="нет такого клуба")
+        return view
+
+    def _etag(self, request):
+        """ETag текущей версии данных клуба; если он совпал с If-None-Match — сразу 304"""
+        etag = f'"{BOOT_ID}-{self._tenant(request).write_version}"'
+        if etag in request.headers.get("If-None-Match", ""):
+            metrics.inc("api.not_modified")
+            raise web.HTTPNotModified(headers={"ETag": etag})
+        return etag
+
+    @staticmethod
+    def _limit(request):
+        limit = int_param(request, "limit", DEFAULT_LIMIT)
+        if not 1 <= limit <= MAX_LIMIT:
+            raise web.HTTPBadRequest(text=f"limit должен быть от 1 до {MAX_LIMIT}")
+        return limit
+
+    async def _stream(self, request, etag, fetch, to_json, cursor, limit):
+        """
+        Потоковый JSON {"items": [...], "next": курсор}. fetch(cursor, n) →
+        (строки, новый курсор); строки читаются из БД кусками по CHUNK_SIZE.
+        """
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                "ETag": etag,
+                "Cache-Control": "no-cache",
+            }
+        )
+        await response.prepare(request)
+        await response.write(b'{"items": [')
+
+        sent = 0
+        first = True
+        while sent < limit:
+            size = min(CHUNK_SIZE, limit - sent)
+            rows, next_cursor = await asyncio.to_thread(fetch, cursor, size)
+            if rows:
+                chunk = ",".join(
+                    json.dumps(to_json(row), ensure_ascii=False) for row in rows
+                )
+                await response.write((chunk if first else "," + chunk).encode())
+                first = False
+                sent += len(rows)
+                cursor = next_cursor
+            if len(rows) < size:
+                cursor = None  # дальше данных нет
+                break
+
+        await response.write(f'], "next": {json.dumps(cursor)}}}'.encode())
+        await response.write_eof()
+        metrics.inc("api.rows", sent)
+        return response
+
+    # ---------- Эндпоинты ----------
+    async def subscribers(self, request):
+        """GET /api/{tenant}/subscribers?segment=all&after=<user_id>&limit=100"""
+        db = self._tenant(request)
+        segment = request.query.get("segment", "all")
+        if segment not in SEGMENTS:
+            raise web.HTTPBadRequest(text=f"segment: одно из {', '.join(SEGMENTS)}")
+        after = int_param(request, "after", 0)
+        limit = self._limit(request)
+        etag = self._etag(request)
+
+        def fetch(cursor, size):
+            users = db.get_users_after(segment, cursor, size)
+            return users, users[-1].user_id if users else cursor
+
+        return await self._stream(request, etag, fetch, user_json, after, limit)
+
+    async def payments(self, request):
+        """GET /api/{tenant}/payments?before=<id>&limit=100 — от новых к старым"""
+        db = self._tenant(request)
+        before = int_param(request, "before")
+        limit = self._limit(request)
+        etag = self._etag(request)
+
+        def fetch(cursor, size):
+            rows = db.get_payments_before(cursor, size)
+            return rows, rows[-1][0] if rows else cursor
+
+        return await self._stream(
+            request, etag, fetch, lambda row: payment_json(*row), before, limit
+        )
+
+    async def stats(self, request):
+        """GET /api/{tenant}/stats"""
+        db = self._tenant(request)
+        etag = self._etag(request)
+        stats = await asyncio.to_thread(db.get_stats)
+        return web.json_response(
+            stats, headers={"ETag": etag, "Cache-Control": "no-cache"}
+        )
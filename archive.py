@@ -0,0 +1,31 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from lifecycle import lifecycle
+from metrics import metrics
+
+# Оплаты моложе горизонта — «горячие»: списки и выгрузки читают только их
+PAYMENTS_HOT_DAYS = int(os.getenv("PAYMENTS_HOT_DAYS", "365"))
+ARCHIVE_HOUR = 4  # ночью, когда оплат почти нет
+
+
+async def archive_old_payments(db, hot_days=PAYMENTS_HOT_DAYS):
+    """Раз в сутки переносить оплаты старше hot_days дней в архив"""
+    while True:
+        now = datetime.now()
+        next_run = now.replace(hour=ARCHIVE_HOUR, minute=0, second=0, microsecond=0)
+        if now >= next_run:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+
+        try:
+            async with lifecycle.busy():  # перенос идёт в потоке — ждём его
+                moved = await asyncio.to_thread(
+                    db.archive_payments, datetime.now() - timedelta(days=hot_days)
+                )
+            metrics.inc("archive.payments_moved", moved)
+        except Exception as e:
+            metrics.inc("archive.failures")
+            logging.error(f"❌ Ошибка ночной архивации оплат: {e}", exc_info=True)
@@ -0,0 +1,190 @@
+import os
+import gzip
+import time
+import shutil
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from aiogram import types
+
+from lifecycle import lifecycle
+from metrics import metrics
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "6"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "28"))  # сколько последних копий хранить
+SNAPSHOT_PREFIX = "subscriptions-"
+SNAPSHOT_SUFFIX = ".db.gz"
+
+
+class BackupError(Exception):
+    """Копия не создана или не прошла проверку"""
+
+
+class BackupResult:
+    __slots__ = ("path", "size", "raw_size", "pages", "duration")
+
+    def __init__(self, path, size, raw_size, pages, duration):
+        self.path = path
+        self.size = size
+        self.raw_size = raw_size
+        self.pages = pages
+        self.duration = duration
+
+    def __repr__(self):
+        return f"<BackupResult {self.path.name} {self.size}>"
+
+
+def format_size(size):
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+class BackupManager:
+    """
+    Сжатые копии БД по расписанию и по команде /admin_backup.
+
+    Копия снимается онлайн (Database.backup_to) в отдельном потоке, проверяется
+    PRAGMA integrity_check и только потом сжимается под итоговым именем —
+    в каталоге не бывает недописанных или битых снимков. Старые удаляются.
+    """
+
+    def __init__(
+        self,
+        db,
+        directory=BACKUP_DIR,
+        keep=BACKUP_KEEP,
+        interval_hours=BACKUP_INTERVAL_HOURS,
+    ):
+        self.db = db
+        self.directory = Path(directory)
+        self.keep = keep
+        self.interval = timedelta(hours=interval_hours)
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def snapshots(self):
+        """Снимки от старых к новым (имя содержит время — сортировка по имени)"""
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob(f"{SNAPSHOT_PREFIX}*{SNAPSHOT_SUFFIX}"))
+
+    async def backup(self):
+        """Снять копию; параллельные вызовы ждут друг друга"""
+        async with self._lock:
+            started = time.monotonic()
+            try:
+                path, raw_size, pages = await asyncio.to_thread(self._make_snapshot)
+            except Exception:
+                metrics.inc("backup.failures")
+                raise
+            duration = time.monotonic() - started
+
+            result = BackupResult(path, path.stat().st_size, raw_size, pages, duration)
+            metrics.observe("backup.duration", duration)
+            metrics.set("backup.size", result.size)
+            metrics.set("backup.last_success", datetime.now().isoformat())
+            logging.info(
+                f"💾 Резервная копия {path.name}: {format_size(result.size)} "
+                f"(БД {format_size(raw_size)}), {duration:.1f} сек."
+            )
+            return result
+
+    def _make_snapshot(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = SNAPSHOT_PREFIX + datetime.now().strftime("%Y%m%d-%H%M%S")
+        raw = self.directory / f"{name}.db.tmp"
+        part = self.directory / f"{name}{SNAPSHOT_SUFFIX}.part"
+        final = self.directory / f"{name}{SNAPSHOT_SUFFIX}"
+
+        try:
+            pages = self.db.backup_to(str(raw))
+            self._verify(raw)
+            raw_size = raw.stat().st_size
+
+            with open(raw, "rb") as src, gzip.open(part, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            part.replace(final)
+        finally:
+            raw.unlink(missing_ok=True)
+            part.unlink(missing_ok=True)
+
+        self._prune()
+        return final, raw_size, pages
+
+    @staticmethod
+    def _verify(path):
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            conn.close()
+        if result != [("ok",)]:
+            raise BackupError(f"копия не прошла integrity_check: {result[:5]}")
+
+    def _prune(self):
+        snapshots = self.snapshots()
+        for old in snapshots[: max(0, len(snapshots) - self.keep)]:
+            try:
+                old.unlink()
+                logging.info(f"🗑 Удалена старая резервная копия {old.name}")
+            except OSError as e:
+                logging.warning(f"⚠️ Не удалось удалить копию {old.name}: {e}")
+
+    # ---------- Расписание ----------
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = lifecycle.spawn(self._run(), name="backups")
+
+    def _seconds_until_due(self):
+        snapshots = self.snapshots()
+        if not snapshots:
+            return 0
+        last = datetime.fromtimestamp(snapshots[-1].stat().st_mtime)
+        return max(0, (last + self.interval - datetime.now()).total_seconds())
+
+    async def _run(self):
+        logging.info(
+            f"💾 Резервное копирование запущено: каждые {self.interval}, хранится {self.keep}"
+        )
+        while True:
+            try:
+                await asyncio.sleep(self._seconds_until_due())
+                async with lifecycle.busy():  # не бросаем копию на полпути
+                    await self.backup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"❌ Ошибка резервного копирования: {e}", exc_info=True)
+                await asyncio.sleep(600)  # не долбим диск при постоянной ошибке
+
+
+def register_backup_handlers(dp, backups, admin_ids):
+    """Команда /admin_backup — снять копию сейчас"""
+
+    @dp.message_handler(commands=["admin_backup"])
+    async def admin_backup(message: types.Message):
+        try:
+            if message.from_user.id not in admin_ids:
+                return
+
+            await message.answer("💾 Снимаю резервную копию...")
+            result = await backups.backup()
+            await message.answer(
+                f"✅ Резервная копия готова\n"
+                f"━━━━━━━━━━━━━━━\n"
+                f"📄 {result.path.name}\n"
+                f"📦 Размер: {format_size(result.size)} (БД {format_size(result.raw_size)})\n"
+                f"⏱ Время: {result.duration:.1f} сек.\n"
+                f"🔎 Проверка целостности: ok\n"
+                f"🗂 Хранится копий: {len(backups.snapshots())}"
+            )
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_backup: {e}", exc_info=True)
+            await message.answer(f"⚠️ Резервная копия не создана: {e}")
@@ -0,0 +1,113 @@
+"""
+Бенчмарк: задержка чтения под параллельной нагрузкой на запись.
+
+Сравнивает исходную схему (одно соединение, журнал отката DELETE и
+synchronous=FULL — как было раньше) и WAL с пулом читателей.
+
+    python bench_database.py [--users 20000] [--seconds 5] [--readers 4]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from database import Database
+
+
+def fill(db, users):
+    with db._transaction() as conn:
+        conn.executemany(
+            "INSERT INTO subscriptions (user_id, username, expiry_date, full_access, status) "
+            "VALUES (?, ?, '2030-01-01T00:00:00', 0, 'active')",
+            ((uid, f"user{uid}") for uid in range(1, users + 1)),
+        )
+
+
+def writer_loop(db, users, stop, counter):
+    uid = 1
+    while not stop.is_set():
+        db.add_or_update_subscription(uid, f"user{uid}", amount=50000)
+        counter[0] += 1
+        uid = uid % users + 1
+
+
+def reader_loop(db, users, stop, latencies):
+    uid = 1
+    while not stop.is_set():
+        started = time.perf_counter()
+        db.get_expiry(uid)
+        latencies.append(time.perf_counter() - started)
+
+        if uid % 200 == 0:  # время от времени — тяжёлый список, как в админке
+            started = time.perf_counter()
+            db.get_active_users()
+            latencies.append(time.perf_counter() - started)
+        uid = uid % users + 1
+
+
+# Настройки SQLite по умолчанию, с которыми БД работала до WAL
+LEGACY_PRAGMAS = ("PRAGMA journal_mode=DELETE", "PRAGMA synchronous=FULL")
+
+
+def run(readers, users, seconds, threads, legacy=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"), readers=readers)
+        if legacy:
+            for pragma in LEGACY_PRAGMAS:
+                db.db.execute(pragma)
+        fill(db, users)
+
+        stop = threading.Event()
+        writes = [0]
+        latencies = []
+        workers = [threading.Thread(target=writer_loop, args=(db, users, stop, writes))]
+        workers += [
+            threading.Thread(target=reader_loop, args=(db, users, stop, latencies))
+            for _ in range(threads)
+        ]
+        for t in workers:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in workers:
+            t.join()
+        db.close()
+
+    latencies.sort()
+    ms = [x * 1000 for x in latencies]
+    return {
+        "reads": len(ms),
+        "writes": writes[0],
+        "p50": statistics.median(ms),
+        "p99": ms[int(len(ms) * 0.99) - 1],
+        "max": ms[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    # add_or_update_subscription пишет в лог на каждую запись
+    logging.disable(logging.INFO)
+
+    for title, readers, legacy in (
+        ("одно соединение, DELETE", 0, True),
+        ("WAL + пул читателей", args.readers, False),
+    ):
+        r = run(readers, args.users, args.seconds, threads=args.readers, legacy=legacy)
+        print(
+            f"{title:>24}: чтений {r['reads']:>7}, записей {r['writes']:>6} | "
+            f"p50 {r['p50']:.3f} мс, p99 {r['p99']:.3f} мс, max {r['max']:.1f} мс"
+        )
+
+
+if __name__ == "__main__":
+    main()
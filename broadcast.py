@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram.utils import exceptions
+
+from lifecycle import lifecycle
+from ratelimit import RateLimiter
+
+# Telegram допускает ~30 сообщений в секунду разным пользователям
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+CHUNK_SIZE = 200
+PROGRESS_INTERVAL = 5  # секунд между обновлениями сообщения с прогрессом
+
+# Ошибки, после которых повторять отправку пользователю бессмысленно
+UNREACHABLE_ERRORS = (
+    exceptions.BotBlocked,
+    exceptions.ChatNotFound,
+    exceptions.UserDeactivated,
+    exceptions.CantInitiateConversation,
+)
+
+
+def format_progress(job):
+    """Текст с прогрессом рассылки"""
+    counts = job["counts"]
+    done = sum(v for k, v in counts.items() if k not in ("pending", "sending"))
+    status = {
+        "running": "⏳ идёт",
+        "done": "✅ завершена",
+        "cancelled": "⛔ отменена",
+    }.get(job["status"], job["status"])
+
+    return (
+        f"📣 Рассылка #{job['id']} ({job['segment']}) — {status}\n"
+        f"━━━━━━━━━━━━━━━\n"
+        f"📦 Обработано: {done} из {job['total']}\n"
+        f"✅ Доставлено: {counts.get('sent', 0)}\n"
+        f"🚫 Недоступны: {counts.get('blocked', 0)}\n"
+        f"⚠️ Ошибки: {counts.get('failed', 0)}"
+    )
+
+
+class Broadcaster:
+    """
+    Рассылки по сегментам подписчиков.
+
+    Задание и статус каждого получателя хранятся в БД, поэтому после рестарта
+    рассылка продолжается с того же места. Пачка помечается 'sending' до
+    отправки: если процесс упал посреди пачки, эти получатели не получат дубль.
+    """
+
+    def __init__(self, bot, db, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self.db = db
+        self.limiter = RateLimiter(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks = {}
+        self.cancelled = set()
+
+    # ---------- Управление заданиями ----------
+    async def start(self, segment, text, admin_chat_id, source_message_id=None):
+        """Создать рассылку и запустить её в фоне (повтор команды — та же рассылка)"""
+        job_id, created = await asyncio.to_thread(
+            self.db.create_broadcast, segment, text, admin_chat_id, source_message_id
+        )
+        if not created:
+            logging.warning(
+                f"⚠️ Рассылка #{job_id} по сообщению {source_message_id} уже создана — повтор пропущен"
+            )
+            return job_id
+        job = await asyncio.to_thread(self.db.get_broadcast, job_id)
+        msg = await self.bot.send_message(admin_chat_id, format_progress(job))
+        await asyncio.to_thread(
+            self.db.set_broadcast_progress_message,
+            job_id,
+            admin_chat_id,
+            msg.message_id,
+        )
+        self._spawn(job_id)
+        return job_id
+
+    def resume(self):
+        """Продолжить рассылки, прерванные остановкой бота"""
+        for job_id in self.db.get_unfinished_broadcasts():
+            self.db.abandon_sending_recipients(job_id)
+            logging.info(f"📣 Возобновляем рассылку #{job_id}")
+            self._spawn(job_id)
+
+    def cancel(self, job_id):
+        if job_id not in self.tasks:
+            return False
+        self.cancelled.add(job_id)
+        return True
+
+    def _spawn(self, job_id):
+        if job_id not in self.tasks:
+            self.tasks[job_id] = lifecycle.spawn(
+                self._run(job_id), name=f"broadcast:{job_id}"
+            )
+
+    # ---------- Отправка ----------
+    async def _send_one(self, user_id, text):
+        """Отправка одному получателю → (user_id, status, error)"""
+        async with self.semaphore:
+            for _ in range(3):
+                await self.limiter.wait()
+                try:
+                    await self.bot.send_message(user_id, text, parse_mode="HTML")
+                    return user_id, "sent", None
+                except exceptions.RetryAfter as e:
+                    logging.warning(
+                        f"⚠️ Flood control в рассылке: ждём {e.timeout} сек."
+                    )
+                    self.limiter.pause(e.timeout)
+                except UNREACHABLE_ERRORS as e:
+                    return user_id, "blocked", str(e)
+                except Exception as e:
+                    return user_id, "failed", str(e)
+            return user_id, "failed", "flood control"
+
+    async def _run(self, job_id):
+        try:
+            job = await asyncio.to_thread(self.db.get_broadcast, job_id)
+            if not job:
+                return
+
+            last_report = time.monotonic()
+            while job_id not in self.cancelled:
+                user_ids = await asyncio.to_thread(
+                    self.db.get_pending_recipients, job_id, CHUNK_SIZE
+                )
+                if not user_ids:
+                    break
+
+                # Помеченную 'sending' пачку отправляем до конца даже при остановке
+                async with lifecycle.busy():
+                    await asyncio.to_thread(self.db.claim_recipients, job_id, user_ids)
+                    results = await asyncio.gather(
+                        *(self._send_one(uid, job["text"]) for uid in user_ids)
+                    )
+                    await asyncio.to_thread(self.db.finish_recipients, job_id, results)
+
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    await self._report(job_id)
+                    last_report = time.monotonic()
+
+            status = "cancelled" if job_id in self.cancelled else "done"
+            await asyncio.to_thread(self.db.finish_broadcast, job_id, status)
+            await self._report(job_id)
+            logging.info(f"📣 Рассылка #{job_id}: {status}")
+        except Exception as e:
+            logging.error(f"❌ Ошибка выполнения рассылки #{job_id}: {e}", exc_info=True)
+        finally:
+            self.tasks.pop(job_id, None)
+            self.cancelled.discard(job_id)
+
+    async def _report(self, job_id):
+        """Обновить сообщение с прогрессом у администратора"""
+        job = await asyncio.to_thread(self.db.get_broadcast, job_id)
+        if not job or not job["progress_message_id"]:
+            return
+        try:
+            await self.bot.edit_message_text(
+                format_progress(job),
+                chat_id=job["progress_chat_id"],
+                message_id=job["progress_message_id"],
+            )
+        except exceptions.MessageNotModified:
+            pass
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось обновить прогресс рассылки #{job_id}: {e}")
@@ -0,0 +1,111 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+from metrics import metrics
+
+# Сколько последних charge_id держать в памяти для отсева повторов
+RECENT_CHARGES = 10000
+
+# Причина отказа → текст для пользователя (Telegram покажет его в окне оплаты)
+REJECTIONS = {
+    "unknown_plan": "Этот счёт недействителен. Откройте оплату заново из меню.",
+    "inactive_plan": "Этот тариф больше недоступен. Выберите другой в меню.",
+    "price_changed": "Цена изменилась. Откройте оплату заново из меню, чтобы получить новый счёт.",
+    "already_full": "У вас уже есть полный доступ — оплачивать ничего не нужно.",
+}
+
+
+class CheckoutValidator:
+    """
+    Проверка pre_checkout перед списанием денег: тариф из payload, сумма и
+    валюта по текущему каталогу, состояние подписки пользователя.
+
+    Ответ на pre_checkout нужен Telegram в течение 10 секунд, поэтому обычно
+    здесь нет запросов к БД: каталог уже в памяти, а пользователи с полным
+    доступом держатся во множестве, загруженном при старте, пополняемом при
+    оплате и перезагружаемом после пересборки подписок. Отказ «уже есть полный
+    доступ» подтверждается по БД — множество могло устареть, а ошибочный
+    отказ стоит оплаты.
+    """
+
+    def __init__(self, catalog, db):
+        self.catalog = catalog
+        self.db = db
+        self.full_access = set()
+
+    def load(self):
+        self.full_access = {u.user_id for u in self.db.get_full_access_users()}
+        logging.info(
+            f"✅ Проверка оплат клуба {self.db.tenant_id}: полный доступ у {len(self.full_access)}"
+        )
+
+    def grant_full(self, user_id):
+        self.full_access.add(user_id)
+
+    async def check(self, user_id, payload, total_amount, currency):
+        """None — оплату можно принимать, иначе причина отказа (ключ REJECTIONS)"""
+        started = time.perf_counter()
+        reason = self._reason(user_id, payload, total_amount, currency)
+        if reason == "already_full" and not await asyncio.to_thread(
+            self.db.has_full_access, user_id
+        ):
+            metrics.inc("checkout.stale_full_access")
+            self.full_access.discard(user_id)
+            reason = None
+        metrics.observe("checkout.validate", time.perf_counter() - started)
+
+        if reason:
+            metrics.inc(f"checkout.rejected.{reason}")
+            logging.warning(
+                f"⚠️ pre_checkout отклонён для {user_id}: {reason} "
+                f"({payload}, {total_amount} {currency})"
+            )
+        else:
+            metrics.inc("checkout.approved")
+        return reason
+
+    def _reason(self, user_id, payload, total_amount, currency):
+        plan = self.catalog.by_payload(payload)
+        if plan is None:
+            return "unknown_plan"
+        if not plan.active:
+            return "inactive_plan"
+        if total_amount != plan.price or currency != plan.currency:
+            return "price_changed"  # счёт выставлен до смены цены
+        if user_id in self.full_access:
+            return "already_full"
+        return None
+
+
+class RecentCharges:
+    """
+    Недавние charge_id оплат в памяти: повторная доставка successful_payment
+    узнаётся за O(1), без транзакции. Хранится не больше maxlen последних;
+    более старые повторы всё равно отсекает уникальный индекс в БД.
+    """
+
+    def __init__(self, maxlen=RECENT_CHARGES):
+        self.maxlen = maxlen
+        self.order = deque()
+        self.ids = set()
+
+    def load(self, charge_ids):
+        """charge_ids — от новых к старым (как их отдаёт БД)"""
+        for charge_id in reversed(charge_ids):
+            self.add(charge_id)
+
+    def add(self, charge_id):
+        if charge_id in self.ids:
+            return
+        self.order.append(charge_id)
+        self.ids.add(charge_id)
+        if len(self.order) > self.maxlen:
+            self.ids.discard(self.order.popleft())
+
+    def __contains__(self, charge_id):
+        return charge_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
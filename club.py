@@ -0,0 +1,630 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from aiogram import Dispatcher, types
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.utils import exceptions
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from transport import ResilientBot
+from database import REMINDER_STAGES
+from broadcast import Broadcaster
+from ratelimit import ThrottlingMiddleware
+from alerts import Alerter
+from lifecycle import lifecycle
+from metrics import metrics
+from plans import PlanCatalog, default_plans
+from checkout import CheckoutValidator, RecentCharges, REJECTIONS
+from admin import register_admin_handlers
+from support import register_support_handlers
+from backup import register_backup_handlers
+from profiler import register_profiler_handlers
+from materials import MENU_BUTTON, MaterialLibrary, register_material_handlers
+
+# ---------- Меню (одно на все клубы) ----------
+main_menu = ReplyKeyboardMarkup(resize_keyboard=True)
+main_menu.add(
+    KeyboardButton("Текущий статус"),
+    KeyboardButton("ℹ️ О клубе"),
+    KeyboardButton("Поддержка"),
+    KeyboardButton("💳 Доступ на месяц"),
+    KeyboardButton("📚 Полный доступ"),
+    KeyboardButton(MENU_BUTTON),
+)
+
+
+# ---------- FSM поддержки ----------
+class SupportForm(StatesGroup):
+    waiting_for_message = State()
+
+
+class PaymentForm(StatesGroup):
+    waiting_for_email = State()
+
+
+def user_info(user: types.User):
+    return f"{user.id} (@{user.username or user.full_name})"
+
+
+def channel_status(member: types.ChatMember):
+    """Статус участника канала → member / left / kicked"""
+    if member.status == types.ChatMemberStatus.KICKED:
+        return "kicked"
+    if member.is_chat_member() and getattr(member, "is_member", True) is not False:
+        return "member"
+    return "left"
+
+
+# Напоминания о продлении: как часто проверять и сколько брать за раз
+REMINDER_INTERVAL = 600
+REMINDER_BATCH_SIZE = 100
+REMINDER_MAX_DELAY = timedelta(days=1)
+
+
+class Club:
+    """
+    Один книжный клуб: свой бот, канал, каталог тарифов, рассылки и
+    планировщик. БД, outbox-воркер, резервные копии и соединения с Bot API
+    общие для всех клубов процесса — клуб без активности почти ничего не стоит.
+    """
+
+    def __init__(self, config, db, outbox, backups):
+        self.config = config
+        self.tenant_id = config.tenant_id
+        self.db = db.for_tenant(config.tenant_id)
+        self.outbox = outbox
+
+        self.bot = ResilientBot(token=config.bot_token, name=config.tenant_id)
+        # Хранилище FSM у каждого бота своё: ключи в нём — только chat/user
+        self.dp = Dispatcher(self.bot, storage=MemoryStorage())
+        self.dp.middleware.setup(ThrottlingMiddleware(config.admin_ids))
+
+        self.db.seed_plans(default_plans(config.month_price, config.full_price))
+        self.catalog = PlanCatalog(self.db, config.provider_token)
+        self.catalog.load()
+        self.checkout = CheckoutValidator(self.catalog, self.db)
+        self.checkout.load()
+        self.recent_charges = RecentCharges()
+        self.recent_charges.load(
+            self.db.get_recent_charge_ids(self.recent_charges.maxlen)
+        )
+        self.library = MaterialLibrary(self.db, self.bot)
+        self.library.load()
+        self.library.load_access()
+        self.broadcaster = Broadcaster(self.bot, self.db)
+        self.scheduler = None
+        self.reminders = None
+
+        self.alerts = Alerter(self.bot, config.support_user_id, name=self.tenant_id)
+        outbox.add_alerts(self.tenant_id, self.alerts)
+        register_admin_handlers(
+            self.dp,
+            self.db,
+            config.support_user_id,
+            config.dev_user_id,
+            self.bot,
+            self.broadcaster,
+            self.catalog,
+            self.reload_access,
+        )
+        register_support_handlers(self.dp, self.db, self.bot, outbox, config.admin_ids)
+        register_backup_handlers(self.dp, backups, config.admin_ids)
+        register_profiler_handlers(self.dp, config.admin_ids)
+        register_material_handlers(self.dp, self.library, config.admin_ids)
+        register_club_handlers(self)
+
+    def reload_access(self):
+        """Доступы в памяти — заново из БД (после пересборки подписок)"""
+        self.checkout.load()
+        self.library.load_access()
+
+    def start(self):
+        """Фоновые задачи клуба: планировщик подписок, напоминания и прерванные рассылки"""
+        logging.info(f"🌐 Планировщик подписок клуба {self.tenant_id} запущен.")
+        self.scheduler = lifecycle.spawn(
+            check_subscriptions(self), name=f"scheduler:{self.tenant_id}"
+        )
+        self.reminders = lifecycle.spawn(
+            send_reminders(self), name=f"reminders:{self.tenant_id}"
+        )
+        self.alerts.start()
+        self.broadcaster.resume()
+
+    async def stop(self):
+        """После остановки фоновых задач: последняя сводка ошибок и закрытие сессий"""
+        await self.alerts.flush()
+        await self.dp.storage.close()
+        await self.dp.storage.wait_closed()
+        session = await self.bot.get_session()
+        await session.close()
+
+    def __repr__(self):
+        return f"<Club {self.tenant_id}>"
+
+
+def register_club_handlers(club):
+    """Пользовательские обработчики: меню, оплата, поддержка, участники канала"""
+    bot, db, dp = club.bot, club.db, club.dp
+    catalog, outbox, config = club.catalog, club.outbox, club.config
+    checkout, recent_charges = club.checkout, club.recent_charges
+
+    # ---------- Обработка сообщений ----------
+    @dp.message_handler(commands=["start"])
+    async def start_command(message: types.Message):
+        try:
+            logging.info(f"/start от {user_info(message.from_user)}")
+            await message.answer(
+                "👋 Привет! Выберите действие из меню 👇", reply_markup=main_menu
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка в /start для {user_info(message.from_user)}: {e}",
+                exc_info=True,
+            )
+
+    @dp.message_handler()
+    async def any_message(message: types.Message):
+        try:
+            if not message.text:
+                return
+
+            if message.text.startswith("/"):
+                return
+
+            logging.info(f"Сообщение от {user_info(message.from_user)}: {message.text}")
+
+            if message.text == "💳 Доступ на месяц":
+                logging.info(
+                    f"Пользователь {user_info(message.from_user)} открыл оплату месяца"
+                )
+                await message.answer(
+                    "💰 Доступ в книжный клуб (1 месяц = 30 дней).\nВыбери срок и нажми кнопку, чтобы оплатить 👇",
+                    reply_markup=catalog.keyboard(full_access=False),
+                )
+
+            elif message.text == "📚 Полный доступ":
+                logging.info(
+                    f"Пользователь {user_info(message.from_user)} открыл оплату полного доступа"
+                )
+                await message.answer(
+                    "💰 Полный доступ — бессрочно.\nНажми кнопку ниже, чтобы оплатить 👇",
+                    reply_markup=catalog.keyboard(full_access=True),
+                )
+
+            elif message.text == "Текущий статус":
+                logging.info(
+                    f"Пользователь {user_info(message.from_user)} запросил статус подписки"
+                )
+                expiry = await asyncio.to_thread(db.get_expiry, message.from_user.id)
+                full = await asyncio.to_thread(db.has_full_access, message.from_user.id)
+
+                info = "📊 Ваш текущий статус подписки:"
+
+                if full:
+                    info += "\n✅ У вас полный доступ."
+                    await message.answer(info, reply_markup=main_menu)
+
+                elif expiry and expiry > datetime.now():
+                    days_left = (expiry - datetime.now()).days
+                    info += f"\n✅ Ваша подписка активна ещё {days_left} дней."
+                    await message.answer(info, reply_markup=main_menu)
+
+                else:
+                    info += "\n❌ Подписка не активна😟."
+                    await message.answer(info, reply_markup=main_menu)
+
+                    # И только теперь — предложения оплатить
+                    await message.answer(
+                        f"💳 Хочешь продлить? 👇",
+                        reply_markup=catalog.keyboard(full_access=False),
+                    )
+                    await message.answer(
+                        f"📚 Или полный доступ: 👇",
+                        reply_markup=catalog.keyboard(full_access=True),
+                    )
+
+            elif message.text == "ℹ️ О клубе":
+                logging.info(
+                    f"Пользователь {user_info(message.from_user)} открыл информацию о клубе"
+                )
+                await message.answer(
+                    config.about_text, reply_markup=main_menu, parse_mode="Markdown"
+                )
+
+            elif message.text == "Поддержка":
+                logging.info(
+                    f"Пользователь {user_info(message.from_user)} пишет в поддержку"
+                )
+                await message.answer(
+                    "📝 Опишите вашу проблему. Я передам её администратору."
+                )
+                await SupportForm.waiting_for_message.set()
+
+            else:
+                await message.answer(
+                    "Выберите действие из меню 👇", reply_markup=main_menu
+                )
+
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка обработки сообщения от {user_info(message.from_user)}: {e}",
+                exc_info=True,
+            )
+            await message.answer(
+                "⚠️ Произошла ошибка. Попробуйте ещё раз или обратитесь в поддержку."
+            )
+
+    # ---------- Callback оплаты ----------
+    @dp.callback_query_handler(lambda c: catalog.is_buy_callback(c.data))
+    async def process_buy_callback(callback_query: types.CallbackQuery):
+        try:
+            logging.info(
+                f"➡️ Пользователь {callback_query.from_user.id} {callback_query.from_user}: нажал {callback_query.data}"
+            )
+            plan = catalog.by_callback(callback_query.data)
+            if not plan or not plan.active:
+                await callback_query.answer(
+                    "⚠️ Этот тариф больше недоступен. Выберите другой в меню.",
+                    show_alert=True,
+                )
+                return
+
+            # Параметры счёта и чек собраны заранее при загрузке каталога
+            await bot.send_invoice(chat_id=callback_query.from_user.id, **plan.invoice)
+            await callback_query.answer()
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка создания счёта для {callback_query.from_user.id}",
+                exc_info=True,
+            )
+            await callback_query.answer(
+                "⚠️ Не удалось создать счёт. Попробуйте позже.", show_alert=True
+            )
+
+    @dp.pre_checkout_query_handler(lambda q: True)
+    async def pre_checkout(pre_checkout_query: types.PreCheckoutQuery):
+        try:
+            reason = await checkout.check(
+                pre_checkout_query.from_user.id,
+                pre_checkout_query.invoice_payload,
+                pre_checkout_query.total_amount,
+                pre_checkout_query.currency,
+            )
+            if reason:
+                await bot.answer_pre_checkout_query(
+                    pre_checkout_query.id, ok=False, error_message=REJECTIONS[reason]
+                )
+            else:
+                await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка pre_checkout для {pre_checkout_query.from_user.id}: {e}",
+                exc_info=True,
+            )
+
+    @dp.message_handler(content_types=types.ContentType.SUCCESSFUL_PAYMENT)
+    async def successful_payment(message: types.Message):
+        try:
+            pay = message.successful_payment
+            charge_id = pay.telegram_payment_charge_id
+            confirmation = {"user_id": message.from_user.id, "charge_id": charge_id}
+
+            if charge_id in recent_charges:
+                # Повтор уже учтённой оплаты: подписку не продлеваем, а то же
+                # подтверждение (с той же ссылкой) отправляем ещё раз — иначе
+                # пользователь не поймёт, прошла ли оплата
+                metrics.inc("payments.duplicates")
+                requeued = await asyncio.to_thread(
+                    db.requeue_charge_outbox, charge_id, ["payment_confirmed"]
+                )
+                logging.warning(
+                    f"⚠️ Повтор оплаты {charge_id} от {user_info(message.from_user)} — "
+                    + (
+                        "подтверждение отправим ещё раз"
+                        if requeued
+                        else "подтверждение уже в очереди"
+                    )
+                )
+                outbox.wake()
+                return
+
+            plan = catalog.by_payload(pay.invoice_payload)
+            if plan is None:
+                # Деньги уже списаны — выдаём месяц и разбираемся вручную
+                logging.error(f"❌ Неизвестный тариф в оплате: {pay.invoice_payload}")
+
+            # Ссылка и подтверждение пишутся в outbox в одной транзакции с оплатой:
+            # после commit они будут доставлены, даже если Telegram сейчас недоступен
+            expiry = await asyncio.to_thread(
+                db.add_or_update_subscription,
+                message.from_user.id,
+                message.from_user.username,
+                months=plan.months if plan else 1,
+                full_access=plan.full_access if plan else False,
+                amount=pay.total_amount,
+                currency=pay.currency,
+                outbox=[("payment_confirmed", confirmation)],
+                charge_id=charge_id,
+                provider_charge_id=pay.provider_payment_charge_id,
+            )
+            recent_charges.add(charge_id)
+            club.library.grant(message.from_user.id, expiry)
+            outbox.wake()
+            if plan and plan.full_access:
+                checkout.grant_full(message.from_user.id)
+
+            logging.info(
+                f"✅ УСПЕШНАЯ ОПЛАТА | Клуб {club.tenant_id} | User {user_info(message.from_user)} | "
+                f"{pay.total_amount/100} {pay.currency} | Тип: {pay.invoice_payload}"
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка при обработке успешной оплаты {user_info(message.from_user)}",
+                exc_info=True,
+            )
+            club.alerts.report("successful_payment", e, sample=message.from_user.id)
+            await message.answer(
+                "⚠️ Произошла ошибка при регистрации оплаты. Администратор уже уведомлен."
+            )
+
+    # ---------- Доставка событий outbox ----------
+    @outbox.handler("payment_confirmed", club.tenant_id)
+    async def deliver_payment_confirmation(payload):
+        """
+        Одноразовая ссылка в канал и подтверждение оплаты. Ссылка запоминается
+        в событии: повторная отправка (повтор оплаты, сбой send_message)
+        присылает ту же ссылку, а не создаёт новую
+        """
+        invite_link = payload.get("invite_link")
+        if not invite_link:
+            invite = await bot.create_chat_invite_link(
+                chat_id=config.channel_id, member_limit=1
+            )
+            invite_link = invite.invite_link
+            if payload.get("charge_id"):
+                await asyncio.to_thread(
+                    db.set_charge_outbox_value,
+                    "payment_confirmed",
+                    payload["charge_id"],
+                    "invite_link",
+                    invite_link,
+                )
+
+        expiry = payload["expiry"]
+        expiry_text = (
+            datetime.fromisoformat(expiry).strftime("%d.%m.%Y")
+            if expiry
+            else "у вас полный доступ✅"
+        )
+
+        await bot.send_message(
+            payload["user_id"],
+            f"✅ Оплата успешно получена!\n"
+            f"Подписка активна до: {expiry_text}.\n\n"
+            f"Вот ссылка на канал:\n{invite_link}, присоединяйтесь!",
+            reply_markup=main_menu,
+        )
+
+    @outbox.handler("send_message", club.tenant_id)
+    async def deliver_message(payload):
+        await bot.send_message(payload["chat_id"], payload["text"])
+
+    # ---------- Поддержка ----------
+    @dp.message_handler(state=SupportForm.waiting_for_message)
+    async def process_support_message(message: types.Message, state: FSMContext):
+        try:
+            ticket_id = await asyncio.to_thread(
+                db.create_ticket,
+                message.from_user.id,
+                message.from_user.username,
+                message.text,
+                config.admin_ids,
+                message.message_id,
+            )
+            outbox.wake()
+            await message.answer(
+                f"✅ Ваше обращение #{ticket_id} отправлено администратору. "
+                f"Ответ придёт сюда же.",
+                reply_markup=main_menu,
+            )
+            logging.info(
+                f"📩 Обращение #{ticket_id} от {user_info(message.from_user)}: {message.text}"
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка отправки в поддержку от {user_info(message.from_user)}: {e}",
+                exc_info=True,
+            )
+            await message.answer("⚠️ Произошла ошибка. Попробуйте позже.")
+        finally:
+            await state.finish()
+
+    # ---------- Участники канала ----------
+    @dp.chat_member_handler(lambda update: update.chat.id == config.channel_id)
+    async def channel_member_updated(update: types.ChatMemberUpdated):
+        try:
+            user_id = update.new_chat_member.user.id
+            status = channel_status(update.new_chat_member)
+            await asyncio.to_thread(
+                db.set_channel_status, user_id, status, at=update.date
+            )
+            logging.info(f"👥 Канал клуба {club.tenant_id}: {user_id} → {status}")
+        except Exception as e:
+            logging.error(f"❌ Ошибка обработки chat_member: {e}", exc_info=True)
+
+
+async def fetch_channel_status(club, user_id):
+    """Статус пользователя, о котором апдейтов ещё не было — один запрос к API"""
+    try:
+        member = await club.bot.get_chat_member(club.config.channel_id, user_id)
+        status = channel_status(member)
+        await asyncio.to_thread(club.db.set_channel_status, user_id, status)
+        return status
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось получить статус {user_id} в канале: {e}")
+        return "member"  # не знаем — действуем как раньше
+
+
+# ---------- Планировщик подписок ----------
+async def check_subscriptions(club):
+    """Проверка подписок клуба каждый день в 00:01 с безопасной обработкой ошибок"""
+    bot, db, channel_id = club.bot, club.db, club.config.channel_id
+
+    while True:
+        now = datetime.now()
+        # Следующее время запуска: сегодня в 00:01 или завтра
+        next_run = now.replace(hour=0, minute=1, second=0, microsecond=0)
+        if now >= next_run:
+            next_run += timedelta(days=1)
+
+        wait_time = (next_run - now).total_seconds()
+        logging.info(
+            f"⏳ Следующая проверка подписок клуба {club.tenant_id} в {next_run.strftime('%Y-%m-%d %H:%M:%S')} "
+            f"(через {wait_time/60:.1f} минут)"
+        )
+
+        await asyncio.sleep(wait_time)
+
+        try:
+            subscriptions = await asyncio.to_thread(db.get_all_subscriptions)
+            members = await asyncio.to_thread(db.get_channel_statuses)
+
+            for sub in subscriptions:
+                async with lifecycle.busy():
+                    user_id, username = sub.user_id, sub.username
+                    try:
+                        if sub.full_access:
+                            continue  # полный доступ — пропускаем
+
+                        expiry = sub.expiry_date
+                        if not expiry:
+                            continue  # нет даты (или она некорректна) — пропускаем
+
+                        # Подписка истекла (напоминания шлёт send_reminders)
+                        if expiry < datetime.now() and sub.status == "active":
+                            in_channel = members.get(user_id)
+                            if in_channel is None:
+                                in_channel = await fetch_channel_status(club, user_id)
+
+                            if in_channel != "member":
+                                # Не вступал или уже вышел — удалять из канала некого
+                                metrics.inc("scheduler.expired_not_member")
+                                logging.info(
+                                    f"🚫 {user_id} ({username}): подписка истекла, в канале нет ({in_channel})"
+                                )
+                            else:
+                                try:
+                                    await bot.ban_chat_member(channel_id, user_id)
+                                    await bot.unban_chat_member(channel_id, user_id)
+                                    await bot.send_message(
+                                        user_id,
+                                        "🚫 Ваш доступ в книжный клуб истек. Вы сможете вернуться, оплатив по кнопке ниже 👇.",
+                                        reply_markup=club.catalog.keyboard(
+                                            full_access=False
+                                        ),
+                                    )
+                                    logging.info(
+                                        f"🚫 {user_id} удалён из канала за неуплату"
+                                    )
+                                except exceptions.BotBlocked:
+                                    logging.warning(
+                                        f"⚠️ Бот заблокирован пользователем {user_id} ({username})"
+                                    )
+                                except Exception as e:
+                                    logging.error(
+                                        f"❌ Ошибка при удалении {user_id} ({username}) из канала: {e}"
+                                    )
+
+                            await asyncio.to_thread(db.expire_user, user_id)
+
+                    except Exception as e:
+                        logging.error(
+                            f"❌ Ошибка обработки подписки для {user_id} ({username}): {e}",
+                            exc_info=True,
+                        )
+                        continue  # продолжаем цикл по другим пользователям
+
+        except Exception as critical_error:
+            logging.error(
+                f"❌ Критическая ошибка в планировщике подписок клуба {club.tenant_id}: {critical_error}",
+                exc_info=True,
+            )
+            await asyncio.sleep(60)  # подождём минуту и попробуем снова
+
+
+# ---------- Напоминания о продлении ----------
+def reminder_text(stage):
+    days = REMINDER_STAGES[stage]
+    if days > 0:
+        return (
+            "📚 Ваша подписка закончилась вчера — клуб продолжает читать без вас. "
+            "Возвращайтесь, оплатив по кнопке ниже 👇"
+        )
+    return (
+        f"🔔 Ваша подписка заканчивается через {-days} дн.! "
+        f"Чтобы не потерять доступ в клуб, продлите её по кнопке ниже 👇"
+    )
+
+
+async def send_reminders(club):
+    """
+    Отправка созревших напоминаний клуба. Каждый проход — выборка по частичному
+    индексу reminders(due_at), без обхода всех подписок.
+    """
+    bot, db = club.bot, club.db
+
+    while True:
+        try:
+            while True:
+                now = datetime.now()
+                due = await asyncio.to_thread(
+                    db.get_due_reminders, now, REMINDER_BATCH_SIZE
+                )
+                failed = False
+                for user_id, stage, due_at, username, expiry in due:
+                    async with lifecycle.busy():
+                        delivered = False
+                        if due_at and now - due_at > REMINDER_MAX_DELAY:
+                            # Бот долго не работал — «за 7 дней» накануне окончания только путает
+                            metrics.inc("reminders.stale")
+                        else:
+                            try:
+                                await bot.send_message(
+                                    user_id,
+                                    reminder_text(stage),
+                                    reply_markup=club.catalog.keyboard(
+                                        full_access=False
+                                    ),
+                                )
+                                delivered = True
+                                metrics.inc(f"reminders.sent.{stage}")
+                                logging.info(
+                                    f"🔔 Напоминание {stage} отправлено {user_id} ({username})"
+                                )
+                            except exceptions.BotBlocked:
+                                metrics.inc("reminders.blocked")
+                                logging.warning(
+                                    f"⚠️ Бот заблокирован пользователем {user_id} ({username})"
+                                )
+                            except Exception as e:
+                                metrics.inc("reminders.failures")
+                                logging.error(
+                                    f"❌ Ошибка отправки напоминания {stage} {user_id}: {e}"
+                                )
+                                failed = True
+                                continue  # попробуем на следующем проходе
+                        await asyncio.to_thread(
+                            db.mark_reminder_sent, user_id, stage, delivered
+                        )
+
+                if failed or len(due) < REMINDER_BATCH_SIZE:
+                    break
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка отправки напоминаний клуба {club.tenant_id}: {e}",
+                exc_info=True,
+            )
+        await asyncio.sleep(REMINDER_INTERVAL)
@@ -1,55 +1,1266 @@
+import os
+import copy
+import collections
+import json
+import hashlib
+import queue
 import sqlite3
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from pathlib import Path
 
-from helpers import calculate_expiry
+from helpers import calculate_expiry, parse_date
+from models import UserRow, SubscriptionRow, PaymentRow, TicketRow
+
+# Клуб, которому принадлежат данные, записанные до появления нескольких клубов
+DEFAULT_TENANT = "default"
+
+
+# ---------- Схема ----------
+# Все данные разделены по клубам (tenant_id). Ключи составные: один и тот же
+# пользователь Telegram может состоять в нескольких клубах.
+SCHEMA = {
+    # Таблица активных подписок
+    "subscriptions": """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            expiry_date TEXT,
+            full_access INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'active',
+            notified_3days INTEGER DEFAULT 0,
+            PRIMARY KEY (tenant_id, user_id)
+        )
+    """,
+    # Журнал событий подписки — источник истины; subscriptions — его проекция.
+    # Каждое событие хранит состояние подписки после него, поэтому проекция
+    # восстанавливается по последнему событию пользователя
+    "subscription_events": """
+        CREATE TABLE IF NOT EXISTS subscription_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            created_at TEXT,
+            username TEXT,
+            expiry_date TEXT,
+            full_access INTEGER,
+            status TEXT,
+            details TEXT
+        )
+    """,
+    # Расписание напоминаний о продлении (notified_3days больше не используется):
+    # строки пересчитываются при каждой оплате и продлении
+    "reminders": """
+        CREATE TABLE IF NOT EXISTS reminders (
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            due_at TEXT NOT NULL,
+            sent_at TEXT,
+            PRIMARY KEY (tenant_id, user_id, stage)
+        ) WITHOUT ROWID
+    """,
+    # История всех оплат
+    "payments": """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER,
+            amount INTEGER,
+            currency TEXT,
+            payment_date TEXT,
+            expiry_date TEXT,
+            full_access INTEGER DEFAULT 0,
+            charge_id TEXT,
+            provider_charge_id TEXT
+        )
+    """,
+    # Архив оплат старше горизонта: оперативные запросы его не трогают
+    "payments_archive": """
+        CREATE TABLE IF NOT EXISTS payments_archive (
+            id INTEGER PRIMARY KEY,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER,
+            amount INTEGER,
+            currency TEXT,
+            payment_date TEXT,
+            expiry_date TEXT,
+            full_access INTEGER DEFAULT 0,
+            archived_at TEXT,
+            charge_id TEXT,
+            provider_charge_id TEXT
+        )
+    """,
+    # Итоги по архиву (по месяцам) — сводные цифры не читают сам архив
+    "payments_archive_totals": """
+        CREATE TABLE IF NOT EXISTS payments_archive_totals (
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            month TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            payments INTEGER DEFAULT 0,
+            amount INTEGER DEFAULT 0,
+            PRIMARY KEY (tenant_id, month, currency)
+        ) WITHOUT ROWID
+    """,
+    # Рассылки: задание и статус доставки по каждому получателю
+    "broadcast_jobs": """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            segment TEXT,
+            text TEXT,
+            status TEXT DEFAULT 'running',
+            created_by INTEGER,
+            created_at TEXT,
+            finished_at TEXT,
+            total INTEGER DEFAULT 0,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER,
+            source_message_id INTEGER
+        )
+    """,
+    # job_id уже принадлежит одному клубу — tenant_id здесь не нужен
+    "broadcast_recipients": """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER,
+            user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            error TEXT,
+            sent_at TEXT,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+    """,
+    # Outbox: побочные эффекты (сообщения, ссылки) пишутся в той же
+    # транзакции, что и данные, и доставляются фоновым воркером
+    "outbox": """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            kind TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TEXT,
+            last_error TEXT,
+            created_at TEXT,
+            sent_at TEXT,
+            dedupe_key TEXT
+        )
+    """,
+    # Обращения в поддержку и уведомления о них у админов (для ответа reply'ем)
+    "support_tickets": """
+        CREATE TABLE IF NOT EXISTS support_tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER,
+            username TEXT,
+            text TEXT,
+            status TEXT DEFAULT 'open',
+            created_at TEXT,
+            answered_at TEXT,
+            answered_by INTEGER,
+            source_message_id INTEGER
+        )
+    """,
+    # message_id уникален только внутри чата с конкретным ботом
+    "support_ticket_messages": """
+        CREATE TABLE IF NOT EXISTS support_ticket_messages (
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            chat_id INTEGER,
+            message_id INTEGER,
+            ticket_id INTEGER,
+            PRIMARY KEY (tenant_id, chat_id, message_id)
+        ) WITHOUT ROWID
+    """,
+    # Участники канала по апдейтам chat_member: joined / left / kicked
+    "channel_members": """
+        CREATE TABLE IF NOT EXISTS channel_members (
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER NOT NULL,
+            status TEXT,
+            joined_at TEXT,
+            left_at TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (tenant_id, user_id)
+        )
+    """,
+    # Каталог тарифов
+    "plans": """
+        CREATE TABLE IF NOT EXISTS plans (
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            code TEXT NOT NULL,
+            title TEXT,
+            months INTEGER DEFAULT 1,
+            full_access INTEGER DEFAULT 0,
+            price INTEGER,
+            currency TEXT DEFAULT 'RUB',
+            active INTEGER DEFAULT 1,
+            sort_order INTEGER DEFAULT 0,
+            PRIMARY KEY (tenant_id, code)
+        )
+    """,
+    # Материалы клуба: файлы уже лежат в Telegram, храним их file_id.
+    # file_id действует только для загрузившего его бота — отсюда tenant_id
+    "materials": """
+        CREATE TABLE IF NOT EXISTS materials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            book TEXT NOT NULL,
+            chapter TEXT NOT NULL,
+            title TEXT,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            created_at TEXT,
+            created_by INTEGER
+        )
+    """,
+    # Последний обработанный update_id каждого бота: polling продолжает с него
+    "update_offsets": """
+        CREATE TABLE IF NOT EXISTS update_offsets (
+            tenant_id TEXT PRIMARY KEY,
+            update_id INTEGER,
+            updated_at TEXT
+        )
+    """,
+    # Число подписчиков по сегментам и по дням окончания — ведут триггеры
+    "segment_counters": """
+        CREATE TABLE IF NOT EXISTS segment_counters (
+            tenant_id TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, segment)
+        ) WITHOUT ROWID
+    """,
+    # Журнал ручных изменений подписок (массовые продления и т.п.)
+    "subscription_audit": """
+        CREATE TABLE IF NOT EXISTS subscription_audit (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER,
+            action TEXT,
+            old_expiry TEXT,
+            new_expiry TEXT,
+            created_at TEXT,
+            actor_id INTEGER,
+            note TEXT,
+            source_message_id INTEGER
+        )
+    """,
+}
+
+# Колонки, появившиеся позже таблицы: в старые БД добавляются ALTER TABLE
+ADDED_COLUMNS = {
+    "payments": {"charge_id": "TEXT", "provider_charge_id": "TEXT"},
+    "payments_archive": {"charge_id": "TEXT", "provider_charge_id": "TEXT"},
+    "outbox": {"dedupe_key": "TEXT"},
+    # Сообщение, из которого создана запись: повторная доставка обновления
+    # не создаёт вторую рассылку, продление или обращение
+    "broadcast_jobs": {"source_message_id": "INTEGER"},
+    "support_tickets": {"source_message_id": "INTEGER"},
+    "subscription_audit": {"source_message_id": "INTEGER"},
+}
+
+INDEXES = (
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_segment
+    ON subscriptions (tenant_id, status, full_access)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payments_user
+    ON payments (tenant_id, user_id, payment_date)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payments_date
+    ON payments (tenant_id, payment_date)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payments_tenant_id
+    ON payments (tenant_id, id)
+    """,
+    # Повторно доставленный successful_payment не должен продлить подписку дважды
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge
+    ON payments (tenant_id, charge_id) WHERE charge_id IS NOT NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payments_archive_user
+    ON payments_archive (tenant_id, user_id, payment_date)
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_archive_charge
+    ON payments_archive (tenant_id, charge_id) WHERE charge_id IS NOT NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status
+    ON broadcast_recipients (job_id, status)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_outbox_pending
+    ON outbox (next_attempt_at) WHERE status='pending'
+    """,
+    # Одно событие на ключ: повтор оплаты не ставит в очередь второе подтверждение
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_dedupe
+    ON outbox (tenant_id, dedupe_key) WHERE dedupe_key IS NOT NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_support_tickets_open
+    ON support_tickets (tenant_id, created_at) WHERE status='open'
+    """,
+    # Отправщик читает только созревшие неотправленные напоминания
+    """
+    CREATE INDEX IF NOT EXISTS idx_reminders_due
+    ON reminders (tenant_id, due_at) WHERE sent_at IS NULL
+    """,
+    # История пользователя и последнее событие каждого — при пересборке проекции
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscription_events_user
+    ON subscription_events (tenant_id, user_id, id)
+    """,
+    # Один и тот же файл, загруженный повторно, обновляет метки, а не дублируется
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_materials_file
+    ON materials (tenant_id, file_unique_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_materials_tags
+    ON materials (tenant_id, book, chapter)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscription_audit_user
+    ON subscription_audit (tenant_id, user_id)
+    """,
+    # message_id уникален в чате — с админом или подписчиком (created_by, user_id, actor_id)
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_broadcast_jobs_source
+    ON broadcast_jobs (tenant_id, created_by, source_message_id)
+    WHERE source_message_id IS NOT NULL
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_support_tickets_source
+    ON support_tickets (tenant_id, user_id, source_message_id)
+    WHERE source_message_id IS NOT NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscription_audit_source
+    ON subscription_audit (tenant_id, actor_id, source_message_id)
+    WHERE source_message_id IS NOT NULL
+    """,
+)
+
+
+# ---------- SQL ----------
+# Все запросы в одном месте: текст каждого запроса один и тот же при каждом
+# вызове, поэтому sqlite3 берёт подготовленный statement из кэша соединения.
+# Первый параметр почти всех запросов — tenant_id.
+USER_COLUMNS = "user_id, username, expiry_date, full_access"
+TICKET_COLUMNS = (
+    "id, user_id, username, text, status, created_at, answered_at, answered_by"
+)
+
+# Сегменты подписчиков: одни и те же условия для админских списков и рассылок
+SEGMENTS = {
+    "all": "1=1",
+    "active": "status='active' AND full_access=0",
+    "full": "full_access=1",
+    "expired": "status='expired'",
+}
+
+# Этапы напоминаний: этап → сдвиг от даты окончания подписки в днях
+REMINDER_DAYS_BEFORE = os.getenv("REMINDER_DAYS_BEFORE", "7,3,1")
+REMINDER_STAGES = {
+    f"before_{days}d": -days
+    for days in sorted({int(d) for d in REMINDER_DAYS_BEFORE.split(",")}, reverse=True)
+}
+REMINDER_STAGES["expired_1d"] = 1  # «возвращайтесь» на следующий день после окончания
+
+# Этапы как таблица для INSERT ... SELECT (значения — только из REMINDER_STAGES)
+_REMINDER_STAGES_CTE = "stages(stage, shift) AS (VALUES {})".format(
+    ", ".join(
+        f"('{stage}', '{days:+d} days')" for stage, days in REMINDER_STAGES.items()
+    )
+)
+REMINDER_DUE = "strftime('%Y-%m-%dT%H:%M:%f', expiry_date, shift)"
+
+SQL = {
+    "insert_payment": """
+        INSERT INTO payments (tenant_id, user_id, amount, currency, payment_date, expiry_date, full_access, charge_id, provider_charge_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    "recent_charges": """
+        SELECT charge_id FROM payments
+        WHERE tenant_id=? AND charge_id IS NOT NULL
+        ORDER BY id DESC
+        LIMIT ?
+    """,
+    # Старые оплаты уже в архиве — повтор ищем и там
+    "payment_by_charge": """
+        SELECT expiry_date FROM payments WHERE tenant_id=? AND charge_id=?
+        UNION ALL
+        SELECT expiry_date FROM payments_archive WHERE tenant_id=? AND charge_id=?
+        LIMIT 1
+    """,
+    "expiry_date": "SELECT expiry_date FROM subscriptions WHERE tenant_id=? AND user_id=?",
+    "status": "SELECT status FROM subscriptions WHERE tenant_id=? AND user_id=?",
+    "expiry_and_access": """
+        SELECT expiry_date, full_access FROM subscriptions WHERE tenant_id=? AND user_id=?
+    """,
+    "full_access": "SELECT full_access FROM subscriptions WHERE tenant_id=? AND user_id=?",
+    "user_payments": """
+        SELECT user_id, NULL, amount, currency, payment_date, expiry_date, full_access
+        FROM payments WHERE tenant_id=? AND user_id=?
+        ORDER BY payment_date DESC
+    """,
+    "user_payments_full": """
+        SELECT user_id, NULL, amount, currency, payment_date, expiry_date, full_access
+        FROM payments WHERE tenant_id=? AND user_id=?
+        UNION ALL
+        SELECT user_id, NULL, amount, currency, payment_date, expiry_date, full_access
+        FROM payments_archive WHERE tenant_id=? AND user_id=?
+        ORDER BY payment_date DESC
+    """,
+    "all_subscriptions": f"""
+        SELECT {USER_COLUMNS}, status FROM subscriptions
+        WHERE tenant_id=?
+    """,
+    "all_payments_with_users": """
+        SELECT
+            payments.user_id,
+            subscriptions.username,
+            payments.amount,
+            payments.currency,
+            payments.payment_date,
+            payments.expiry_date,
+            payments.full_access
+        FROM payments
+        LEFT JOIN subscriptions
+        ON payments.tenant_id = subscriptions.tenant_id
+        AND payments.user_id = subscriptions.user_id
+        WHERE payments.tenant_id=?
+        ORDER BY payments.payment_date DESC
+    """,
+    "payments_page": """
+        SELECT
+            payments.user_id,
+            subscriptions.username,
+            payments.amount,
+            payments.currency,
+            payments.payment_date,
+            payments.expiry_date,
+            payments.full_access
+        FROM payments
+        LEFT JOIN subscriptions
+        ON payments.tenant_id = subscriptions.tenant_id
+        AND payments.user_id = subscriptions.user_id
+        WHERE payments.tenant_id=?
+        ORDER BY payments.payment_date DESC
+        LIMIT ? OFFSET ?
+    """,
+    "count_payments": "SELECT COUNT(*) FROM payments WHERE tenant_id=?",
+    "payment_totals": """
+        SELECT COALESCE(SUM(payments), 0), COALESCE(SUM(amount), 0) FROM (
+            SELECT COUNT(*) AS payments, SUM(amount) AS amount
+            FROM payments WHERE tenant_id=?
+            UNION ALL
+            SELECT SUM(payments), SUM(amount)
+            FROM payments_archive_totals WHERE tenant_id=?
+        )
+    """,
+    # ----- HTTP API: постранично по ключу, без OFFSET -----
+    "payments_after": """
+        SELECT id, user_id, amount, currency, payment_date, expiry_date, full_access
+        FROM payments WHERE tenant_id=? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    """,
+    # ----- Архив оплат (все клубы сразу, пачками по id) -----
+    "archive_totals": """
+        INSERT INTO payments_archive_totals (tenant_id, month, currency, payments, amount)
+        SELECT tenant_id, substr(payment_date, 1, 7), COALESCE(currency, ''),
+               COUNT(*), COALESCE(SUM(amount), 0)
+        FROM payments WHERE id IN (
+            SELECT id FROM payments WHERE payment_date < ? ORDER BY id LIMIT ?
+        )
+        GROUP BY 1, 2, 3
+        ON CONFLICT(tenant_id, month, currency) DO UPDATE SET
+            payments=payments + excluded.payments,
+            amount=amount + excluded.amount
+    """,
+    "archive_payments": """
+        INSERT INTO payments_archive
+            (id, tenant_id, user_id, amount, currency, payment_date, expiry_date, full_access, archived_at, charge_id, provider_charge_id)
+        SELECT id, tenant_id, user_id, amount, currency, payment_date, expiry_date, full_access, ?, charge_id, provider_charge_id
+        FROM payments WHERE id IN (
+            SELECT id FROM payments WHERE payment_date < ? ORDER BY id LIMIT ?
+        )
+    """,
+    "delete_archived_payments": """
+        DELETE FROM payments WHERE id IN (
+            SELECT id FROM payments WHERE payment_date < ? ORDER BY id LIMIT ?
+        )
+        RETURNING tenant_id
+    """,
+    # ----- Журнал событий подписки -----
+    # Сначала пишется событие: его состояние считается из входных данных (и
+    # прежнего состояния), потом строка subscriptions берётся из события
+    "append_event": """
+        INSERT INTO subscription_events
+            (tenant_id, user_id, kind, created_at, username, expiry_date, full_access, status, details)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    # Событие без новых дат: прежнее состояние, status=NULL — без изменений
+    "log_event": """
+        INSERT INTO subscription_events
+            (tenant_id, user_id, kind, created_at, username, expiry_date, full_access, status, details)
+        SELECT tenant_id, user_id, ?, ?, username, expiry_date, full_access, COALESCE(?, status), ?
+        FROM subscriptions WHERE tenant_id=? AND user_id=?
+    """,
+    "last_event_id": "SELECT COALESCE(MAX(id), 0) FROM subscription_events",
+    # Проекция: события клуба начиная с id — в subscriptions (последнее побеждает)
+    "project_events": """
+        INSERT INTO subscriptions (tenant_id, user_id, username, expiry_date, full_access, status)
+        SELECT tenant_id, user_id, username, expiry_date, full_access, status
+        FROM subscription_events WHERE tenant_id=? AND id >= ?
+        ORDER BY id
+        ON CONFLICT(tenant_id, user_id) DO UPDATE SET
+            username=excluded.username,
+            expiry_date=excluded.expiry_date,
+            full_access=excluded.full_access,
+            status=excluded.status
+    """,
+    # Подписки, которые были до появления журнала (все клубы)
+    "import_events": """
+        INSERT INTO subscription_events
+            (tenant_id, user_id, kind, created_at, username, expiry_date, full_access, status)
+        SELECT tenant_id, user_id, 'imported', ?, username, expiry_date, full_access, status
+        FROM subscriptions
+    """,
+    "user_events": """
+        SELECT kind, created_at, expiry_date, full_access, status, details
+        FROM subscription_events WHERE tenant_id=? AND user_id=?
+        ORDER BY id DESC
+        LIMIT ?
+    """,
+    # Пересборка проекции: последнее событие каждого пользователя клуба —
+    # сначала во временную таблицу писателя, затем сравнение и только разница
+    "create_rebuild": """
+        CREATE TEMP TABLE IF NOT EXISTS subscriptions_rebuild (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            expiry_date TEXT,
+            full_access INTEGER,
+            status TEXT
+        )
+    """,
+    "clear_rebuild": "DELETE FROM temp.subscriptions_rebuild",
+    "stage_rebuild": """
+        INSERT INTO temp.subscriptions_rebuild
+        SELECT user_id, username, expiry_date, full_access, status
+        FROM subscription_events WHERE id IN (
+            SELECT MAX(id) FROM subscription_events WHERE tenant_id=? GROUP BY user_id
+        )
+    """,
+    # Расхождения: user_id, есть ли строка в subscriptions, затем обе версии строки
+    "rebuild_diff": """
+        SELECT r.user_id, s.user_id IS NOT NULL,
+               r.username, r.expiry_date, r.full_access, r.status,
+               s.username, s.expiry_date, s.full_access, s.status
+        FROM temp.subscriptions_rebuild r
+        LEFT JOIN subscriptions s ON s.tenant_id=? AND s.user_id=r.user_id
+        WHERE s.user_id IS NULL
+        OR s.username IS NOT r.username
+        OR s.expiry_date IS NOT r.expiry_date
+        OR s.full_access IS NOT r.full_access
+        OR s.status IS NOT r.status
+        ORDER BY r.user_id
+    """,
+    # Строки без единого события: не трогаем, только сообщаем
+    "rebuild_orphans": """
+        SELECT user_id FROM subscriptions
+        WHERE tenant_id=? AND user_id NOT IN (SELECT user_id FROM temp.subscriptions_rebuild)
+        ORDER BY user_id
+    """,
+    "apply_rebuild": """
+        INSERT INTO subscriptions (tenant_id, user_id, username, expiry_date, full_access, status)
+        SELECT ?, user_id, username, expiry_date, full_access, status
+        FROM temp.subscriptions_rebuild WHERE true
+        ON CONFLICT(tenant_id, user_id) DO UPDATE SET
+            username=excluded.username,
+            expiry_date=excluded.expiry_date,
+            full_access=excluded.full_access,
+            status=excluded.status
+        WHERE subscriptions.username IS NOT excluded.username
+        OR subscriptions.expiry_date IS NOT excluded.expiry_date
+        OR subscriptions.full_access IS NOT excluded.full_access
+        OR subscriptions.status IS NOT excluded.status
+    """,
+    # ----- Напоминания о продлении -----
+    # Старое расписание пользователя удаляется, новое строится от expiry_date;
+    # этапы, срок которых уже прошёл, не создаются
+    "clear_reminders": "DELETE FROM reminders WHERE tenant_id=? AND user_id=?",
+    "schedule_reminders": f"""
+        WITH {_REMINDER_STAGES_CTE}
+        INSERT INTO reminders (tenant_id, user_id, stage, due_at)
+        SELECT tenant_id, user_id, stage, {REMINDER_DUE}
+        FROM subscriptions, stages
+        WHERE tenant_id=? AND user_id=? AND full_access=0
+        AND expiry_date IS NOT NULL AND {REMINDER_DUE} > ?
+    """,
+    # Подписчики, которые были до появления таблицы reminders (все клубы)
+    "backfill_reminders": f"""
+        WITH {_REMINDER_STAGES_CTE}
+        INSERT OR IGNORE INTO reminders (tenant_id, user_id, stage, due_at)
+        SELECT tenant_id, user_id, stage, {REMINDER_DUE}
+        FROM subscriptions, stages
+        WHERE status='active' AND full_access=0
+        AND expiry_date IS NOT NULL AND {REMINDER_DUE} > ?
+    """,
+    # Этапы, срок которых к моменту backfill уже прошёл: их не создаём, только считаем
+    "skipped_reminders": f"""
+        WITH {_REMINDER_STAGES_CTE}
+        SELECT COUNT(*) FROM subscriptions, stages
+        WHERE status='active' AND full_access=0
+        AND expiry_date IS NOT NULL AND {REMINDER_DUE} <= ?
+    """,
+    "due_reminders": """
+        SELECT r.user_id, r.stage, r.due_at, s.username, s.expiry_date
+        FROM reminders r
+        JOIN subscriptions s ON s.tenant_id = r.tenant_id AND s.user_id = r.user_id
+        WHERE r.tenant_id=? AND r.sent_at IS NULL AND r.due_at <= ?
+        ORDER BY r.due_at
+        LIMIT ?
+    """,
+    "reminder_sent": """
+        UPDATE reminders SET sent_at=? WHERE tenant_id=? AND user_id=? AND stage=?
+    """,
+    # ----- Polling -----
+    "get_update_offset": "SELECT update_id FROM update_offsets WHERE tenant_id=?",
+    "set_update_offset": """
+        INSERT INTO update_offsets (tenant_id, update_id, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(tenant_id) DO UPDATE SET
+            update_id=excluded.update_id,
+            updated_at=excluded.updated_at
+    """,
+    "get_user": f"SELECT {USER_COLUMNS} FROM subscriptions WHERE tenant_id=? AND user_id=?",
+    # Продление, уже выполненное по этому сообщению админа: число продлённых
+    "audit_by_source": """
+        SELECT COUNT(*) FROM subscription_audit
+        WHERE tenant_id=? AND actor_id=? AND source_message_id=?
+    """,
+    # ----- Рассылки -----
+    "create_broadcast": """
+        INSERT INTO broadcast_jobs (tenant_id, segment, text, created_by, created_at, source_message_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    "broadcast_by_source": """
+        SELECT id FROM broadcast_jobs
+        WHERE tenant_id=? AND created_by=? AND source_message_id=?
+    """,
+    "set_broadcast_total": """
+        UPDATE broadcast_jobs SET total=(
+            SELECT COUNT(*) FROM broadcast_recipients WHERE job_id=?
+        ) WHERE id=?
+    """,
+    "set_broadcast_progress_message": """
+        UPDATE broadcast_jobs SET progress_chat_id=?, progress_message_id=? WHERE id=?
+    """,
+    "get_broadcast": """
+        SELECT id, segment, text, status, created_by, created_at, finished_at,
+               total, progress_chat_id, progress_message_id
+        FROM broadcast_jobs WHERE tenant_id=? AND id=?
+    """,
+    "unfinished_broadcasts": """
+        SELECT id FROM broadcast_jobs WHERE tenant_id=? AND status='running'
+    """,
+    "broadcast_counts": """
+        SELECT status, COUNT(*) FROM broadcast_recipients
+        WHERE job_id=? GROUP BY status
+    """,
+    "pending_recipients": """
+        SELECT user_id FROM broadcast_recipients
+        WHERE job_id=? AND status='pending'
+        LIMIT ?
+    """,
+    "claim_recipient": """
+        UPDATE broadcast_recipients SET status='sending'
+        WHERE job_id=? AND user_id=?
+    """,
+    "finish_recipient": """
+        UPDATE broadcast_recipients SET status=?, error=?, sent_at=?
+        WHERE job_id=? AND user_id=?
+    """,
+    "abandon_sending_recipients": """
+        UPDATE broadcast_recipients SET status='failed', error='прервано перезапуском'
+        WHERE job_id=? AND status='sending'
+    """,
+    "finish_broadcast": "UPDATE broadcast_jobs SET status=?, finished_at=? WHERE id=?",
+    # ----- Outbox (общий для всех клубов) -----
+    "enqueue_outbox": """
+        INSERT INTO outbox (tenant_id, kind, payload, created_at, next_attempt_at, dedupe_key)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (tenant_id, dedupe_key) WHERE dedupe_key IS NOT NULL DO NOTHING
+    """,
+    # Событие с тем же ключом — снова в очередь (отправленное или недоставленное);
+    # ожидающее и так будет доставлено
+    "requeue_outbox": """
+        UPDATE outbox SET status='pending', attempts=0, next_attempt_at=?, last_error=NULL
+        WHERE tenant_id=? AND dedupe_key=? AND status != 'pending'
+    """,
+    # Выданное при доставке значение (ссылка-приглашение) — в payload события,
+    # чтобы повторная отправка использовала его же
+    "set_outbox_value": """
+        UPDATE outbox SET payload=json_set(payload, '$.' || ?, ?)
+        WHERE tenant_id=? AND dedupe_key=?
+    """,
+    "due_outbox": """
+        SELECT id, tenant_id, kind, payload, attempts FROM outbox
+        WHERE status='pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at
+        LIMIT ?
+    """,
+    "outbox_sent": "UPDATE outbox SET status='sent', sent_at=?, attempts=attempts+1 WHERE id=?",
+    "outbox_retry": """
+        UPDATE outbox SET attempts=attempts+1, next_attempt_at=?, last_error=?
+        WHERE id=?
+    """,
+    "outbox_dead": """
+        UPDATE outbox SET status='dead', attempts=attempts+1, last_error=?
+        WHERE id=?
+    """,
+    # ----- Поддержка -----
+    "create_ticket": """
+        INSERT INTO support_tickets (tenant_id, user_id, username, text, created_at, source_message_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    "ticket_by_source": """
+        SELECT id FROM support_tickets
+        WHERE tenant_id=? AND user_id=? AND source_message_id=?
+    """,
+    "get_ticket": f"""
+        SELECT {TICKET_COLUMNS} FROM support_tickets WHERE tenant_id=? AND id=?
+    """,
+    "ticket_by_message": f"""
+        SELECT {TICKET_COLUMNS} FROM support_tickets
+        WHERE id=(
+            SELECT ticket_id FROM support_ticket_messages
+            WHERE tenant_id=? AND chat_id=? AND message_id=?
+        )
+    """,
+    "link_ticket_message": """
+        INSERT OR IGNORE INTO support_ticket_messages (tenant_id, chat_id, message_id, ticket_id)
+        VALUES (?, ?, ?, ?)
+    """,
+    "answer_ticket": """
+        UPDATE support_tickets SET status='answered', answered_at=?, answered_by=?
+        WHERE id=?
+    """,
+    "close_ticket": """
+        UPDATE support_tickets SET status='closed'
+        WHERE tenant_id=? AND id=? AND status='open'
+    """,
+    "open_tickets": f"""
+        SELECT {TICKET_COLUMNS} FROM support_tickets
+        WHERE tenant_id=? AND status='open'
+        ORDER BY created_at
+        LIMIT ?
+    """,
+    "count_open_tickets": """
+        SELECT COUNT(*) FROM support_tickets WHERE tenant_id=? AND status='open'
+    """,
+    # ----- Участники канала -----
+    "set_channel_status": """
+        INSERT INTO channel_members (tenant_id, user_id, status, joined_at, left_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(tenant_id, user_id) DO UPDATE SET
+            status=excluded.status,
+            joined_at=COALESCE(excluded.joined_at, channel_members.joined_at),
+            left_at=COALESCE(excluded.left_at, channel_members.left_at),
+            updated_at=excluded.updated_at
+    """,
+    "channel_statuses": "SELECT user_id, status FROM channel_members WHERE tenant_id=?",
+    # ----- Тарифы -----
+    "seed_plan": """
+        INSERT OR IGNORE INTO plans (tenant_id, code, title, months, full_access, price, sort_order)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    "get_plans": """
+        SELECT code, title, months, full_access, price, currency, active
+        FROM plans WHERE tenant_id=? ORDER BY sort_order, code
+    """,
+    # ----- Материалы клуба -----
+    "add_material": """
+        INSERT INTO materials (tenant_id, book, chapter, title, kind, file_id, file_unique_id, created_at, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (tenant_id, file_unique_id) DO UPDATE SET
+            book=excluded.book,
+            chapter=excluded.chapter,
+            title=excluded.title,
+            file_id=excluded.file_id
+        RETURNING id
+    """,
+    "get_materials": """
+        SELECT id, book, chapter, title, kind, file_id
+        FROM materials WHERE tenant_id=?
+        ORDER BY book, chapter, id
+    """,
+    "delete_material": "DELETE FROM materials WHERE tenant_id=? AND id=?",
+    # Статус в канале известен (апдейт chat_member или getChatMember) — и это не member
+    "not_joined_users": """
+        SELECT s.user_id, s.username, s.expiry_date, s.full_access
+        FROM subscriptions s
+        JOIN channel_members c
+        ON c.tenant_id = s.tenant_id AND c.user_id = s.user_id
+        WHERE s.tenant_id=? AND s.status='active' AND c.status != 'member'
+    """,
+    # Апдейтов о пользователе не было: например, вступил до начала отслеживания
+    "unknown_channel_users": """
+        SELECT s.user_id, s.username, s.expiry_date, s.full_access
+        FROM subscriptions s
+        LEFT JOIN channel_members c
+        ON c.tenant_id = s.tenant_id AND c.user_id = s.user_id
+        WHERE s.tenant_id=? AND s.status='active' AND c.user_id IS NULL
+    """,
+}
+
+# Новая дата окончания при массовом продлении (формат совместим с fromisoformat)
+EXTENDED_EXPIRY = "strftime('%Y-%m-%dT%H:%M:%f', expiry_date, ?)"
+
+for _segment, _where in SEGMENTS.items():
+    # Массовое продление: только активные месячные подписки внутри сегмента
+    _extendable = (
+        f"{_where} AND status='active' AND full_access=0 AND expiry_date IS NOT NULL"
+    )
+    SQL.update(
+        {
+            # Списки для админки
+            f"users_{_segment}": f"""
+                SELECT {USER_COLUMNS} FROM subscriptions
+                WHERE tenant_id=? AND {_where}
+            """,
+            f"users_after_{_segment}": f"""
+                SELECT {USER_COLUMNS} FROM subscriptions
+                WHERE tenant_id=? AND user_id > ? AND {_where}
+                ORDER BY user_id
+                LIMIT ?
+            """,
+            # Получатели рассылки берутся теми же условиями, что и списки сегментов
+            f"broadcast_recipients_{_segment}": f"""
+                INSERT INTO broadcast_recipients (job_id, user_id)
+                SELECT ?, user_id FROM subscriptions WHERE tenant_id=? AND {_where}
+            """,
+            f"extend_audit_{_segment}": f"""
+                INSERT INTO subscription_audit
+                    (tenant_id, user_id, action, old_expiry, new_expiry, created_at, actor_id, note, source_message_id)
+                SELECT tenant_id, user_id, 'extend', expiry_date, {EXTENDED_EXPIRY}, ?, ?, ?, ?
+                FROM subscriptions WHERE tenant_id=? AND {_extendable}
+            """,
+            # События продления считаются из прежней даты и числа дней;
+            # subscriptions обновляется из них (project_events)
+            f"extend_events_{_segment}": f"""
+                INSERT INTO subscription_events
+                    (tenant_id, user_id, kind, created_at, username, expiry_date, full_access, status, details)
+                SELECT tenant_id, user_id, 'extended', ?, username, {EXTENDED_EXPIRY}, full_access, status, ?
+                FROM subscriptions WHERE tenant_id=? AND {_extendable}
+            """,
+            # Напоминания продлённых подписок — заново от новой даты окончания
+            f"extend_clear_reminders_{_segment}": f"""
+                DELETE FROM reminders WHERE tenant_id=? AND user_id IN (
+                    SELECT user_id FROM subscriptions WHERE tenant_id=? AND {_extendable}
+                )
+            """,
+            f"extend_reminders_{_segment}": f"""
+                WITH {_REMINDER_STAGES_CTE}
+                INSERT INTO reminders (tenant_id, user_id, stage, due_at)
+                SELECT tenant_id, user_id, stage, {REMINDER_DUE}
+                FROM subscriptions, stages
+                WHERE tenant_id=? AND {_extendable} AND {REMINDER_DUE} > ?
+            """,
+        }
+    )
+
+# ---------- Счётчики сегментов ----------
+# Кроме сегментов — корзины «активна до дня»: expires:YYYY-MM-DD
+EXPIRY_BUCKET_PREFIX = "expires:"
+EXPIRY_BUCKET = f"'{EXPIRY_BUCKET_PREFIX}' || substr(expiry_date, 1, 10)"
+_BUCKETED = f"{SEGMENTS['active']} AND expiry_date IS NOT NULL"
+
+
+def _counter_segments(row):
+    """
+    Сегменты, в которые входит строка row (NEW/OLD триггера), — подзапрос
+    (segment). Колонки строки выставлены под своими именами, поэтому условия
+    берутся из SEGMENTS как есть, без отдельной копии для триггеров.
+    """
+    columns = f"(SELECT {row}.status AS status, {row}.full_access AS full_access, {row}.expiry_date AS expiry_date)"
+    parts = [
+        f"SELECT '{segment}' AS segment FROM {columns} WHERE {where}"
+        for segment, where in SEGMENTS.items()
+    ]
+    parts.append(f"SELECT {EXPIRY_BUCKET} FROM {columns} WHERE {_BUCKETED}")
+    return " UNION ALL ".join(parts)
+
+
+_COUNTERS_ADD = f"""
+    INSERT INTO segment_counters (tenant_id, segment, count)
+    SELECT NEW.tenant_id, segment, 1 FROM ({_counter_segments("NEW")}) WHERE true
+    ON CONFLICT(tenant_id, segment) DO UPDATE SET count=count + 1;
+"""
+_COUNTERS_REMOVE = f"""
+    UPDATE segment_counters SET count=count - 1
+    WHERE tenant_id=OLD.tenant_id AND segment IN ({_counter_segments("OLD")});
+    DELETE FROM segment_counters
+    WHERE tenant_id=OLD.tenant_id AND count=0
+    AND segment IN ({_counter_segments("OLD")});
+"""
+
+# Пересоздаются при каждом запуске — всегда соответствуют текущим SEGMENTS
+TRIGGERS = {
+    "subscriptions_counters_insert": f"""
+        CREATE TRIGGER subscriptions_counters_insert AFTER INSERT ON subscriptions
+        BEGIN {_COUNTERS_ADD} END
+    """,
+    "subscriptions_counters_update": f"""
+        CREATE TRIGGER subscriptions_counters_update
+        AFTER UPDATE OF tenant_id, status, full_access, expiry_date ON subscriptions
+        BEGIN {_COUNTERS_REMOVE} {_COUNTERS_ADD} END
+    """,
+    "subscriptions_counters_delete": f"""
+        CREATE TRIGGER subscriptions_counters_delete AFTER DELETE ON subscriptions
+        BEGIN {_COUNTERS_REMOVE} END
+    """,
+}
+
+SQL.update(
+    {
+        # Полный пересчёт (при запуске, вместе с пересозданием триггеров)
+        "clear_counters": "DELETE FROM segment_counters",
+        "rebuild_counters": "INSERT INTO segment_counters (tenant_id, segment, count) "
+        + " UNION ALL ".join(
+            [
+                f"SELECT tenant_id, '{segment}', COUNT(*) FROM subscriptions "
+                f"WHERE {where} GROUP BY tenant_id"
+                for segment, where in SEGMENTS.items()
+            ]
+            + [
+                f"SELECT tenant_id, {EXPIRY_BUCKET}, COUNT(*) FROM subscriptions "
+                f"WHERE {_BUCKETED} GROUP BY 1, 2"
+            ]
+        ),
+        # Сегменты и корзины дней [from, to] — чтение по первичному ключу
+        "segment_counts": f"""
+            SELECT segment, count FROM segment_counters
+            WHERE tenant_id=? AND (
+                segment IN ({", ".join(f"'{segment}'" for segment in SEGMENTS)})
+                OR segment BETWEEN ? AND ?
+            )
+        """,
+    }
+)
+
+# Небольшой запас сверх набора запросов — под PRAGMA и служебные выражения
+STATEMENT_CACHE_SIZE = len(SQL) + 8
+
+# ---------- Настройки SQLite ----------
+READER_POOL_SIZE = int(os.getenv("DB_READERS", "4"))
+CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))  # кэш страниц на соединение
+MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+BUSY_TIMEOUT_MS = 5000
+
+# Архивация оплат: строк за одну транзакцию
+ARCHIVE_BATCH_SIZE = 2000
+
+# Онлайн-копия: страниц за шаг и пауза для писателей между шагами
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE = 0.005
+
+COMMON_PRAGMAS = (
+    f"PRAGMA cache_size=-{CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size={MMAP_SIZE}",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # В WAL режим NORMAL не теряет целостность, только последние транзакции при сбое ОС
+    "PRAGMA synchronous=NORMAL",
+) + COMMON_PRAGMAS
+
+READER_PRAGMAS = ("PRAGMA query_only=1",) + COMMON_PRAGMAS
 
 
 class Database:
-    def __init__(self, path="subscriptions.db"):
+    """
+    Одно соединение-писатель (под блокировкой) и пул соединений только для
+    чтения. В WAL читатели не ждут писателя: списки для админки и проверки
+    статуса идут через пул, оплаты и изменения подписок — через писателя.
+
+    Экземпляр привязан к одному клубу (tenant_id); for_tenant() возвращает
+    представление другого клуба поверх тех же соединений.
+    """
+
+    def __init__(
+        self,
+        path="subscriptions.db",
+        readers=READER_POOL_SIZE,
+        tenant_id=DEFAULT_TENANT,
+    ):
         try:
-            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.path = path
+            self.tenant_id = tenant_id
+            self.db = self._connect(path, WRITER_PRAGMAS)
             self.cur = self.db.cursor()
+            self._write_lock = threading.RLock()
+            # Версии данных, которые отдаёт API, по клубам; _touched — клубы,
+            # чьи данные меняет текущая транзакция. Общие объекты у всех for_tenant()
+            self._versions = collections.Counter()
+            self._touched = set()
 
-            # Таблица активных подписок
-            self.cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS subscriptions (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    expiry_date TEXT,
-                    full_access INTEGER DEFAULT 0,
-                    status TEXT DEFAULT 'active',
-                    notified_3days INTEGER DEFAULT 0
-                )
-                """
-            )
-
-            # История всех оплат
-            self.cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS payments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount INTEGER,
-                    currency TEXT,
-                    payment_date TEXT,
-                    expiry_date TEXT,
-                    full_access INTEGER DEFAULT 0
-                )
-                """
-            )
+            # Сначала таблицы (со старыми переносим данные), потом индексы:
+            # у переименованной старой таблицы остаются индексы с теми же именами.
+            # Всё одной транзакцией — прерванный перенос откатывается целиком
+            self.cur.execute("BEGIN")
+            try:
+                new_reminders = not self._columns("reminders")
+                new_events = not self._columns("subscription_events")
+                for table, ddl in SCHEMA.items():
+                    self._create_table(table, ddl)
+                for ddl in INDEXES:
+                    self.cur.execute(ddl)
+                self._create_counters()
+                # rowcount у INSERT ... SELECT с WITH равен -1 — считаем по total_changes
+                if new_events:
+                    before = self.db.total_changes
+                    self.cur.execute(
+                        SQL["import_events"], (datetime.now().isoformat(),)
+                    )
+                    logging.info(
+                        f"✅ Журнал событий подписок начат: импортировано "
+                        f"{self.db.total_changes - before}"
+                    )
+                if new_reminders:
+                    now = datetime.now().isoformat()
+                    before = self.db.total_changes
+                    self.cur.execute(SQL["backfill_reminders"], (now,))
+                    created = self.db.total_changes - before
+                    skipped = self.cur.execute(
+                        SQL["skipped_reminders"], (now,)
+                    ).fetchone()[0]
+                    logging.info(f"✅ Расписание напоминаний построено: {created} шт.")
+                    if skipped:
+                        logging.warning(
+                            f"⚠️ Напоминания, срок которых уже прошёл, не созданы "
+                            f"и отправлены не будут: {skipped} шт."
+                        )
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+
+            # Пул читателей (для :memory: у каждого соединения своя БД — читаем через писателя)
+            self._readers = queue.Queue()
+            if path != ":memory:":
+                reader_uri = Path(path).absolute().as_uri() + "?mode=ro"
+                for _ in range(readers):
+                    self._readers.put(
+                        self._connect(reader_uri, READER_PRAGMAS, uri=True)
+                    )
+            self.readers_count = self._readers.qsize()
 
-            self.db.commit()
-            logging.info("✅ База данных инициализирована успешно")
+            logging.info(
+                f"✅ База данных инициализирована успешно (WAL, читателей: {self.readers_count})"
+            )
         except Exception as e:
             logging.error(f"❌ Ошибка инициализации БД: {e}", exc_info=True)
             raise
 
+    def _columns(self, table):
+        return [row[1] for row in self.cur.execute(f"PRAGMA table_info({table})")]
+
+    def _create_table(self, table, ddl):
+        """Создать таблицу; таблицу без tenant_id перестроить, отдав данные клубу по умолчанию"""
+        old_columns = self._columns(table)
+        if not old_columns or "tenant_id" in old_columns or "tenant_id" not in ddl:
+            self.cur.execute(ddl)
+            self._add_columns(table, old_columns)
+            return
+
+        legacy = f"{table}_legacy"
+        self.cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        self.cur.execute(ddl)
+        columns = ", ".join(c for c in self._columns(table) if c in old_columns)
+        self.cur.execute(
+            f"INSERT INTO {table} (tenant_id, {columns}) "
+            f"SELECT ?, {columns} FROM {legacy}",
+            (DEFAULT_TENANT,),
+        )
+        self.cur.execute(f"DROP TABLE {legacy}")
+        logging.info(f"✅ Таблица {table} перенесена в клуб {DEFAULT_TENANT}")
+
+    def _add_columns(self, table, old_columns):
+        if not old_columns:
+            return  # таблица только что создана по актуальной схеме
+        for column, decl in ADDED_COLUMNS.get(table, {}).items():
+            if column not in old_columns:
+                self.cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+                logging.info(f"✅ В таблицу {table} добавлена колонка {column}")
+
+    def _create_counters(self):
+        """Пересоздать триггеры счётчиков и пересчитать счётчики с нуля"""
+        for name, ddl in TRIGGERS.items():
+            self.cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+            self.cur.execute(ddl)
+        self.cur.execute(SQL["clear_counters"])
+        self.cur.execute(SQL["rebuild_counters"])
+
+    def for_tenant(self, tenant_id):
+        """Та же БД (соединения, блокировка, пул), но запросы — от имени другого клуба"""
+        view = copy.copy(self)
+        view.tenant_id = tenant_id
+        return view
+
+    # ---------- Соединения ----------
+    @staticmethod
+    def _connect(path, pragmas, uri=False):
+        conn = sqlite3.connect(
+            path,
+            uri=uri,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in pragmas:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def _reader(self):
+        """Соединение для чтения из пула (или писатель, если пула нет)"""
+        if not self.readers_count:
+            with self._write_lock:
+                yield self.db
+            return
+
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Транзакция на писателе: commit при успехе, rollback при ошибке. После
+        commit увеличивает версии клубов, отмеченных в ней через _touch()
+        """
+        with self._write_lock:
+            try:
+                yield self.db
+                self.db.commit()
+                for tenant_id in self._touched:
+                    self._versions[tenant_id] += 1
+            except Exception:
+                self.db.rollback()
+                raise
+            finally:
+                self._touched.clear()
+
+    def _touch(self, tenant_id=None):
+        """
+        Внутри транзакции: она меняет данные клуба, которые отдаёт API
+        (подписки, оплаты, обращения), — после commit сменится его ETag
+        """
+        self._touched.add(tenant_id or self.tenant_id)
+
+    def close(self):
+        """Закрыть все соединения (общие для всех клубов)"""
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        self.readers_count = 0
+        with self._write_lock:
+            # Переносим WAL в основной файл: следующий запуск начинает с пустого журнала
+            try:
+                self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось сбросить WAL перед закрытием: {e}")
+            self.db.close()
+        logging.info("✅ Соединения с БД закрыты")
+
+    def backup_to(self, path, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+        """
+        Онлайн-копия БД в файл path через backup API, по pages страниц за шаг.
+
+        Копируем с писателя: его изменения между шагами SQLite сам переносит в
+        копию, без перезапуска. Блокировка писателя отпускается после каждого
+        шага, так что оплаты не ждут всю копию. Возвращает число страниц.
+        """
+        total_pages = 0
+
+        def yield_to_writers(status, remaining, total):
+            nonlocal total_pages
+            total_pages = total
+            self._write_lock.release()
+            try:
+                time.sleep(pause)
+            finally:
+                self._write_lock.acquire()
+
+        target = sqlite3.connect(path)
+        try:
+            with self._write_lock:
+                self.db.backup(target, pages=pages, progress=yield_to_writers)
+        finally:
+            target.close()
+        return total_pages
+
+    @property
+    def write_version(self):
+        """
+        Версия данных клуба, которые отдаёт API. Увеличивается после commit
+        транзакции, отметившей клуб через _touch(); служебные записи (offset,
+        outbox, напоминания) и повторы без изменений её не меняют.
+        """
+        return self._versions[self.tenant_id]
+
+    # ---------- Вспомогательные методы ----------
+    def _fetchall(self, name, params=(), row_factory=None):
+        with self._reader() as conn:
+            cur = conn.execute(SQL[name], params)
+            cur.row_factory = row_factory
+            return cur.fetchall()
+
+    def _fetchone(self, name, params=(), row_factory=None):
+        with self._reader() as conn:
+            cur = conn.execute(SQL[name], params)
+            cur.row_factory = row_factory
+            return cur.fetchone()
+
     def add_or_update_subscription(
-        self, user_id, username, months=1, full_access=False, amount=0, currency="RUB"
+        self,
+        user_id,
+        username,
+        months=1,
+        full_access=False,
+        amount=0,
+        currency="RUB",
+        outbox=(),
+        charge_id=None,
+        provider_charge_id=None,
     ):
-        """Добавление или продление подписки с полной обработкой ошибок"""
+        """
+        Добавление или продление подписки с полной обработкой ошибок.
+
+        outbox — события [(kind, payload)], которые пишутся в той же транзакции;
+        в payload каждого события добавляется "expiry" (ISO-дата или None).
+        charge_id — id платежа Telegram: события оплаты пишутся с ключом от
+        него, а повторная доставка той же оплаты ничего не меняет — только
+        снова ставит в очередь её события и возвращает выданную дату окончания.
+        """
         try:
             now = datetime.now()
 
@@ -60,108 +1271,310 @@ class Database:
             if months < 1:
                 raise ValueError(f"Некорректное количество месяцев: {months}")
 
-            # ----- Полный доступ: бессрочно -----
-            if full_access:
-                expiry = None
-                self.cur.execute(
-                    """
-                    INSERT INTO subscriptions (user_id, username, expiry_date, full_access, status, notified_3days)
-                    VALUES (?, ?, NULL, 1, 'active', 0)
-                    ON CONFLICT(user_id) DO UPDATE SET
-                        username=excluded.username,
-                        full_access=1,
-                        expiry_date=NULL,
-                        status='active',
-                        notified_3days=0
-                    """,
-                    (user_id, username),
+            with self._transaction() as conn:
+                if charge_id:
+                    row = conn.execute(
+                        SQL["payment_by_charge"],
+                        (self.tenant_id, charge_id, self.tenant_id, charge_id),
+                    ).fetchone()
+                    if row:
+                        logging.warning(
+                            f"⚠️ Оплата {charge_id} от {user_id} уже учтена — повтор пропущен"
+                        )
+                        self._requeue_charge(
+                            conn, charge_id, [kind for kind, _ in outbox]
+                        )
+                        return parse_date(row[0])
+
+                # Оплата после истечения — «вернулся»
+                row = conn.execute(SQL["status"], (self.tenant_id, user_id)).fetchone()
+                kind = "rejoined" if row and row[0] == "expired" else "paid"
+
+                # ----- Полный доступ: бессрочно -----
+                if full_access:
+                    expiry = None
+                    logging.info(f"✅ Полный доступ выдан пользователю {user_id}")
+
+                # ----- Месячная подписка (продлеваем) -----
+                else:
+                    # Старую дату читаем на писателе — внутри той же транзакции
+                    result = conn.execute(
+                        SQL["expiry_date"], (self.tenant_id, user_id)
+                    ).fetchone()
+                    old_expiry = None
+                    if result and result[0]:
+                        old_expiry = parse_date(result[0])
+                        if old_expiry is None:
+                            logging.warning(
+                                f"⚠️ Ошибка парсинга старой даты для {user_id}: {result[0]}"
+                            )
+                    # Новая дата окончания через нашу функцию
+                    expiry = calculate_expiry(old_expiry, months)
+                    logging.info(
+                        f"✅ Подписка на {months} мес. добавлена для {user_id} до {expiry.strftime('%d.%m.%Y')}"
+                    )
+
+                # ----- Записываем платеж (всегда, не стираем историю) -----
+                conn.execute(
+                    SQL["insert_payment"],
+                    (
+                        self.tenant_id,
+                        user_id,
+                        amount,
+                        currency,
+                        now.isoformat(),
+                        expiry.isoformat() if expiry else None,
+                        int(full_access),
+                        charge_id,
+                        provider_charge_id,
+                    ),
                 )
-                logging.info(f"✅ Полный доступ выдан пользователю {user_id}")
 
-            # ----- Месячная подписка (продлеваем) -----
-            else:
-                self.cur.execute(
-                    "SELECT expiry_date FROM subscriptions WHERE user_id=?", (user_id,)
+                # ----- Событие → строка subscriptions -----
+                self._append_event(
+                    conn,
+                    user_id,
+                    kind,
+                    username,
+                    expiry,
+                    full_access,
+                    {
+                        "months": months,
+                        "full_access": bool(full_access),
+                        "amount": amount,
+                        "currency": currency,
+                        "charge_id": charge_id,
+                    },
+                )
+
+                # ----- Напоминания: заново от новой даты окончания -----
+                conn.execute(SQL["clear_reminders"], (self.tenant_id, user_id))
+                conn.execute(
+                    SQL["schedule_reminders"],
+                    (self.tenant_id, user_id, now.isoformat()),
                 )
-                result = self.cur.fetchone()
-                old_expiry = None
-                if result and result[0]:
-                    try:
-                        old_expiry = datetime.fromisoformat(result[0])
-                    except (ValueError, TypeError) as e:
-                        old_expiry = None
+
+                for kind, payload in outbox:
+                    payload = dict(
+                        payload, expiry=expiry.isoformat() if expiry else None
+                    )
+                    self._enqueue(
+                        conn, kind, payload, self._charge_key(kind, charge_id)
+                    )
+
+            return expiry
+
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка добавления подписки для {user_id}: {e}", exc_info=True
+            )
+            raise
+
+    def extend_subscriptions(
+        self, segment, days, actor_id=None, note=None, source_message_id=None
+    ):
+        """
+        Продлить все активные месячные подписки сегмента на days дней.
+
+        События продления считаются одним INSERT ... SELECT из прежних дат,
+        subscriptions обновляется из них, напоминания перестраиваются — в
+        одной транзакции, без чтения строк в Python. Возвращает число
+        продлённых подписок. Повтор команды с тем же source_message_id
+        ничего не продлевает и возвращает число из первого раза.
+        """
+        try:
+            if segment not in SEGMENTS:
+                raise ValueError(f"Неизвестный сегмент: {segment}")
+            if not isinstance(days, int) or days < 1:
+                raise ValueError(f"Некорректное количество дней: {days}")
+
+            now = datetime.now()
+            modifier = f"+{days} days"
+
+            with self._transaction() as conn:
+                if source_message_id is not None:
+                    done = conn.execute(
+                        SQL["audit_by_source"],
+                        (self.tenant_id, actor_id, source_message_id),
+                    ).fetchone()[0]
+                    if done:
                         logging.warning(
-                            f"⚠️ Ошибка парсинга старой даты для {user_id}: {e}"
+                            f"⚠️ Продление по сообщению {source_message_id} от "
+                            f"{actor_id} уже выполнено — повтор пропущен"
                         )
-                expiry = calculate_expiry(old_expiry, months)
-                # Новая дата окончания через нашу функцию
-
-                # if result and result[0]:  # есть старая подписка
-                #     try:
-                #         old_expiry = datetime.fromisoformat(result[0])
-                #         if old_expiry > now:
-                #             expiry = old_expiry + timedelta(days=30 * months)
-                #         else:
-                #             expiry = now + timedelta(days=30 * months)
-                #     except (ValueError, TypeError) as e:
-                #         logging.warning(
-                #             f"⚠️ Ошибка парсинга старой даты для {user_id}: {e}"
-                #         )
-                #         expiry = now + timedelta(days=30 * months)
-                # else:
-                #     expiry = now + timedelta(days=30 * months)
-
-                self.cur.execute(
-                    """
-                    INSERT INTO subscriptions (user_id, username, expiry_date, full_access, status, notified_3days)
-                    VALUES (?, ?, ?, 0, 'active', 0)
-                    ON CONFLICT(user_id) DO UPDATE SET
-                        username=excluded.username,
-                        expiry_date=excluded.expiry_date,
-                        full_access=0,
-                        status='active',
-                        notified_3days=0
-                    """,
-                    (user_id, username, expiry.isoformat()),
+                        return done
+
+                conn.execute(
+                    SQL[f"extend_audit_{segment}"],
+                    (
+                        modifier,
+                        now.isoformat(),
+                        actor_id,
+                        note,
+                        source_message_id,
+                        self.tenant_id,
+                    ),
+                )
+                self._touch()
+                first_event = conn.execute(SQL["last_event_id"]).fetchone()[0] + 1
+                count = conn.execute(
+                    SQL[f"extend_events_{segment}"],
+                    (
+                        now.isoformat(),
+                        modifier,
+                        json.dumps({"days": days, "actor_id": actor_id, "note": note}),
+                        self.tenant_id,
+                    ),
+                ).rowcount
+                conn.execute(SQL["project_events"], (self.tenant_id, first_event))
+                conn.execute(
+                    SQL[f"extend_clear_reminders_{segment}"],
+                    (self.tenant_id, self.tenant_id),
                 )
-                logging.info(
-                    f"✅ Подписка на {months} мес. добавлена для {user_id} до {expiry.strftime('%d.%m.%Y')}"
+                conn.execute(
+                    SQL[f"extend_reminders_{segment}"],
+                    (self.tenant_id, now.isoformat()),
                 )
 
-            # ----- Записываем платеж (всегда, не стираем историю) -----
-            self.cur.execute(
-                """
-                INSERT INTO payments (user_id, amount, currency, payment_date, expiry_date, full_access)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    user_id,
-                    amount,
-                    currency,
-                    now.isoformat(),
-                    expiry.isoformat() if expiry else None,
-                    int(full_access),
-                ),
+            logging.info(
+                f"✅ Продлено подписок: {count} (клуб {self.tenant_id}, сегмент {segment}, +{days} дн.)"
             )
+            return count
+        except Exception as e:
+            logging.error(f"❌ Ошибка массового продления: {e}", exc_info=True)
+            raise
 
-            self.db.commit()
-            return expiry
+    def get_recent_charge_ids(self, limit):
+        """charge_id последних оплат клуба — для проверки повторов в памяти"""
+        try:
+            rows = self._fetchall("recent_charges", (self.tenant_id, limit))
+            return [row[0] for row in rows]
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения последних оплат: {e}", exc_info=True)
+            return []
+
+    # ---------- Журнал событий ----------
+    def _append_event(
+        self, conn, user_id, kind, username, expiry, full_access, details
+    ):
+        """
+        Дописать событие с состоянием, посчитанным из входных данных, и
+        обновить по нему строку subscriptions (внутри транзакции)
+        """
+        event_id = conn.execute(
+            SQL["append_event"],
+            (
+                self.tenant_id,
+                user_id,
+                kind,
+                datetime.now().isoformat(),
+                username,
+                expiry.isoformat() if expiry else None,
+                int(bool(full_access)),
+                "active",
+                json.dumps(details),
+            ),
+        ).lastrowid
+        conn.execute(SQL["project_events"], (self.tenant_id, event_id))
+        self._touch()
 
+    def _log_event(self, conn, user_id, kind, status=None, details=None):
+        """
+        Событие без новой даты: прежнее состояние, status — если меняется.
+        Строка subscriptions обновляется по событию, только когда меняется статус
+        """
+        cur = conn.execute(
+            SQL["log_event"],
+            (
+                kind,
+                datetime.now().isoformat(),
+                status,
+                json.dumps(details) if details else None,
+                self.tenant_id,
+                user_id,
+            ),
+        )
+        if status is not None and cur.rowcount:
+            conn.execute(SQL["project_events"], (self.tenant_id, cur.lastrowid))
+            self._touch()
+
+    def get_user_events(self, user_id, limit=20):
+        """Последние события пользователя: (kind, created_at, expiry, full_access, status, details)"""
+        try:
+            rows = self._fetchall("user_events", (self.tenant_id, user_id, limit))
+            return [
+                (
+                    kind,
+                    parse_date(created_at),
+                    parse_date(expiry),
+                    bool(full_access),
+                    status,
+                    json.loads(details) if details else {},
+                )
+                for kind, created_at, expiry, full_access, status, details in rows
+            ]
         except Exception as e:
             logging.error(
-                f"❌ Ошибка добавления подписки для {user_id}: {e}", exc_info=True
+                f"❌ Ошибка чтения событий пользователя {user_id}: {e}", exc_info=True
             )
-            self.db.rollback()
+            return []
+
+    def rebuild_subscriptions(self, token=None):
+        """
+        Сверить проекцию subscriptions клуба с журналом и исправить расхождения.
+
+        Последнее событие каждого пользователя одним INSERT ... SELECT пишется
+        во временную таблицу, сравнивается с subscriptions, и перезаписываются
+        только отличающиеся строки. Строки без событий не удаляются — о них
+        только сообщается. Без token — только сверка; с token — применить, только
+        если расхождения те же, что были показаны при сверке (их "token").
+
+        Возвращает {"changed": [...], "missing": [...], "orphaned": [...]} —
+        user_id отличающихся строк, отсутствующих в subscriptions и строк без
+        событий, — а также "token" этих расхождений и "applied".
+        """
+        try:
+            started = time.monotonic()
+            with self._transaction() as conn:
+                conn.execute(SQL["create_rebuild"])
+                conn.execute(SQL["clear_rebuild"])
+                conn.execute(SQL["stage_rebuild"], (self.tenant_id,))
+                rows = conn.execute(SQL["rebuild_diff"], (self.tenant_id,)).fetchall()
+                diff = {
+                    "changed": [row[0] for row in rows if row[1]],
+                    "missing": [row[0] for row in rows if not row[1]],
+                    "orphaned": [
+                        row[0]
+                        for row in conn.execute(
+                            SQL["rebuild_orphans"], (self.tenant_id,)
+                        )
+                    ],
+                }
+                # Код сверки — от самих строк: изменилось хоть одно значение — другой код
+                diff["token"] = hashlib.sha1(
+                    json.dumps([rows, diff["orphaned"]]).encode()
+                ).hexdigest()[:8]
+                diff["applied"] = token is not None and token == diff["token"]
+                if diff["applied"]:
+                    conn.execute(SQL["apply_rebuild"], (self.tenant_id,))
+                    self._touch()
+                conn.execute(SQL["clear_rebuild"])
+
+            logging.info(
+                f"{'✅ Пересборка' if diff['applied'] else '🔍 Сверка'} подписок клуба "
+                f"{self.tenant_id} с журналом: отличаются {len(diff['changed'])}, "
+                f"нет в проекции {len(diff['missing'])}, без событий "
+                f"{len(diff['orphaned'])} за {time.monotonic() - started:.2f} сек."
+            )
+            return diff
+        except Exception as e:
+            logging.error(f"❌ Ошибка пересборки подписок: {e}", exc_info=True)
             raise
 
     def get_expiry(self, user_id):
         """Получение окончания подписки с проверкой None"""
         try:
-            self.cur.execute(
-                "SELECT expiry_date, full_access FROM subscriptions WHERE user_id=?",
-                (user_id,),
-            )
-            result = self.cur.fetchone()
+            result = self._fetchone("expiry_and_access", (self.tenant_id, user_id))
 
             if not result:
                 return None
@@ -174,11 +1587,10 @@ class Database:
             if not expiry:
                 return None
 
-            try:
-                return datetime.fromisoformat(expiry)
-            except (ValueError, TypeError) as e:
-                logging.error(f"❌ Ошибка парсинга даты для {user_id}: {e}")
-                return None
+            parsed = parse_date(expiry)
+            if parsed is None:
+                logging.error(f"❌ Ошибка парсинга даты для {user_id}: {expiry}")
+            return parsed
 
         except Exception as e:
             logging.error(
@@ -189,10 +1601,7 @@ class Database:
     def has_full_access(self, user_id):
         """Проверка полного доступа"""
         try:
-            self.cur.execute(
-                "SELECT full_access FROM subscriptions WHERE user_id=?", (user_id,)
-            )
-            result = self.cur.fetchone()
+            result = self._fetchone("full_access", (self.tenant_id, user_id))
             return bool(result[0]) if result else False
         except Exception as e:
             logging.error(
@@ -200,18 +1609,18 @@ class Database:
             )
             return False
 
-    def get_user_payments(self, user_id):
-        """История всех платежей пользователя"""
+    def get_user_payments(self, user_id, full_history=False):
+        """Платежи пользователя: оперативные или (full_history) вместе с архивом"""
         try:
-            self.cur.execute(
-                """
-                SELECT payment_date, amount, currency, expiry_date, full_access
-                FROM payments WHERE user_id=?
-                ORDER BY payment_date DESC
-                """,
-                (user_id,),
+            if full_history:
+                return self._fetchall(
+                    "user_payments_full",
+                    (self.tenant_id, user_id, self.tenant_id, user_id),
+                    PaymentRow.from_row,
+                )
+            return self._fetchall(
+                "user_payments", (self.tenant_id, user_id), PaymentRow.from_row
             )
-            return self.cur.fetchall()
         except Exception as e:
             logging.error(
                 f"❌ Ошибка получения платежей для {user_id}: {e}", exc_info=True
@@ -221,58 +1630,59 @@ class Database:
     def get_all_subscriptions(self):
         """Все подписки"""
         try:
-            self.cur.execute(
-                "SELECT user_id, username, expiry_date, full_access, status, notified_3days FROM subscriptions"
+            return self._fetchall(
+                "all_subscriptions", (self.tenant_id,), SubscriptionRow.from_row
             )
-            return self.cur.fetchall()
         except Exception as e:
             logging.error(f"❌ Ошибка получения всех подписок: {e}", exc_info=True)
             return []
 
-    def mark_notified(self, user_id):
-        """Уведомление за 3 дня (только 1 раз)"""
+    def get_due_reminders(self, now, limit=100):
+        """Созревшие неотправленные напоминания: (user_id, stage, due_at, username, expiry)"""
         try:
-            self.cur.execute(
-                "UPDATE subscriptions SET notified_3days=1 WHERE user_id=?", (user_id,)
+            rows = self._fetchall(
+                "due_reminders", (self.tenant_id, now.isoformat(), limit)
             )
-            self.db.commit()
+            return [
+                (user_id, stage, parse_date(due_at), username, parse_date(expiry))
+                for user_id, stage, due_at, username, expiry in rows
+            ]
+        except Exception as e:
+            logging.error(f"❌ Ошибка получения напоминаний: {e}", exc_info=True)
+            return []
+
+    def mark_reminder_sent(self, user_id, stage, delivered=True):
+        """Напоминание отправлено (или пропущено) — больше не выбирается"""
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    SQL["reminder_sent"],
+                    (datetime.now().isoformat(), self.tenant_id, user_id, stage),
+                )
+                if delivered:
+                    self._log_event(conn, user_id, "reminded", details={"stage": stage})
         except Exception as e:
             logging.error(
-                f"❌ Ошибка пометки уведомления для {user_id}: {e}", exc_info=True
+                f"❌ Ошибка пометки напоминания {stage} для {user_id}: {e}",
+                exc_info=True,
             )
 
     def expire_user(self, user_id):
         """Пометить пользователя как истёкшего"""
         try:
-            self.cur.execute(
-                "UPDATE subscriptions SET status='expired' WHERE user_id=?", (user_id,)
-            )
-            self.db.commit()
+            with self._transaction() as conn:
+                self._log_event(conn, user_id, "expired", status="expired")
         except Exception as e:
             logging.error(
                 f"❌ Ошибка пометки истечения для {user_id}: {e}", exc_info=True
             )
 
     def get_all_payments_with_users(self):
-        """Все платежи с данными пользователей"""
-        try:
-            self.cur.execute(
-                """
-                SELECT
-                    payments.user_id,
-                    subscriptions.username,
-                    payments.payment_date,
-                    payments.amount,
-                    payments.currency,
-                    payments.expiry_date,
-                    payments.full_access
-                FROM payments
-                LEFT JOIN subscriptions
-                ON payments.user_id = subscriptions.user_id
-                ORDER BY payments.payment_date DESC
-                """
-            )
-            return self.cur.fetchall()
+        """Все оперативные (не архивные) платежи с данными пользователей"""
+        try:
+            return self._fetchall(
+                "all_payments_with_users", (self.tenant_id,), PaymentRow.from_row
+            )
         except Exception as e:
             logging.error(f"❌ Ошибка получения всех платежей: {e}", exc_info=True)
             return []
@@ -280,25 +1690,9 @@ class Database:
     def get_payments(self, offset=0, limit=20):
         """Платежи с пагинацией"""
         try:
-            self.cur.execute(
-                """
-                SELECT
-                    payments.user_id,
-                    subscriptions.username,
-                    payments.amount,
-                    payments.currency,
-                    payments.payment_date,
-                    payments.expiry_date,
-                    payments.full_access
-                FROM payments
-                LEFT JOIN subscriptions
-                ON payments.user_id = subscriptions.user_id
-                ORDER BY payments.payment_date DESC
-                LIMIT ? OFFSET ?
-                """,
-                (limit, offset),
-            )
-            return self.cur.fetchall()
+            return self._fetchall(
+                "payments_page", (self.tenant_id, limit, offset), PaymentRow.from_row
+            )
         except Exception as e:
             logging.error(f"❌ Ошибка получения платежей: {e}", exc_info=True)
             return []
@@ -306,20 +1700,59 @@ class Database:
     def count_payments(self):
         """Количество платежей"""
         try:
-            self.cur.execute("SELECT COUNT(*) FROM payments")
-            result = self.cur.fetchone()
+            result = self._fetchone("count_payments", (self.tenant_id,))
             return result[0] if result else 0
         except Exception as e:
             logging.error(f"❌ Ошибка подсчета платежей: {e}", exc_info=True)
             return 0
 
+    def get_payment_totals(self):
+        """(число оплат, сумма) за всё время: оперативные + итоги архива"""
+        try:
+            return self._fetchone(
+                "payment_totals", (self.tenant_id, self.tenant_id)
+            ) or (0, 0)
+        except Exception as e:
+            logging.error(f"❌ Ошибка подсчёта итогов оплат: {e}", exc_info=True)
+            return 0, 0
+
+    def archive_payments(self, before, batch=ARCHIVE_BATCH_SIZE):
+        """
+        Перенести оплаты старше before (всех клубов) в payments_archive.
+
+        Пачками по batch строк, каждая — отдельной короткой транзакцией:
+        итоги по месяцам, копия в архив, удаление. Писатель между пачками
+        свободен. Возвращает число перенесённых оплат.
+        """
+        before = before.isoformat()
+        moved = 0
+        try:
+            while True:
+                with self._transaction() as conn:
+                    conn.execute(SQL["archive_totals"], (before, batch))
+                    count = conn.execute(
+                        SQL["archive_payments"],
+                        (datetime.now().isoformat(), before, batch),
+                    ).rowcount
+                    for (tenant_id,) in conn.execute(
+                        SQL["delete_archived_payments"], (before, batch)
+                    ).fetchall():
+                        self._touch(tenant_id)
+                moved += count
+                if count < batch:
+                    break
+
+            if moved:
+                logging.info(f"🗄 В архив перенесено оплат: {moved} (старше {before})")
+            return moved
+        except Exception as e:
+            logging.error(f"❌ Ошибка архивации оплат: {e}", exc_info=True)
+            raise
+
     def get_all_users(self):
         """Все пользователи"""
         try:
-            self.cur.execute(
-                "SELECT user_id, username, expiry_date, full_access FROM subscriptions"
-            )
-            return self.cur.fetchall()
+            return self._fetchall("users_all", (self.tenant_id,), UserRow.from_row)
         except Exception as e:
             logging.error(f"❌ Ошибка получения всех пользователей: {e}", exc_info=True)
             return []
@@ -327,10 +1760,7 @@ class Database:
     def get_active_users(self):
         """Активные пользователи (месячная подписка)"""
         try:
-            self.cur.execute(
-                "SELECT user_id, username, expiry_date, full_access FROM subscriptions WHERE status='active' AND full_access=0"
-            )
-            return self.cur.fetchall()
+            return self._fetchall("users_active", (self.tenant_id,), UserRow.from_row)
         except Exception as e:
             logging.error(
                 f"❌ Ошибка получения активных пользователей: {e}", exc_info=True
@@ -340,10 +1770,7 @@ class Database:
     def get_full_access_users(self):
         """Пользователи с полным доступом"""
         try:
-            self.cur.execute(
-                "SELECT user_id, username, expiry_date, full_access FROM subscriptions WHERE full_access=1"
-            )
-            return self.cur.fetchall()
+            return self._fetchall("users_full", (self.tenant_id,), UserRow.from_row)
         except Exception as e:
             logging.error(
                 f"❌ Ошибка получения пользователей с полным доступом: {e}",
@@ -354,26 +1781,535 @@ class Database:
     def get_expired_users(self):
         """Пользователи с истекшей подпиской"""
         try:
-            self.cur.execute(
-                "SELECT user_id, username, expiry_date, full_access FROM subscriptions WHERE status='expired'"
-            )
-            return self.cur.fetchall()
+            return self._fetchall("users_expired", (self.tenant_id,), UserRow.from_row)
         except Exception as e:
             logging.error(
                 f"❌ Ошибка получения истекших пользователей: {e}", exc_info=True
             )
             return []
 
+    # ---------- Polling ----------
+    def get_update_offset(self):
+        """update_id, с которого продолжать polling (None — с начала очереди)"""
+        try:
+            row = self._fetchone("get_update_offset", (self.tenant_id,))
+            return row[0] if row else None
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения offset обновлений: {e}", exc_info=True)
+            return None
+
+    def set_update_offset(self, update_id):
+        with self._transaction() as conn:
+            conn.execute(
+                SQL["set_update_offset"],
+                (self.tenant_id, update_id, datetime.now().isoformat()),
+            )
+
     def get_user(self, user_id):
         """Получить данные пользователя"""
         try:
-            self.cur.execute(
-                "SELECT user_id, username, expiry_date, full_access FROM subscriptions WHERE user_id=?",
-                (user_id,),
+            return self._fetchone(
+                "get_user", (self.tenant_id, user_id), UserRow.from_row
             )
-            return self.cur.fetchone()
         except Exception as e:
             logging.error(
                 f"❌ Ошибка получения пользователя {user_id}: {e}", exc_info=True
             )
             return None
+
+    def get_segment_counts(self, today=None, expiring_days=7):
+        """
+        Подписчики по сегментам из счётчиков (без обхода subscriptions) плюс
+        expiring — активные месячные, истекающие в ближайшие expiring_days дней.
+        """
+        try:
+            today = today or datetime.now().date()
+            last = today + timedelta(days=expiring_days - 1)
+            rows = self._fetchall(
+                "segment_counts",
+                (
+                    self.tenant_id,
+                    f"{EXPIRY_BUCKET_PREFIX}{today.isoformat()}",
+                    f"{EXPIRY_BUCKET_PREFIX}{last.isoformat()}",
+                ),
+            )
+            counts = dict.fromkeys(SEGMENTS, 0)
+            counts["expiring"] = 0
+            for segment, count in rows:
+                if segment.startswith(EXPIRY_BUCKET_PREFIX):
+                    counts["expiring"] += count
+                else:
+                    counts[segment] = count
+            return counts
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения счётчиков сегментов: {e}", exc_info=True)
+            return None
+
+    # ---------- HTTP API ----------
+    def get_users_after(self, segment, after_user_id=0, limit=500):
+        """Пользователи сегмента с user_id > after_user_id, по возрастанию"""
+        if segment not in SEGMENTS:
+            raise ValueError(f"Неизвестный сегмент: {segment}")
+        return self._fetchall(
+            f"users_after_{segment}",
+            (self.tenant_id, after_user_id, limit),
+            UserRow.from_row,
+        )
+
+    def get_payments_before(self, before_id=None, limit=500):
+        """Оперативные оплаты с id < before_id, от новых к старым: [(id, PaymentRow)]"""
+        rows = self._fetchall(
+            "payments_after",
+            (self.tenant_id, before_id if before_id else 2**63 - 1, limit),
+        )
+        return [(row[0], PaymentRow(row[1], None, *row[2:])) for row in rows]
+
+    def get_stats(self):
+        """Сводка клуба: подписчики по сегментам, оплаты за всё время, обращения"""
+        payments, amount = self.get_payment_totals()
+        return {
+            "subscribers": self.get_segment_counts(),
+            "payments": {"count": payments, "amount": amount},
+            "open_tickets": self.count_open_tickets(),
+        }
+
+    # ---------- Рассылки ----------
+    def create_broadcast(self, segment, text, created_by, source_message_id=None):
+        """
+        Создать задание рассылки и список получателей по сегменту.
+        Возвращает (job_id, создано ли задание): для повтора того же
+        source_message_id — уже существующее задание.
+        """
+        try:
+            if segment not in SEGMENTS:
+                raise ValueError(f"Неизвестный сегмент: {segment}")
+
+            with self._transaction() as conn:
+                row = conn.execute(
+                    SQL["broadcast_by_source"],
+                    (self.tenant_id, created_by, source_message_id),
+                ).fetchone()
+                if row:
+                    return row[0], False
+
+                cur = conn.execute(
+                    SQL["create_broadcast"],
+                    (
+                        self.tenant_id,
+                        segment,
+                        text,
+                        created_by,
+                        datetime.now().isoformat(),
+                        source_message_id,
+                    ),
+                )
+                job_id = cur.lastrowid
+                conn.execute(
+                    SQL[f"broadcast_recipients_{segment}"], (job_id, self.tenant_id)
+                )
+                conn.execute(SQL["set_broadcast_total"], (job_id, job_id))
+
+            logging.info(
+                f"📣 Создана рассылка #{job_id} по сегменту {segment} (клуб {self.tenant_id})"
+            )
+            return job_id, True
+        except Exception as e:
+            logging.error(f"❌ Ошибка создания рассылки: {e}", exc_info=True)
+            raise
+
+    def set_broadcast_progress_message(self, job_id, chat_id, message_id):
+        """Запомнить сообщение с прогрессом (чтобы обновлять его и после рестарта)"""
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    SQL["set_broadcast_progress_message"], (chat_id, message_id, job_id)
+                )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка сохранения прогресса рассылки #{job_id}: {e}", exc_info=True
+            )
+
+    def get_broadcast(self, job_id):
+        """Задание рассылки со счётчиками по статусам получателей"""
+        try:
+            with self._reader() as conn:
+                cur = conn.execute(SQL["get_broadcast"], (self.tenant_id, job_id))
+                cur.row_factory = sqlite3.Row
+                job = cur.fetchone()
+                if not job:
+                    return None
+                counts = dict(
+                    conn.execute(SQL["broadcast_counts"], (job_id,)).fetchall()
+                )
+            return dict(job, counts=counts)
+        except Exception as e:
+            logging.error(f"❌ Ошибка получения рассылки #{job_id}: {e}", exc_info=True)
+            return None
+
+    def get_unfinished_broadcasts(self):
+        """ID рассылок, прерванных остановкой бота"""
+        try:
+            return [
+                row[0]
+                for row in self._fetchall("unfinished_broadcasts", (self.tenant_id,))
+            ]
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка получения незавершённых рассылок: {e}", exc_info=True
+            )
+            return []
+
+    def get_pending_recipients(self, job_id, limit):
+        """Следующая пачка получателей, которым ещё ничего не отправляли"""
+        try:
+            return [
+                row[0] for row in self._fetchall("pending_recipients", (job_id, limit))
+            ]
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка получения получателей рассылки #{job_id}: {e}", exc_info=True
+            )
+            return []
+
+    def claim_recipients(self, job_id, user_ids):
+        """Пометить пачку как 'sending' до отправки — после рестарта её не повторяем"""
+        with self._transaction() as conn:
+            conn.executemany(
+                SQL["claim_recipient"], ((job_id, uid) for uid in user_ids)
+            )
+
+    def finish_recipients(self, job_id, results):
+        """Записать итог доставки пачкой: results — [(user_id, status, error)]"""
+        now = datetime.now().isoformat()
+        with self._transaction() as conn:
+            conn.executemany(
+                SQL["finish_recipient"],
+                ((status, error, now, job_id, uid) for uid, status, error in results),
+            )
+
+    def abandon_sending_recipients(self, job_id):
+        """Получатели, отправка которым прервалась на середине, не получат дубль"""
+        try:
+            with self._transaction() as conn:
+                conn.execute(SQL["abandon_sending_recipients"], (job_id,))
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка восстановления рассылки #{job_id}: {e}", exc_info=True
+            )
+
+    def finish_broadcast(self, job_id, status="done"):
+        """Завершить рассылку (done / cancelled)"""
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    SQL["finish_broadcast"],
+                    (status, datetime.now().isoformat(), job_id),
+                )
+        except Exception as e:
+            logging.error(f"❌ Ошибка завершения рассылки #{job_id}: {e}", exc_info=True)
+
+    # ---------- Outbox ----------
+    def _enqueue(self, conn, kind, payload, dedupe_key=None):
+        now = datetime.now().isoformat()
+        conn.execute(
+            SQL["enqueue_outbox"],
+            (
+                self.tenant_id,
+                kind,
+                json.dumps(payload, ensure_ascii=False),
+                now,
+                now,
+                dedupe_key,
+            ),
+        )
+
+    @staticmethod
+    def _charge_key(kind, charge_id):
+        return f"{kind}:{charge_id}" if charge_id else None
+
+    def _requeue_charge(self, conn, charge_id, kinds):
+        now = datetime.now().isoformat()
+        return sum(
+            conn.execute(
+                SQL["requeue_outbox"],
+                (now, self.tenant_id, self._charge_key(kind, charge_id)),
+            ).rowcount
+            for kind in kinds
+        )
+
+    def requeue_charge_outbox(self, charge_id, kinds):
+        """
+        Повтор уже учтённой оплаты: снова поставить в очередь её события kinds
+        (отправленные или недоставленные) — с тем же payload, поэтому и с той
+        же ссылкой-приглашением. Ожидающие не дублируются. Возвращает число
+        поставленных в очередь.
+        """
+        with self._transaction() as conn:
+            return self._requeue_charge(conn, charge_id, kinds)
+
+    def set_charge_outbox_value(self, kind, charge_id, field, value):
+        """Запомнить в payload события оплаты значение, выданное при доставке"""
+        with self._transaction() as conn:
+            conn.execute(
+                SQL["set_outbox_value"],
+                (field, value, self.tenant_id, self._charge_key(kind, charge_id)),
+            )
+
+    def enqueue_outbox(self, events):
+        """События [(kind, payload)] в outbox одной транзакцией"""
+        with self._transaction() as conn:
+            for kind, payload in events:
+                self._enqueue(conn, kind, payload)
+
+    def get_due_outbox(self, limit=50):
+        """События всех клубов, которые пора доставить: [(id, tenant_id, kind, payload, attempts)]"""
+        try:
+            rows = self._fetchall("due_outbox", (datetime.now().isoformat(), limit))
+            return [
+                (id_, tenant_id, kind, json.loads(payload), attempts)
+                for id_, tenant_id, kind, payload, attempts in rows
+            ]
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения outbox: {e}", exc_info=True)
+            return []
+
+    def mark_outbox_sent(self, event_id):
+        with self._transaction() as conn:
+            conn.execute(SQL["outbox_sent"], (datetime.now().isoformat(), event_id))
+
+    def mark_outbox_retry(self, event_id, next_attempt_at, error):
+        with self._transaction() as conn:
+            conn.execute(
+                SQL["outbox_retry"], (next_attempt_at.isoformat(), error, event_id)
+            )
+
+    def mark_outbox_dead(self, event_id, error):
+        with self._transaction() as conn:
+            conn.execute(SQL["outbox_dead"], (error, event_id))
+
+    # ---------- Поддержка ----------
+    def create_ticket(self, user_id, username, text, admin_ids, source_message_id=None):
+        """
+        Новое обращение + уведомление каждому админу через outbox.
+        Повтор того же source_message_id возвращает уже созданное обращение.
+        """
+        with self._transaction() as conn:
+            row = conn.execute(
+                SQL["ticket_by_source"], (self.tenant_id, user_id, source_message_id)
+            ).fetchone()
+            if row:
+                return row[0]
+
+            cur = conn.execute(
+                SQL["create_ticket"],
+                (
+                    self.tenant_id,
+                    user_id,
+                    username,
+                    text,
+                    datetime.now().isoformat(),
+                    source_message_id,
+                ),
+            )
+            ticket_id = cur.lastrowid
+            self._touch()
+            for admin_id in admin_ids:
+                self._enqueue(
+                    conn, "ticket_notify", {"ticket_id": ticket_id, "chat_id": admin_id}
+                )
+        return ticket_id
+
+    def get_ticket(self, ticket_id):
+        try:
+            return self._fetchone(
+                "get_ticket", (self.tenant_id, ticket_id), TicketRow.from_row
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка получения обращения #{ticket_id}: {e}", exc_info=True
+            )
+            return None
+
+    def get_ticket_by_message(self, chat_id, message_id):
+        """Обращение, уведомлением о котором является сообщение у админа"""
+        try:
+            return self._fetchone(
+                "ticket_by_message",
+                (self.tenant_id, chat_id, message_id),
+                TicketRow.from_row,
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка поиска обращения по сообщению {message_id}: {e}",
+                exc_info=True,
+            )
+            return None
+
+    def link_ticket_message(self, ticket_id, chat_id, message_id):
+        """Запомнить уведомление у админа, чтобы принять ответ на него"""
+        with self._transaction() as conn:
+            conn.execute(
+                SQL["link_ticket_message"],
+                (self.tenant_id, chat_id, message_id, ticket_id),
+            )
+
+    def answer_ticket(self, ticket_id, admin_id, text):
+        """Ответ админа: статус обращения и сообщение пользователю — одной транзакцией"""
+        ticket = self.get_ticket(ticket_id)
+        if not ticket:
+            return None
+
+        with self._transaction() as conn:
+            conn.execute(
+                SQL["answer_ticket"],
+                (datetime.now().isoformat(), admin_id, ticket_id),
+            )
+            self._touch()
+            self._enqueue(
+                conn,
+                "send_message",
+                {
+                    "chat_id": ticket.user_id,
+                    "text": f"💬 Ответ поддержки на ваше обращение #{ticket_id}:\n\n{text}",
+                },
+            )
+        return ticket
+
+    def close_ticket(self, ticket_id):
+        """Закрыть обращение без ответа → True, если оно было открыто"""
+        with self._transaction() as conn:
+            closed = (
+                conn.execute(SQL["close_ticket"], (self.tenant_id, ticket_id)).rowcount
+                > 0
+            )
+            if closed:
+                self._touch()
+            return closed
+
+    def get_open_tickets(self, limit=20):
+        """Самые старые открытые обращения (по частичному индексу)"""
+        try:
+            return self._fetchall(
+                "open_tickets", (self.tenant_id, limit), TicketRow.from_row
+            )
+        except Exception as e:
+            logging.error(f"❌ Ошибка получения открытых обращений: {e}", exc_info=True)
+            return []
+
+    def count_open_tickets(self):
+        try:
+            result = self._fetchone("count_open_tickets", (self.tenant_id,))
+            return result[0] if result else 0
+        except Exception as e:
+            logging.error(f"❌ Ошибка подсчёта открытых обращений: {e}", exc_info=True)
+            return 0
+
+    # ---------- Участники канала ----------
+    def set_channel_status(self, user_id, status, at=None):
+        """Статус в канале: member (вступил), left (вышел), kicked (удалён)"""
+        try:
+            at = (at or datetime.now()).isoformat()
+            with self._transaction() as conn:
+                conn.execute(
+                    SQL["set_channel_status"],
+                    (
+                        self.tenant_id,
+                        user_id,
+                        status,
+                        at if status == "member" else None,
+                        at if status != "member" else None,
+                        at,
+                    ),
+                )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка сохранения статуса в канале для {user_id}: {e}",
+                exc_info=True,
+            )
+
+    def get_channel_statuses(self):
+        """{user_id: status} по всем известным участникам канала"""
+        try:
+            return dict(self._fetchall("channel_statuses", (self.tenant_id,)))
+        except Exception as e:
+            logging.error(f"❌ Ошибка получения участников канала: {e}", exc_info=True)
+            return {}
+
+    def get_not_joined_users(self):
+        """Активные подписчики, которых точно нет в канале (не вступили или вышли)"""
+        try:
+            return self._fetchall(
+                "not_joined_users", (self.tenant_id,), UserRow.from_row
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка получения не вступивших пользователей: {e}", exc_info=True
+            )
+            return []
+
+    def get_unknown_channel_users(self):
+        """Активные подписчики, о статусе которых в канале ничего не известно"""
+        try:
+            return self._fetchall(
+                "unknown_channel_users", (self.tenant_id,), UserRow.from_row
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка получения подписчиков без статуса в канале: {e}",
+                exc_info=True,
+            )
+            return []
+
+    # ---------- Тарифы ----------
+    def seed_plans(self, plans):
+        """Добавить тарифы по умолчанию (существующие не трогаем)"""
+        try:
+            with self._transaction() as conn:
+                conn.executemany(
+                    SQL["seed_plan"], ((self.tenant_id, *plan) for plan in plans)
+                )
+        except Exception as e:
+            logging.error(f"❌ Ошибка заполнения тарифов: {e}", exc_info=True)
+
+    def get_plans(self):
+        """Все тарифы: (code, title, months, full_access, price, currency, active)"""
+        try:
+            return self._fetchall("get_plans", (self.tenant_id,))
+        except Exception as e:
+            logging.error(f"❌ Ошибка получения тарифов: {e}", exc_info=True)
+            return []
+
+    # ---------- Материалы клуба ----------
+    def add_material(
+        self, book, chapter, title, kind, file_id, file_unique_id, created_by
+    ):
+        """Сохранить файл (или обновить метки уже загруженного); возвращает id"""
+        with self._transaction() as conn:
+            return conn.execute(
+                SQL["add_material"],
+                (
+                    self.tenant_id,
+                    book,
+                    chapter,
+                    title,
+                    kind,
+                    file_id,
+                    file_unique_id,
+                    datetime.now().isoformat(),
+                    created_by,
+                ),
+            ).fetchone()[0]
+
+    def get_materials(self):
+        """Все материалы: (id, book, chapter, title, kind, file_id)"""
+        try:
+            return self._fetchall("get_materials", (self.tenant_id,))
+        except Exception as e:
+            logging.error(f"❌ Ошибка получения материалов: {e}", exc_info=True)
+            return []
+
+    def delete_material(self, material_id):
+        with self._transaction() as conn:
+            return conn.execute(
+                SQL["delete_material"], (self.tenant_id, material_id)
+            ).rowcount
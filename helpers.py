@@ -16,3 +16,60 @@ def calculate_expiry(old_expiry, months=1) -> datetime:
 
     # После запуска → обычные 30 дней
     return now + timedelta(days=30 * months)
+
+
+def parse_date(value):
+    """ISO-строка из БД → datetime (None, если даты нет или она битая)"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def format_access(full_access, expiry) -> str:
+    """Текст статуса доступа для админских списков"""
+    if full_access:
+        return "бессрочно (полный)"
+    if expiry:
+        return f"до {expiry.strftime('%d.%m.%Y')}"
+    return "нет подписки"
+
+
+# ---------- Страницы сообщений ----------
+# Лимит длины сообщения Telegram — в единицах UTF-16, не в символах Python
+MESSAGE_LIMIT = 4096
+
+
+def message_length(text) -> int:
+    """Длина текста так, как её считает Telegram (эмодзи — 2 единицы)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def fit_message(text, limit=MESSAGE_LIMIT) -> str:
+    """Обрезать текст до лимита Telegram (только если он не влезает)"""
+    if message_length(text) <= limit:
+        return text
+    cut = text.encode("utf-16-le")[: 2 * (limit - 1)]
+    return cut.decode("utf-16-le", errors="ignore") + "…"
+
+
+def pack_pages(blocks, reserved=0, limit=MESSAGE_LIMIT):
+    """
+    Разбить блоки (строки списка) на страницы: на каждую — столько блоков,
+    сколько влезает в limit вместе с reserved единицами заголовка и итогов.
+    Возвращает границы страниц [(start, end)]; блок больше страницы идёт один.
+    """
+    budget = limit - reserved
+    pages = []
+    start = size = 0
+    for i, block in enumerate(blocks):
+        length = message_length(block)
+        if i > start and size + length > budget:
+            pages.append((start, i))
+            start, size = i, 0
+        size += length
+    if blocks:
+        pages.append((start, len(blocks)))
+    return pages
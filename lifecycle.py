@@ -0,0 +1,102 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from metrics import metrics
+
+# Сколько ждать незавершённую работу после SIGTERM (меньше grace period оркестратора)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+
+class Lifecycle:
+    """
+    Остановка процесса без потери работы.
+
+    Фоновые циклы запускаются через spawn, а шаги, которые нельзя прерывать
+    посередине (пачка обновлений до записи offset, один подписчик в
+    планировщике, пачка outbox), оборачиваются в busy(). По SIGTERM задачи,
+    которые сейчас ждут (getUpdates, sleep), отменяются сразу, а занятые —
+    сразу после выхода из busy(). Что не уложилось в timeout, отменяется
+    принудительно: незаписанный offset вернёт пачку следующему экземпляру,
+    а обработчики идемпотентны.
+    """
+
+    def __init__(self, timeout=SHUTDOWN_TIMEOUT):
+        self.timeout = timeout
+        self.stopping = asyncio.Event()
+        self.tasks = set()
+        self._busy = Counter()  # задача → глубина вложенных busy()
+
+    def install(self):
+        """SIGTERM/SIGINT → мягкая остановка (вызывать из работающего loop)"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop, sig)
+
+    def stop(self, sig=None):
+        if self.stopping.is_set():
+            return
+        name = signal.Signals(sig).name if sig else "запрос"
+        logging.info(
+            f"🛑 Получен {name}: новые обновления не принимаем, завершаем работу"
+        )
+        self.stopping.set()
+        for task in self.tasks:
+            if task not in self._busy:
+                task.cancel()
+
+    def spawn(self, coro, name=None):
+        """Фоновая задача, которую остановка дождётся (или отменит в безопасной точке)"""
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if self.stopping.is_set():
+            task.cancel()
+        return task
+
+    @asynccontextmanager
+    async def busy(self):
+        """Шаг, который при остановке доводится до конца, а не прерывается"""
+        if self.stopping.is_set():
+            raise asyncio.CancelledError
+        task = asyncio.current_task()
+        self._busy[task] += 1
+        try:
+            yield
+        finally:
+            self._busy[task] -= 1
+            if not self._busy[task]:
+                del self._busy[task]
+                if self.stopping.is_set() and task in self.tasks:
+                    task.cancel()  # дальше — только ожидание, его прерываем
+
+    async def drain(self):
+        """Дождаться фоновых задач (не дольше timeout); остаток отменить"""
+        started = time.monotonic()
+        tasks = set(self.tasks)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.timeout)
+            if pending:
+                metrics.inc("shutdown.forced", len(pending))
+                logging.warning(
+                    f"⚠️ Не завершились за {self.timeout:.0f} сек., отменяем: "
+                    f"{', '.join(sorted(t.get_name() for t in pending))}"
+                )
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending, timeout=1)
+
+        duration = time.monotonic() - started
+        metrics.observe("shutdown.drain", duration)
+        logging.info(f"✅ Фоновые задачи остановлены за {duration:.1f} сек.")
+
+    def remaining(self, started):
+        """Сколько осталось от timeout, отсчитанного от started (monotonic)"""
+        return max(0.0, self.timeout - (time.monotonic() - started))
+
+
+lifecycle = Lifecycle()
@@ -1,27 +1,22 @@
-import os
+import time
 import asyncio
 import logging
-import json
-from datetime import datetime, timedelta
 
-from aiogram import Bot, Dispatcher, types
-from aiogram.types import (
-    LabeledPrice,
-    ReplyKeyboardMarkup,
-    KeyboardButton,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-)
-from aiogram.utils import executor, exceptions
-from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram import types
 from aiogram.utils.exceptions import TelegramAPIError
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
 from database import Database
-from info import about_text
-from admin import register_admin_handlers
+from outbox import OutboxWorker
+from backup import BackupManager
+from archive import archive_old_payments
+from api import AdminApi, ADMIN_API_TOKEN
+from profiler import LoopWatchdog
+from polling import poll_updates
+from lifecycle import lifecycle
+from transport import close_shared_connector
+from tenants import load_tenants
+from club import Club
 from logger_config import setup_logger
 
 
@@ -31,426 +26,84 @@ setup_logger()
 # ---------- Настройки ----------
 load_dotenv()
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-PROVIDER_TOKEN = os.getenv("PROVIDER_TOKEN")
-CHANNEL_ID = int(os.getenv("CHANNEL_ID"))
-SUPPORT_USER_ID = int(os.getenv("SUPPORT_USER_ID"))
-DEV_USER_ID = int(os.getenv("DEV_USER_ID"))
-MONTH_PRICE = int(os.getenv("MONTH_PRICE", "50000"))
-FULL_PRICE = int(os.getenv("FULL_PRICE", "150000"))
+# chat_member не приходит по умолчанию — запрашиваем явно (бот должен быть админом канала)
+ALLOWED_UPDATES = types.AllowedUpdates.all()
 
-bot = Bot(token=BOT_TOKEN, timeout=60)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
-
-# ---------- Инициализация БД ----------
+# ---------- Инициализация ----------
+# Одна БД и один outbox-воркер на все клубы; у каждого клуба свой бот и канал
 db = Database()
-register_admin_handlers(dp, db, SUPPORT_USER_ID, DEV_USER_ID, bot)
-
-# ---------- Меню ----------
-main_menu = ReplyKeyboardMarkup(resize_keyboard=True)
-main_menu.add(
-    KeyboardButton("Текущий статус"),
-    KeyboardButton("ℹ️ О клубе"),
-    KeyboardButton("Поддержка"),
-    KeyboardButton("💳 Доступ на месяц"),
-    KeyboardButton("📚 Полный доступ"),
-)
-
-buy_month_inline = InlineKeyboardMarkup().add(
-    InlineKeyboardButton("💳 Оплатить месяц", callback_data="buy_month")
-)
-
-buy_full_inline = InlineKeyboardMarkup().add(
-    InlineKeyboardButton("💳 Оплатить полный доступ", callback_data="buy_full")
-)
-
-
-# ---------- FSM поддержки ----------
-class SupportForm(StatesGroup):
-    waiting_for_message = State()
-
-
-class PaymentForm(StatesGroup):
-    waiting_for_email = State()
-
-
-def user_info(user: types.User):
-    return f"{user.id} (@{user.username or user.full_name})"
-
-
-# ---------- Обработка сообщений ----------
-@dp.message_handler(commands=["start"])
-async def start_command(message: types.Message):
-    try:
-        logging.info(f"/start от {user_info(message.from_user)}")
-        await message.answer(
-            "👋 Привет! Выберите действие из меню 👇", reply_markup=main_menu
-        )
-    except Exception as e:
-        logging.error(
-            f"❌ Ошибка в /start для {user_info(message.from_user)}: {e}", exc_info=True
-        )
-
-
-@dp.message_handler()
-async def any_message(message: types.Message):
-    try:
-        if not message.text:
-            return
-
-        if message.text.startswith("/"):
-            return
-
-        logging.info(f"Сообщение от {user_info(message.from_user)}: {message.text}")
-
-        if message.text == "💳 Доступ на месяц":
-            logging.info(
-                f"Пользователь {user_info(message.from_user)} открыл оплату месяца"
-            )
-            await message.answer(
-                f"💰 Доступ в книжный клуб на 30 дней: {MONTH_PRICE/100:.2f} ₽\nНажми кнопку ниже, чтобы оплатить 👇",
-                reply_markup=buy_month_inline,
-            )
-
-        elif message.text == "📚 Полный доступ":
-            logging.info(
-                f"Пользователь {user_info(message.from_user)} открыл оплату полного доступа"
-            )
-            await message.answer(
-                f"💰 Полный доступ: {FULL_PRICE/100:.2f} ₽\nНажми кнопку ниже, чтобы оплатить 👇",
-                reply_markup=buy_full_inline,
-            )
-
-        elif message.text == "Текущий статус":
-            logging.info(
-                f"Пользователь {user_info(message.from_user)} запросил статус подписки"
-            )
-            expiry = db.get_expiry(message.from_user.id)
-            full = db.has_full_access(message.from_user.id)
-
-            info = "📊 Ваш текущий статус подписки:"
-
-            if full:
-                info += "\n✅ У вас полный доступ."
-                await message.answer(info, reply_markup=main_menu)
-
-            elif expiry and expiry > datetime.now():
-                days_left = (expiry - datetime.now()).days
-                info += f"\n✅ Ваша подписка активна ещё {days_left} дней."
-                await message.answer(info, reply_markup=main_menu)
-
-            else:
-                info += "\n❌ Подписка не активна😟."
-                await message.answer(info, reply_markup=main_menu)
-
-                # И только теперь — предложения оплатить
-                await message.answer(
-                    f"💳 Хочешь продлить? 👇", reply_markup=buy_month_inline
-                )
-                await message.answer(
-                    f"📚 Или полный доступ: 👇", reply_markup=buy_full_inline
-                )
-
-        elif message.text == "ℹ️ О клубе":
-            logging.info(
-                f"Пользователь {user_info(message.from_user)} открыл информацию о клубе"
-            )
-            await message.answer(
-                about_text, reply_markup=main_menu, parse_mode="Markdown"
-            )
-
-        elif message.text == "Поддержка":
-            logging.info(
-                f"Пользователь {user_info(message.from_user)} пишет в поддержку"
-            )
-            await message.answer(
-                "📝 Опишите вашу проблему. Я передам её администратору."
-            )
-            await SupportForm.waiting_for_message.set()
-
-        else:
-            await message.answer("Выберите действие из меню 👇", reply_markup=main_menu)
-
-    except Exception as e:
-        logging.error(
-            f"❌ Ошибка обработки сообщения от {user_info(message.from_user)}: {e}",
-            exc_info=True,
-        )
-        await message.answer(
-            "⚠️ Произошла ошибка. Попробуйте ещё раз или обратитесь в поддержку."
-        )
-
-
-# ---------- Callback оплаты ----------
-@dp.callback_query_handler(lambda c: c.data in ["buy_month", "buy_full"])
-async def process_buy_callback(callback_query: types.CallbackQuery):
-    try:
-        subscription_type = callback_query.data
-        label = (
-            "Полный доступ" if subscription_type == "buy_full" else "Месячный доступ"
-        )
-        description = f"{label} в книжный клуб для {callback_query.from_user.username}"
-        amount = FULL_PRICE if subscription_type == "buy_full" else MONTH_PRICE
-        prices = [LabeledPrice(label=label, amount=amount)]
-        logging.info(
-            f"➡️ Пользователь {callback_query.from_user.id} {callback_query.from_user}: нажал {callback_query.data}"
-        )
-        provider_data = json.dumps(
-            {
-                "receipt": {
-                    "items": [
-                        {
-                            "description": description,
-                            "quantity": 1,
-                            "amount": {
-                                "value": f"{amount / 100:.2f}",  # в РУБЛЯХ, не копейках
-                                "currency": "RUB",
-                            },
-                            "vat_code": 1,  # без НДС
-                            "payment_mode": "full_payment",  # полный расчёт
-                            "payment_subject": "service",  # тип услуги
-                        }
-                    ],
-                    "tax_system_code": 1,  # УСН (упрощённая система) — поменяй на свой код, если другой
-                }
-            }
-        )
+outbox = OutboxWorker(db)
+backups = BackupManager(db)
+watchdog = LoopWatchdog()
+clubs = [Club(config, db, outbox, backups) for config in load_tenants()]
 
-        await bot.send_invoice(
-            chat_id=callback_query.from_user.id,
-            title=label,
-            description=description,
-            payload=subscription_type,
-            provider_token=PROVIDER_TOKEN,
-            currency="RUB",
-            prices=prices,
-            start_parameter=subscription_type,
-            need_email=True,
-            send_email_to_provider=True,
-            provider_data=provider_data,
-        )
-        await callback_query.answer()
-    except Exception as e:
-        logging.error(
-            f"❌ Ошибка создания счёта для {callback_query.from_user.id}", exc_info=True
-        )
-        await callback_query.answer(
-            "⚠️ Не удалось создать счёт. Попробуйте позже.", show_alert=True
-        )
+# HTTP API для дашбордов включается только вместе с токеном
+api = AdminApi(db, [club.tenant_id for club in clubs]) if ADMIN_API_TOKEN else None
 
 
-@dp.pre_checkout_query_handler(lambda q: True)
-async def pre_checkout(pre_checkout_query: types.PreCheckoutQuery):
-    try:
-        await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
-    except Exception as e:
-        logging.error(
-            f"❌ Ошибка pre_checkout для {pre_checkout_query.from_user.id}: {e}",
-            exc_info=True,
-        )
-
-
-@dp.message_handler(content_types=types.ContentType.SUCCESSFUL_PAYMENT)
-async def successful_payment(message: types.Message):
-    try:
-        new_expiry = db.add_or_update_subscription(
-            message.from_user.id,
-            message.from_user.username,
-            months=1,
-            full_access=(message.successful_payment.invoice_payload == "buy_full"),
-            amount=message.successful_payment.total_amount,
-            currency=message.successful_payment.currency,
-        )
-
-        invite = await bot.create_chat_invite_link(chat_id=CHANNEL_ID, member_limit=1)
-
-        expiry_text = (
-            new_expiry.strftime("%d.%m.%Y") if new_expiry else "у вас полный доступ✅"
-        )
-
-        await message.answer(
-            f"✅ Оплата успешно получена!\n"
-            f"Подписка активна до: {expiry_text}.\n\n"
-            f"Вот ссылка на канал:\n{invite.invite_link}, присоединяйтесь!",
-            reply_markup=main_menu,
-        )
-
-        pay = message.successful_payment
-        logging.info(
-            f"✅ УСПЕШНАЯ ОПЛАТА | User {user_info(message.from_user)} | "
-            f"{pay.total_amount/100} {pay.currency} | Тип: {pay.invoice_payload}"
-        )
-    except Exception as e:
-        logging.error(
-            f"❌ Ошибка при обработке успешной оплаты {user_info(message.from_user)}",
-            exc_info=True,
-        )
-        await message.answer(
-            "⚠️ Произошла ошибка при регистрации оплаты. Администратор уже уведомлен."
-        )
-        await bot.send_message(
-            SUPPORT_USER_ID,
-            f"📩 Произошла ошибка при регистрации оплаты от {user_info(message.from_user)}",
-        )
-
-
-# ---------- Поддержка ----------
-@dp.message_handler(state=SupportForm.waiting_for_message)
-async def process_support_message(message: types.Message, state: FSMContext):
-    try:
-        await bot.send_message(
-            SUPPORT_USER_ID,
-            f"📩 Запрос от {user_info(message.from_user)}:\n\n{message.text}",
-        )
-        await bot.send_message(
-            DEV_USER_ID,
-            f"📩 Запрос от {user_info(message.from_user)}:\n\n{message.text}",
-        )
-        await message.answer(
-            "✅ Ваш запрос отправлен администратору.", reply_markup=main_menu
-        )
-        logging.info(
-            f"📩 Сообщение в поддержку от {user_info(message.from_user)}: {message.text}"
-        )
-    except exceptions.BotBlocked:
-        await message.answer("⚠️ Не удалось отправить запрос администратору.")
-        logging.error(
-            f"❌ Сообщение в поддержку не отправлено!!! от {user_info(message.from_user)}: {message.text}"
-        )
-    except Exception as e:
-        logging.error(
-            f"❌ Ошибка отправки в поддержку от {user_info(message.from_user)}: {e}",
-            exc_info=True,
-        )
-        await message.answer("⚠️ Произошла ошибка. Попробуйте позже.")
-    finally:
-        await state.finish()
-
-
-# ---------- Планировщик подписок ----------
-async def check_subscriptions():
-    """Проверка подписок каждый день в 00:01 с безопасной обработкой ошибок"""
+# ---------- Старт ----------
+async def start_bot(club):
+    """Polling одного клуба; сбой перезапускает только его"""
     while True:
-        now = datetime.now()
-        # Следующее время запуска: сегодня в 00:01 или завтра
-        next_run = now.replace(hour=0, minute=1, second=0, microsecond=0)
-        if now >= next_run:
-            next_run += timedelta(days=1)
-
-        wait_time = (next_run - now).total_seconds()
-        logging.info(
-            f"⏳ Следующая проверка подписок в {next_run.strftime('%Y-%m-%d %H:%M:%S')} "
-            f"(через {wait_time/60:.1f} минут)"
-        )
-
-        await asyncio.sleep(wait_time)
-
         try:
-            subscriptions = db.get_all_subscriptions()
-
-            for (
-                user_id,
-                username,
-                expiry_date,
-                full_access,
-                status,
-                notified,
-            ) in subscriptions:
-                try:
-                    if full_access:
-                        continue  # полный доступ — пропускаем
-
-                    if not expiry_date:
-                        continue  # нет даты — пропускаем
-
-                    try:
-                        expiry = datetime.fromisoformat(expiry_date)
-                    except (ValueError, TypeError) as e:
-                        logging.error(
-                            f"❌ Некорректная дата для {user_id} ({username}): {expiry_date}"
-                        )
-                        continue
-
-                    days_left = (expiry - datetime.now()).days
-
-                    # Уведомление за 3 дня
-                    if days_left <= 3 and notified == 0:
-                        try:
-                            await bot.send_message(
-                                user_id,
-                                "🔔 Ваша подписка заканчивается через 3 дня! Чтобы не потерять доступ в клуб, оплатите ещё один месяц.",
-                            )
-                            db.mark_notified(user_id)
-                            logging.info(
-                                f"🔔 Напоминание отправлено {user_id} ({username})"
-                            )
-                        except exceptions.BotBlocked:
-                            logging.warning(
-                                f"⚠️ Бот заблокирован пользователем {user_id} ({username})"
-                            )
-                            db.mark_notified(user_id)
-                        except Exception as e:
-                            logging.error(
-                                f"❌ Ошибка при отправке 3-дневного уведомления {user_id}: {e}"
-                            )
-
-                    # Подписка истекла
-                    if expiry < datetime.now() and status == "active":
-                        try:
-                            await bot.ban_chat_member(CHANNEL_ID, user_id)
-                            await bot.unban_chat_member(CHANNEL_ID, user_id)
-                            await bot.send_message(
-                                user_id,
-                                "🚫 Ваш доступ в книжный клуб истек. Вы сможете вернуться, оплатив по кнопке ниже 👇.",
-                                reply_markup=buy_month_inline,
-                            )
-                            logging.info(f"🚫 {user_id} удалён из канала за неуплату")
-                        except exceptions.BotBlocked:
-                            logging.warning(
-                                f"⚠️ Бот заблокирован пользователем {user_id} ({username})"
-                            )
-                        except Exception as e:
-                            logging.error(
-                                f"❌ Ошибка при удалении {user_id} ({username}) из канала: {e}"
-                            )
-
-                        db.expire_user(user_id)
-
-                except Exception as e:
-                    logging.error(
-                        f"❌ Ошибка обработки подписки для {user_id} ({username}): {e}",
-                        exc_info=True,
-                    )
-                    continue  # продолжаем цикл по другим пользователям
-
-        except Exception as critical_error:
+            logging.info(f"🚀 Бот клуба {club.tenant_id} запущен и работает 24/7")
+            await poll_updates(club, allowed_updates=ALLOWED_UPDATES)
+        except (asyncio.TimeoutError, TelegramAPIError) as e:
             logging.error(
-                f"❌ Критическая ошибка в планировщике подписок: {critical_error}",
-                exc_info=True,
+                f"[⚠️] Ошибка polling клуба {club.tenant_id}: {e}. Перезапуск через 5 сек."
             )
-            await asyncio.sleep(60)  # подождём минуту и попробуем снова
-
-
-# ---------- Старт ----------
-async def on_startup(dp):
-    logging.info("🌐 Планировщик подписок запущен.")
-    asyncio.create_task(check_subscriptions())
+            await asyncio.sleep(5)
+        except Exception as e:
+            logging.exception(
+                f"[💥] Неизвестная ошибка polling клуба {club.tenant_id}: {e}"
+            )
+            await asyncio.sleep(10)
 
 
-async def start_bot():
-    while True:
+async def main():
+    lifecycle.install()
+    watchdog.start()
+    outbox.start()
+    backups.start()
+    lifecycle.spawn(archive_old_payments(db), name="archive")
+    if api:
+        await api.start()
+    for club in clubs:
+        club.start()
+        lifecycle.spawn(start_bot(club), name=f"polling:{club.tenant_id}")
+
+    await lifecycle.stopping.wait()
+    await shutdown()
+
+
+# ---------- Остановка ----------
+async def shutdown():
+    """
+    SIGTERM при выкладке: не принимаем новое, доделываем начатое (не дольше
+    SHUTDOWN_TIMEOUT), досылаем outbox и закрываем сессии и БД.
+    """
+    started = time.monotonic()
+    if api:
+        await api.stop()
+    await lifecycle.drain()
+    await outbox.flush(lifecycle.remaining(started))
+
+    for club in clubs:
         try:
-            logging.info("🚀 Бот запущен и работает 24/7")
-            await dp.start_polling(skip_updates=True, on_startup=on_startup)
-        except (asyncio.TimeoutError, TelegramAPIError) as e:
-            logging.error(f"[⚠️] Ошибка polling: {e}. Перезапуск через 5 сек.")
-            await asyncio.sleep(5)
+            await club.stop()
         except Exception as e:
-            logging.exception(f"[💥] Неизвестная ошибка polling: {e}")
-            await asyncio.sleep(10)
+            logging.error(
+                f"❌ Ошибка остановки клуба {club.tenant_id}: {e}", exc_info=True
+            )
+    watchdog.stop()
+    await close_shared_connector()
+    await asyncio.to_thread(db.close)
+
+    logging.info(f"👋 Процесс остановлен за {time.monotonic() - started:.1f} сек.")
+    for handler in logging.getLogger().handlers:
+        handler.flush()
 
 
 if __name__ == "__main__":
-    logging.info("🚀 Бот запущен и работает 24/7")
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    logging.info(f"🚀 Запуск клубов: {', '.join(club.tenant_id for club in clubs)}")
+    asyncio.run(main())
@@ -0,0 +1,309 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from aiogram import types
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from helpers import fit_message
+from metrics import metrics
+
+MENU_BUTTON = "📖 Материалы"
+
+# Что можно загрузить: тип сообщения → метод бота send_<kind>
+KINDS = ("document", "audio", "voice", "video", "photo")
+
+# callback_data — id материала: он не меняется при перезагрузке библиотеки
+BOOK_PREFIX = "mat_b:"  # первый материал книги → список глав
+CHAPTER_PREFIX = "mat_c:"  # первый материал главы → список файлов
+SEND_PREFIX = "mat:"
+CALLBACK_PREFIXES = (BOOK_PREFIX, CHAPTER_PREFIX, SEND_PREFIX)
+
+KIND_ICONS = {
+    "document": "📄",
+    "audio": "🎧",
+    "voice": "🎙",
+    "video": "🎬",
+    "photo": "🖼",
+}
+
+
+class Material:
+    __slots__ = ("id", "book", "chapter", "title", "kind", "file_id")
+
+    def __init__(self, id, book, chapter, title, kind, file_id):
+        self.id = id
+        self.book = book
+        self.chapter = chapter
+        self.title = title
+        self.kind = kind
+        self.file_id = file_id
+
+    @property
+    def label(self):
+        return f"{KIND_ICONS.get(self.kind, '📎')} {self.title or self.kind}"
+
+    def __repr__(self):
+        return f"<Material {self.id} {self.book}/{self.chapter}>"
+
+
+def file_of(message: types.Message):
+    """(kind, file_id, file_unique_id) файла в сообщении или None"""
+    for kind in KINDS:
+        media = getattr(message, kind, None)
+        if media:
+            if kind == "photo":
+                media = media[-1]  # самый большой размер
+            return kind, media.file_id, media.file_unique_id
+    return None
+
+
+class MaterialLibrary:
+    """
+    Библиотека материалов клуба. Файлы загружаются админом один раз, дальше
+    бот пересылает их по file_id — без повторной загрузки, одним запросом к API.
+
+    Каталог и клавиатуры собираются при загрузке. Доступ проверяется по
+    датам окончания подписок в памяти (загружены при старте, пополняются при
+    оплате); в БД идём только за теми, кого в памяти нет, — например, после
+    ручного продления админом.
+    """
+
+    def __init__(self, db, bot):
+        self.db = db
+        self.bot = bot
+        self.materials = {}
+        self.chapters = {}  # (книга, глава) → [материалы]
+        self.keyboards = {}
+        self.access = {}  # user_id → дата окончания (datetime.max — полный доступ)
+
+    def load(self):
+        materials = {row[0]: Material(*row) for row in self.db.get_materials()}
+
+        books, chapters = {}, {}
+        for material in materials.values():
+            books.setdefault(material.book, material)
+            chapters.setdefault((material.book, material.chapter), []).append(material)
+
+        keyboards = {None: InlineKeyboardMarkup()}
+        for book, first in books.items():
+            keyboards[None].add(
+                InlineKeyboardButton(
+                    f"📚 {book}", callback_data=f"{BOOK_PREFIX}{first.id}"
+                )
+            )
+            keyboards[book] = InlineKeyboardMarkup()
+        for (book, chapter), items in chapters.items():
+            keyboards[book].add(
+                InlineKeyboardButton(
+                    f"📖 {chapter}", callback_data=f"{CHAPTER_PREFIX}{items[0].id}"
+                )
+            )
+            keyboards[book, chapter] = InlineKeyboardMarkup()
+            for material in items:
+                keyboards[book, chapter].add(
+                    InlineKeyboardButton(
+                        material.label, callback_data=f"{SEND_PREFIX}{material.id}"
+                    )
+                )
+
+        # Подменяем целиком — как каталог тарифов
+        self.materials, self.chapters, self.keyboards = materials, chapters, keyboards
+        logging.info(
+            f"✅ Материалы клуба {self.db.tenant_id} загружены: {len(materials)} "
+            f"({len(books)} книг, {len(chapters)} глав)"
+        )
+        return len(materials)
+
+    def load_access(self):
+        access = {u.user_id: u.expiry_date for u in self.db.get_active_users()}
+        access.update(
+            (u.user_id, datetime.max) for u in self.db.get_full_access_users()
+        )
+        self.access = access
+        logging.info(
+            f"✅ Доступ к материалам клуба {self.db.tenant_id}: {len(access)} подписчиков"
+        )
+
+    def grant(self, user_id, expiry):
+        """После оплаты: expiry=None — полный доступ"""
+        self.access[user_id] = expiry or datetime.max
+
+    async def has_access(self, user_id):
+        expiry = self.access.get(user_id)
+        if expiry and expiry > datetime.now():
+            metrics.inc("materials.access.memory")
+            return True
+
+        # Нет в памяти или срок вышел — сверяемся с БД (могли продлить вручную)
+        metrics.inc("materials.access.db")
+        expiry = await asyncio.to_thread(self.db.get_expiry, user_id)
+        if expiry and expiry > datetime.now():
+            self.access[user_id] = expiry
+            return True
+        return False
+
+    def get(self, material_id):
+        return self.materials.get(material_id)
+
+    def keyboard(self, book=None, chapter=None):
+        """Книги; главы книги; файлы главы"""
+        key = None if book is None else book if chapter is None else (book, chapter)
+        return self.keyboards.get(key) or InlineKeyboardMarkup()
+
+    async def send(self, chat_id, material):
+        send = getattr(self.bot, f"send_{material.kind}")
+        await send(chat_id, material.file_id, caption=material.title)
+        metrics.inc("materials.sent")
+
+
+def parse_material_id(data, prefix):
+    value = data[len(prefix) :]
+    return int(value) if value.isdigit() else None
+
+
+def register_material_handlers(dp, library, admin_ids):
+    """Материалы: меню подписчика и загрузка/удаление админом"""
+
+    # -------------------- Подписчики --------------------
+    @dp.message_handler(commands=["materials"])
+    @dp.message_handler(lambda m: m.text == MENU_BUTTON)
+    async def materials_menu(message: types.Message):
+        try:
+            if not await library.has_access(message.from_user.id):
+                metrics.inc("materials.denied")
+                await message.answer(
+                    "🔒 Материалы доступны участникам клуба с активной подпиской."
+                )
+                return
+            if not library.materials:
+                await message.answer("📭 Материалов пока нет — скоро появятся!")
+                return
+            await message.answer(
+                "📖 Материалы клуба. Выберите книгу 👇", reply_markup=library.keyboard()
+            )
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка меню материалов для {message.from_user.id}: {e}",
+                exc_info=True,
+            )
+            await message.answer("⚠️ Произошла ошибка. Попробуйте позже.")
+
+    @dp.callback_query_handler(lambda c: c.data.startswith(CALLBACK_PREFIXES))
+    async def materials_callback(call: types.CallbackQuery):
+        try:
+            prefix = next(p for p in CALLBACK_PREFIXES if call.data.startswith(p))
+            material = library.get(parse_material_id(call.data, prefix))
+            if material is None:
+                await call.answer(
+                    "⚠️ Материал больше недоступен. Откройте меню заново.",
+                    show_alert=True,
+                )
+                return
+            if not await library.has_access(call.from_user.id):
+                metrics.inc("materials.denied")
+                await call.answer(
+                    "🔒 Нужна активная подписка. Продлить её можно в меню.",
+                    show_alert=True,
+                )
+                return
+
+            await call.answer()
+            if prefix == BOOK_PREFIX:
+                await call.message.edit_text(
+                    f"📚 {material.book}. Выберите главу 👇",
+                    reply_markup=library.keyboard(material.book),
+                )
+            elif prefix == CHAPTER_PREFIX:
+                await call.message.edit_text(
+                    f"📖 {material.book}, {material.chapter} 👇",
+                    reply_markup=library.keyboard(material.book, material.chapter),
+                )
+            else:
+                await library.send(call.from_user.id, material)
+                logging.info(f"📖 Материал #{material.id} → {call.from_user.id}")
+        except Exception as e:
+            logging.error(
+                f"❌ Ошибка выдачи материала {call.data} для {call.from_user.id}: {e}",
+                exc_info=True,
+            )
+
+    # -------------------- Админ --------------------
+    @dp.message_handler(commands=["admin_add_material"])
+    async def admin_add_material(message: types.Message):
+        try:
+            if message.from_user.id not in admin_ids:
+                return
+
+            parts = message.text.split(maxsplit=3)[1:]
+            found = message.reply_to_message and file_of(message.reply_to_message)
+            if len(parts) < 2 or not found:
+                await message.answer(
+                    "Ответьте этой командой на сообщение с файлом:\n"
+                    "/admin_add_material <книга> <глава> [название]\n"
+                    "Например: /admin_add_material Книга1 Глава3 Комментарий Оли"
+                )
+                return
+
+            book, chapter = parts[0], parts[1]
+            title = parts[2] if len(parts) > 2 else message.reply_to_message.caption
+            kind, file_id, file_unique_id = found
+            material_id = await asyncio.to_thread(
+                library.db.add_material,
+                book,
+                chapter,
+                title,
+                kind,
+                file_id,
+                file_unique_id,
+                message.from_user.id,
+            )
+            await asyncio.to_thread(library.load)
+            await message.answer(
+                f"✅ Материал #{material_id} сохранён: {book} / {chapter} — {title or kind}"
+            )
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_add_material: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось сохранить материал.")
+
+    @dp.message_handler(commands=["admin_materials"])
+    async def admin_materials(message: types.Message):
+        try:
+            if message.from_user.id not in admin_ids:
+                return
+            if not library.materials:
+                await message.answer("📭 Материалов нет.")
+                return
+
+            lines = ["📖 Материалы клуба:"]
+            for (book, chapter), items in library.chapters.items():
+                lines.append(f"\n📚 {book} / {chapter}")
+                lines.extend(f"#{m.id} {m.label}" for m in items)
+            lines.append("\nУдалить: /admin_delete_material <id>")
+            await message.answer(fit_message("\n".join(lines)))
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_materials: {e}", exc_info=True)
+            await message.answer("⚠️ Ошибка получения материалов.")
+
+    @dp.message_handler(commands=["admin_delete_material"])
+    async def admin_delete_material(message: types.Message):
+        try:
+            if message.from_user.id not in admin_ids:
+                return
+
+            parts = message.text.split()
+            args = parts[1] if len(parts) > 1 else ""
+            if not args.isdigit():
+                await message.answer("Использование: /admin_delete_material <id>")
+                return
+
+            deleted = await asyncio.to_thread(library.db.delete_material, int(args))
+            await asyncio.to_thread(library.load)
+            await message.answer(
+                f"✅ Материал #{args} удалён."
+                if deleted
+                else f"⚠️ Материала #{args} нет."
+            )
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_delete_material: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось удалить материал.")
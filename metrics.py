@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Простые метрики процесса: счётчики, значения и тайминги.
+
+    Без внешних зависимостей — снимок отдаётся админу командой /admin_metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.timings = {}  # имя → [count, sum, max]
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            t = self.timings.get(name)
+            if t is None:
+                self.timings[name] = [1, seconds, seconds]
+            else:
+                t[0] += 1
+                t[1] += seconds
+                t[2] = max(t[2], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime": time.time() - self.started_at,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": {
+                    name: {"count": c, "avg": s / c, "max": m}
+                    for name, (c, s, m) in self.timings.items()
+                },
+            }
+
+    def render(self, prefix=""):
+        """Текстовый отчёт (только метрики с указанным префиксом)"""
+        snap = self.snapshot()
+        lines = [f"📈 Метрики (аптайм {snap['uptime'] / 3600:.1f} ч)"]
+
+        for name, value in sorted(snap["gauges"].items()):
+            if name.startswith(prefix):
+                lines.append(f"{name} = {value}")
+        for name, value in sorted(snap["counters"].items()):
+            if name.startswith(prefix):
+                lines.append(f"{name}: {value}")
+        for name, t in sorted(snap["timings"].items()):
+            if name.startswith(prefix):
+                lines.append(
+                    f"{name}: n={t['count']} avg={t['avg'] * 1000:.0f}мс max={t['max'] * 1000:.0f}мс"
+                )
+        return "\n".join(lines)
+
+
+metrics = Metrics()
@@ -0,0 +1,107 @@
+from helpers import parse_date
+
+# ---------- Строки БД ----------
+# Компактные объекты вместо кортежей: __slots__ без __dict__,
+# даты разбираются один раз — в row_factory, а не в каждом месте использования.
+
+
+class UserRow:
+    """Пользователь из списков подписчиков"""
+
+    __slots__ = ("user_id", "username", "expiry_date", "full_access")
+
+    def __init__(self, user_id, username, expiry_date, full_access):
+        self.user_id = user_id
+        self.username = username
+        self.expiry_date = parse_date(expiry_date)
+        self.full_access = bool(full_access)
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        return cls(*row)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.user_id} @{self.username}>"
+
+
+class SubscriptionRow(UserRow):
+    """Полная строка таблицы subscriptions (для планировщика)"""
+
+    __slots__ = ("status",)
+
+    def __init__(self, user_id, username, expiry_date, full_access, status):
+        super().__init__(user_id, username, expiry_date, full_access)
+        self.status = status
+
+
+class PaymentRow:
+    """Платёж (username подтягивается из subscriptions, если есть)"""
+
+    __slots__ = (
+        "user_id",
+        "username",
+        "amount",
+        "currency",
+        "payment_date",
+        "expiry_date",
+        "full_access",
+    )
+
+    def __init__(
+        self,
+        user_id,
+        username,
+        amount,
+        currency,
+        payment_date,
+        expiry_date,
+        full_access,
+    ):
+        self.user_id = user_id
+        self.username = username
+        self.amount = amount
+        self.currency = currency
+        self.payment_date = parse_date(payment_date)
+        self.expiry_date = parse_date(expiry_date)
+        self.full_access = bool(full_access)
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        return cls(*row)
+
+    def __repr__(self):
+        return f"<PaymentRow {self.user_id} {self.amount} {self.currency}>"
+
+
+class TicketRow:
+    """Обращение в поддержку"""
+
+    __slots__ = (
+        "id",
+        "user_id",
+        "username",
+        "text",
+        "status",
+        "created_at",
+        "answered_at",
+        "answered_by",
+    )
+
+    def __init__(
+        self, id, user_id, username, text, status, created_at, answered_at, answered_by
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.username = username
+        self.text = text
+        self.status = status
+        self.created_at = parse_date(created_at)
+        self.answered_at = parse_date(answered_at)
+        self.answered_by = answered_by
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        return cls(*row)
+
+    def __repr__(self):
+        return f"<TicketRow #{self.id} {self.user_id} {self.status}>"
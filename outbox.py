@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+
+from aiogram.utils import exceptions
+
+from database import DEFAULT_TENANT
+from lifecycle import lifecycle
+from metrics import metrics
+
+POLL_INTERVAL = 5  # сек. — страховка, обычно воркер будят сразу после commit
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 10
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 600
+
+# Повторять бессмысленно: пользователь заблокировал бота или удалил аккаунт
+PERMANENT_ERRORS = (
+    exceptions.BotBlocked,
+    exceptions.ChatNotFound,
+    exceptions.UserDeactivated,
+    exceptions.CantInitiateConversation,
+)
+
+
+class OutboxWorker:
+    """
+    Доставка событий из таблицы outbox.
+
+    Событие попадает в outbox в одной транзакции с данными (например, с
+    оплатой), поэтому после commit оно не потеряется при падении процесса:
+    воркер доставит его с повторами и экспоненциальной задержкой.
+
+    Один воркер на все клубы: обработчики регистрируются по (tenant_id, kind),
+    а о недоставленных событиях сообщается поддержке того клуба, чьё событие.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.handlers = {}
+        self.alerts = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def handler(self, kind, tenant_id=DEFAULT_TENANT):
+        """Декоратор: обработчик событий типа kind клуба tenant_id — async def f(payload)"""
+
+        def decorator(func):
+            self.handlers[tenant_id, kind] = func
+            return func
+
+        return decorator
+
+    def add_alerts(self, tenant_id, alerter):
+        """Куда сообщать о недоставленных событиях клуба (alerts.Alerter)"""
+        self.alerts[tenant_id] = alerter
+
+    def wake(self):
+        """Разбудить воркер сразу после commit с новыми событиями"""
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = lifecycle.spawn(self._run(), name="outbox")
+
+    # ---------- Цикл доставки ----------
+    async def _run(self):
+        logging.info("📬 Outbox-воркер запущен")
+        while True:
+            try:
+                async with lifecycle.busy():
+                    delivered = await self._deliver_batch()
+                if delivered:
+                    continue  # возможно, есть ещё — забираем следующую пачку сразу
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"❌ Ошибка в outbox-воркере: {e}", exc_info=True)
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _deliver_batch(self):
+        """Доставить одну пачку созревших событий; возвращает их число"""
+        events = await asyncio.to_thread(self.db.get_due_outbox, BATCH_SIZE)
+        if events:
+            await asyncio.gather(*(self._deliver(*event) for event in events))
+        return len(events)
+
+    async def flush(self, timeout):
+        """
+        При остановке (воркер уже остановлен): доставить созревшее, пока есть
+        время. Не успели — события остаются в БД для следующего экземпляра.
+        """
+
+        async def deliver_all():
+            while await self._deliver_batch():
+                pass
+
+        try:
+            await asyncio.wait_for(deliver_all(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(
+                "⚠️ Outbox не доставлен целиком — продолжит следующий запуск"
+            )
+
+    async def _deliver(self, event_id, tenant_id, kind, payload, attempts):
+        handler = self.handlers.get((tenant_id, kind))
+        try:
+            if handler is None:
+                raise LookupError(
+                    f"нет обработчика для события {kind} клуба {tenant_id}"
+                )
+
+            await handler(payload)
+            await asyncio.to_thread(self.db.mark_outbox_sent, event_id)
+            metrics.inc(f"outbox.sent.{kind}")
+
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            attempts += 1
+
+            if isinstance(e, PERMANENT_ERRORS) or attempts >= MAX_ATTEMPTS:
+                await asyncio.to_thread(self.db.mark_outbox_dead, event_id, error)
+                metrics.inc(f"outbox.dead.{kind}")
+                logging.error(
+                    f"❌ Событие outbox #{event_id} ({kind}) не доставлено: {error}"
+                )
+                self._alert(event_id, tenant_id, kind, e)
+                return
+
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempts)
+            delay = random.uniform(delay / 2, delay)
+            await asyncio.to_thread(
+                self.db.mark_outbox_retry,
+                event_id,
+                datetime.now() + timedelta(seconds=delay),
+                error,
+            )
+            metrics.inc(f"outbox.retries.{kind}")
+            logging.warning(
+                f"⚠️ Событие outbox #{event_id} ({kind}), попытка {attempts}: {error}. "
+                f"Повтор через {delay:.0f} сек."
+            )
+
+    def _alert(self, event_id, tenant_id, kind, error):
+        """Событие окончательно не доставлено — сообщаем поддержке клуба"""
+        alerter = self.alerts.get(tenant_id)
+        if alerter is not None:
+            alerter.report(f"outbox.{kind}", error, sample=f"#{event_id}")
@@ -0,0 +1,152 @@
+import json
+import logging
+
+from aiogram.types import LabeledPrice, InlineKeyboardMarkup, InlineKeyboardButton
+
+
+# Счета и кнопки, выставленные до появления каталога
+LEGACY_PAYLOADS = {"buy_month": "month", "buy_full": "full"}
+
+PAYLOAD_PREFIX = "plan:"
+CALLBACK_PREFIX = "buy:"
+
+
+def default_plans(month_price, full_price):
+    """Тарифы клуба при первом запуске (дальше каталог живёт в таблице plans)"""
+    return [
+        # code, title, months, full_access, price, sort_order
+        ("month", "Доступ на месяц", 1, 0, month_price, 10),
+        ("month_3", "Доступ на 3 месяца", 3, 0, month_price * 3, 20),
+        ("month_6", "Доступ на 6 месяцев", 6, 0, month_price * 6, 30),
+        ("full", "Полный доступ", 1, 1, full_price, 40),
+    ]
+
+
+class Plan:
+    """Тариф с заранее собранными параметрами счёта"""
+
+    __slots__ = (
+        "code",
+        "title",
+        "months",
+        "full_access",
+        "price",
+        "currency",
+        "active",
+        "payload",
+        "invoice",
+    )
+
+    def __init__(
+        self, code, title, months, full_access, price, currency, active, provider_token
+    ):
+        self.code = code
+        self.title = title
+        self.months = months
+        self.full_access = bool(full_access)
+        self.price = price
+        self.currency = currency
+        self.active = bool(active)
+        self.payload = PAYLOAD_PREFIX + code
+
+        description = f"{title} в книжный клуб"
+        provider_data = json.dumps(
+            {
+                "receipt": {
+                    "items": [
+                        {
+                            "description": description,
+                            "quantity": 1,
+                            "amount": {
+                                "value": f"{price / 100:.2f}",  # в РУБЛЯХ, не копейках
+                                "currency": currency,
+                            },
+                            "vat_code": 1,  # без НДС
+                            "payment_mode": "full_payment",  # полный расчёт
+                            "payment_subject": "service",  # тип услуги
+                        }
+                    ],
+                    "tax_system_code": 1,  # УСН (упрощённая система) — поменяй на свой код, если другой
+                }
+            }
+        )
+
+        # Всё, кроме chat_id, — готовые аргументы для bot.send_invoice
+        self.invoice = dict(
+            title=title,
+            description=description,
+            payload=self.payload,
+            provider_token=provider_token,
+            currency=currency,
+            prices=[LabeledPrice(label=title, amount=price)],
+            start_parameter=code,
+            need_email=True,
+            send_email_to_provider=True,
+            provider_data=provider_data,
+        )
+
+    @property
+    def price_text(self):
+        return f"{self.price / 100:.2f} ₽"
+
+    def __repr__(self):
+        return f"<Plan {self.code} {self.price}>"
+
+
+class PlanCatalog:
+    """
+    Каталог тарифов из БД. Загружается при старте и по /admin_reload_plans;
+    счета и клавиатуры собираются при загрузке, а не на каждое нажатие.
+    """
+
+    def __init__(self, db, provider_token):
+        self.db = db
+        self.provider_token = provider_token
+        self.plans = {}
+        self.keyboards = {}
+
+    def load(self):
+        rows = self.db.get_plans()
+        plans = {row[0]: Plan(*row, self.provider_token) for row in rows}
+
+        keyboards = {}
+        for full in (False, True):
+            kb = InlineKeyboardMarkup()
+            for plan in plans.values():
+                if plan.active and plan.full_access == full:
+                    kb.add(
+                        InlineKeyboardButton(
+                            f"💳 {plan.title} — {plan.price_text}",
+                            callback_data=CALLBACK_PREFIX + plan.code,
+                        )
+                    )
+            keyboards[full] = kb
+
+        # Подменяем целиком — обработчики никогда не видят наполовину загруженный каталог
+        self.plans, self.keyboards = plans, keyboards
+        logging.info(
+            f"✅ Каталог тарифов клуба {self.db.tenant_id} загружен: {', '.join(plans) or 'пусто'}"
+        )
+        return len(plans)
+
+    def get(self, code):
+        return self.plans.get(code)
+
+    def by_callback(self, data):
+        """Тариф по callback_data кнопки (в т.ч. старых buy_month/buy_full)"""
+        if data.startswith(CALLBACK_PREFIX):
+            return self.plans.get(data[len(CALLBACK_PREFIX) :])
+        return self.plans.get(LEGACY_PAYLOADS.get(data))
+
+    def by_payload(self, payload):
+        """Тариф по payload оплаченного счёта (в т.ч. неактивный)"""
+        if payload.startswith(PAYLOAD_PREFIX):
+            return self.plans.get(payload[len(PAYLOAD_PREFIX) :])
+        return self.plans.get(LEGACY_PAYLOADS.get(payload))
+
+    def keyboard(self, full_access=False):
+        """Кнопки оплаты: продление по месяцам или полный доступ"""
+        return self.keyboards.get(full_access) or InlineKeyboardMarkup()
+
+    def is_buy_callback(self, data):
+        return data.startswith(CALLBACK_PREFIX) or data in LEGACY_PAYLOADS
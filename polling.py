@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+
+from lifecycle import lifecycle
+from metrics import metrics
+
+POLL_TIMEOUT = 20  # long polling, сек.
+POLL_LIMIT = 100  # максимум Telegram за один getUpdates
+# Пока пачки обрабатываются, неподтверждённые обновления возвращаются сразу —
+# новые проверяем с таким интервалом (или как только закончится пачка)
+IN_FLIGHT_POLL_INTERVAL = 1
+
+
+async def poll_updates(club, allowed_updates=None):
+    """
+    Long polling клуба с сохранением offset в БД.
+
+    Каждая пачка обновлений обрабатывается отдельной задачей (все обновления
+    параллельно), а polling сразу идёт за следующими: медленный обработчик
+    не задерживает ни pre_checkout, ни остальные обновления. Offset пачки
+    записывается в БД, когда она и все пачки до неё обработаны, — строго по
+    порядку. Telegram получает в getUpdates этот же offset, поэтому
+    необработанные пачки остаются в его очереди: после перезапуска или сбоя
+    они придут снова (обработчики идемпотентны), а уже запущенные в этом
+    процессе отсеиваются по update_id. Если неподтверждённых обновлений
+    больше POLL_LIMIT, новые видны только после завершения старых.
+
+    При остановке ожидание getUpdates прерывается сразу, а начатые пачки
+    обрабатываются до конца вместе с записью offset (lifecycle.busy).
+    """
+    bot, dp, db = club.bot, club.dp, club.db
+    # Обработчики берут бота и диспетчер из контекста текущей задачи
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+
+    await bot.delete_webhook()  # без drop_pending_updates — очередь сохраняется
+    offset = await asyncio.to_thread(db.get_update_offset)
+    logging.info(
+        f"📥 Polling клуба {club.tenant_id} с offset {offset or 'начала очереди'}"
+    )
+
+    gauge = f"polling.batches_in_flight.{club.tenant_id}"
+    in_flight = set()
+    last_handled = None  # future предыдущей пачки: обработана ли она
+    seen = (offset or 0) - 1  # последний update_id, уже отданный в обработку
+
+    async def process(updates, previous, handled):
+        """handled ← обработана ли пачка вместе со всеми предыдущими"""
+        nonlocal offset
+        try:
+            async with lifecycle.busy():
+                results = await asyncio.gather(
+                    *(dp.updates_handler.notify(update) for update in updates),
+                    return_exceptions=True,
+                )
+                for update, result in zip(updates, results):
+                    if isinstance(result, Exception):
+                        # Повторять бесполезно — такое обновление упадёт снова
+                        metrics.inc("polling.handler_errors")
+                        logging.error(
+                            f"❌ Ошибка обработки обновления {update.update_id} "
+                            f"клуба {club.tenant_id}: {result}",
+                            exc_info=result,
+                        )
+
+                # Offset — только после всех предыдущих пачек. Если какая-то
+                # не дообработана (остановка), offset не двигаем: придут снова
+                if previous is not None and not await asyncio.shield(previous):
+                    return
+                handled.set_result(True)
+                await asyncio.to_thread(db.set_update_offset, updates[-1].update_id + 1)
+                offset = updates[-1].update_id + 1
+        finally:
+            if not handled.done():
+                handled.set_result(False)
+
+    def finished(task):
+        in_flight.discard(task)
+        metrics.set(gauge, len(in_flight))
+
+    try:
+        while True:
+            updates = await bot.get_updates(
+                offset=offset,
+                limit=POLL_LIMIT,
+                timeout=POLL_TIMEOUT,
+                allowed_updates=allowed_updates,
+            )
+            fresh = [update for update in updates if update.update_id > seen]
+            if not fresh:
+                if in_flight:
+                    await asyncio.wait(
+                        in_flight,
+                        timeout=IN_FLIGHT_POLL_INTERVAL,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                continue
+
+            metrics.inc("polling.updates", len(fresh))
+            if len(updates) == POLL_LIMIT:
+                metrics.inc("polling.full_batches")  # разбираем накопившуюся очередь
+
+            seen = fresh[-1].update_id
+            handled = asyncio.get_running_loop().create_future()
+            batch = lifecycle.spawn(
+                process(fresh, last_handled, handled),
+                name=f"updates:{club.tenant_id}:{fresh[0].update_id}",
+            )
+            last_handled = handled
+            in_flight.add(batch)
+            batch.add_done_callback(finished)
+            metrics.set(gauge, len(in_flight))
+    except Exception:
+        # Перезапуск polling начнёт с offset из БД — сначала дообрабатываем
+        # начатое, чтобы не запустить те же обновления второй раз
+        if in_flight:
+            await asyncio.wait(in_flight)
+        raise
@@ -0,0 +1,219 @@
+import io
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+
+from aiogram import types
+
+from lifecycle import lifecycle
+from metrics import metrics
+
+SAMPLE_INTERVAL = 0.005  # 200 выборок в секунду
+MAX_PROFILE_SECONDS = 120
+TOP_FUNCTIONS = 40
+
+# Сторожок event loop'а
+STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "300")) / 1000
+HEARTBEAT_INTERVAL = 0.1
+
+# Верхний кадр потока, который просто ждёт работы, — в профиль не считаем
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def frame_key(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    else:
+        filename = os.path.join(*filename.split(os.sep)[-2:])
+    return f"{filename}:{code.co_firstlineno} {code.co_name}"
+
+
+def is_idle(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+# ---------- Профилировщик ----------
+_profile_lock = threading.Lock()
+
+
+def sample_profile(seconds, interval=SAMPLE_INTERVAL):
+    """
+    Статистический профиль процесса за seconds секунд: отдельный поток раз в
+    interval снимает стеки всех потоков (sys._current_frames). Код не
+    инструментируется, поэтому бот работает с обычной скоростью.
+    Возвращает текстовый отчёт.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("профилирование уже идёт")
+    try:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        own_time = Counter()
+        total_time = Counter()
+        busy_threads = Counter()
+        ticks = idle = 0
+
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            ticks += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own or is_idle(frame):
+                    idle += ident != own
+                    continue
+                busy_threads[names.get(ident, ident)] += 1
+                own_time[frame_key(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    key = frame_key(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        total_time[key] += 1
+                    frame = frame.f_back
+            time.sleep(interval)
+
+        return format_profile(
+            seconds, interval, ticks, idle, own_time, total_time, busy_threads
+        )
+    finally:
+        _profile_lock.release()
+
+
+def format_profile(seconds, interval, ticks, idle, own_time, total_time, threads):
+    out = io.StringIO()
+    out.write(
+        f"Профиль за {seconds} сек.: {ticks} выборок (каждые {interval * 1000:.0f} мс)\n"
+        f"Ожидание (потоки простаивали): {idle} выборок\n"
+        f"Доля выборок — сколько времени функция была в работе.\n\n"
+    )
+
+    out.write("Потоки в работе:\n")
+    for name, count in threads.most_common():
+        out.write(f"  {count / ticks:7.1%}  {name}\n")
+
+    for title, counter in (
+        ("Собственное время (функция на вершине стека)", own_time),
+        ("Общее время (функция где-то в стеке)", total_time),
+    ):
+        out.write(f"\n{title}:\n")
+        for key, count in counter.most_common(TOP_FUNCTIONS):
+            out.write(f"  {count / ticks:7.1%}  {count:6}  {key}\n")
+    return out.getvalue()
+
+
+# ---------- Сторожок event loop ----------
+class LoopWatchdog:
+    """
+    Ловит «зависания» event loop: корутина-пульс отмечается каждые
+    HEARTBEAT_INTERVAL, отдельный поток следит за отметкой. Если пульса нет
+    дольше threshold, поток снимает стек потока event loop прямо во время
+    зависания — в логе видно синхронный вызов, который его держит.
+    Стоимость — одно пробуждение корутины и потока на интервал.
+    """
+
+    def __init__(self, threshold=STALL_THRESHOLD):
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.loop = None
+        self.loop_thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logging.info(
+            f"🐶 Сторожок event loop запущен (порог {self.threshold * 1000:.0f} мс)"
+        )
+
+    def stop(self):
+        self._stop.set()
+
+    async def _heartbeat(self):
+        while not self._stop.is_set():
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            lag = time.monotonic() - self.last_beat - HEARTBEAT_INTERVAL
+
+            if lag < self.threshold:
+                if stalled_since is not None:
+                    duration = time.monotonic() - stalled_since
+                    metrics.observe("loop.stall", duration)
+                    logging.warning(f"⚠️ Event loop отвис через {duration:.2f} сек.")
+                    stalled_since = None
+                continue
+
+            if stalled_since is None:
+                stalled_since = self.last_beat + HEARTBEAT_INTERVAL
+                metrics.inc("loop.stalls")
+                self._report(lag)
+
+    def _report(self, lag):
+        frame = sys._current_frames().get(self.loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame else "(нет стека)"
+        task = asyncio.current_task(self.loop)
+        task_info = (
+            f"{task.get_name()} {task.get_coro().__qualname__}" if task else "нет"
+        )
+        logging.warning(
+            f"⚠️ Event loop завис на {lag * 1000:.0f}+ мс. Текущая задача: {task_info}\n"
+            f"Стек потока event loop:\n{stack}"
+        )
+
+
+def register_profiler_handlers(dp, admin_ids):
+    """Команда /admin_profile <секунды> — профиль живого процесса документом"""
+
+    async def send_profile(message, seconds):
+        try:
+            report = await asyncio.to_thread(sample_profile, seconds)
+            await message.answer_document(
+                types.InputFile(
+                    io.BytesIO(report.encode()),
+                    filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt",
+                )
+            )
+        except RuntimeError as e:
+            await message.answer(f"⚠️ {e}")
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_profile: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось снять профиль.")
+
+    @dp.message_handler(commands=["admin_profile"])
+    async def admin_profile(message: types.Message):
+        try:
+            if message.from_user.id not in admin_ids:
+                return
+
+            parts = message.text.split()
+            seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+            if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+                await message.answer(
+                    f"Длительность — от 1 до {MAX_PROFILE_SECONDS} сек.: /admin_profile 10"
+                )
+                return
+
+            await message.answer(f"⏱ Профилирую {seconds} сек...")
+            # В фоне: пачка обновлений не ждёт профиль (polling сохраняет offset после неё)
+            lifecycle.spawn(
+                send_profile(message, seconds), name=f"profile:{message.from_user.id}"
+            )
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_profile: {e}", exc_info=True)
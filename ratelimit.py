@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from metrics import metrics
+
+
+class RateLimiter:
+    """
+    Асинхронный ограничитель частоты: не больше `rate` вызовов в секунду.
+
+    Каждый вызов `wait()` занимает следующий свободный слот; конкурентные
+    корутины выстраиваются в очередь без активного ожидания.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Сдвинуть все слоты (например, после RetryAfter от Telegram)"""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+# ---------- Анти-флуд ----------
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))  # обновлений в секунду
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))  # разовый запас
+THROTTLE_MAX_USERS = 10000  # сколько пользователей помнить (LRU)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Анти-флуд: у каждого пользователя ведро на burst обновлений, которое
+    пополняется rate раз в секунду. Лишние сообщения и нажатия отбрасываются
+    до логирования и запросов к БД; на первое лишнее — одно «помедленнее».
+
+    Вёдра лежат в OrderedDict размером не больше max_users: давно молчавшие
+    пользователи вытесняются (их ведро и так было бы полным).
+    Оплаты и админы не ограничиваются.
+    """
+
+    def __init__(
+        self,
+        admin_ids=(),
+        rate=THROTTLE_RATE,
+        burst=THROTTLE_BURST,
+        max_users=THROTTLE_MAX_USERS,
+    ):
+        super().__init__()
+        self.admin_ids = set(admin_ids)
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()  # user_id → [токены, время, предупреждён]
+
+    def allow(self, user_id):
+        """True — пропустить, False — отбросить с предупреждением, None — молча"""
+        now = time.monotonic()
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = [self.burst, now, False]
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+                metrics.inc("throttle.evicted")
+        else:
+            self.buckets.move_to_end(user_id)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True
+
+        metrics.inc("throttle.dropped")
+        if bucket[2]:
+            return None
+        bucket[2] = True
+        return False
+
+    async def on_pre_process_message(self, message: types.Message, data):
+        if message.content_type == types.ContentType.SUCCESSFUL_PAYMENT:
+            return
+        await self._check(message.from_user, message.answer)
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data):
+        await self._check(call.from_user, call.answer)
+
+    async def _check(self, user, reply):
+        if user is None or user.id in self.admin_ids:
+            return
+
+        allowed = self.allow(user.id)
+        if allowed:
+            return
+        if allowed is False:
+            metrics.inc("throttle.warned")
+            logging.warning(f"⚠️ Флуд от {user.id} (@{user.username}) — притормаживаем")
+            try:
+                await reply(
+                    "⏳ Слишком часто. Подождите пару секунд и попробуйте снова."
+                )
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось предупредить {user.id} о флуде: {e}")
+        raise CancelHandler()
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+
+from aiogram import types
+
+OPEN_TICKETS_LIMIT = 20
+PREVIEW_LENGTH = 150
+
+
+def ticket_author(ticket):
+    return (
+        f"{ticket.user_id} (@{ticket.username})"
+        if ticket.username
+        else str(ticket.user_id)
+    )
+
+
+def register_support_handlers(dp, db, bot, outbox, admin_ids):
+    """Обращения в поддержку: уведомления админам и ответы пользователям"""
+
+    def is_admin(user_id):
+        return user_id in admin_ids
+
+    # -------------------- Уведомление админа (из outbox) --------------------
+    @outbox.handler("ticket_notify", db.tenant_id)
+    async def deliver_ticket(payload):
+        ticket = await asyncio.to_thread(db.get_ticket, payload["ticket_id"])
+        if not ticket:
+            return
+
+        msg = await bot.send_message(
+            payload["chat_id"],
+            f"📩 Обращение #{ticket.id} от {ticket_author(ticket)}:\n\n"
+            f"{ticket.text}\n\n"
+            f"↩️ Ответьте на это сообщение, чтобы ответить пользователю.",
+        )
+        await asyncio.to_thread(
+            db.link_ticket_message, ticket.id, payload["chat_id"], msg.message_id
+        )
+
+    async def send_answer(message, ticket_id, text):
+        ticket = await asyncio.to_thread(
+            db.answer_ticket, ticket_id, message.from_user.id, text
+        )
+        if not ticket:
+            await message.answer("Обращение не найдено.")
+            return
+
+        outbox.wake()
+        await message.answer(
+            f"✅ Ответ на обращение #{ticket.id} отправлен {ticket_author(ticket)}."
+        )
+        logging.info(
+            f"💬 Админ {message.from_user.id} ответил на обращение #{ticket.id}"
+        )
+
+    # -------------------- Ответ reply'ем на уведомление --------------------
+    @dp.message_handler(
+        lambda m: m.reply_to_message is not None
+        and is_admin(m.from_user.id)
+        and not (m.text or "").startswith("/"),
+        content_types=types.ContentType.TEXT,
+    )
+    async def admin_reply(message: types.Message):
+        try:
+            ticket = await asyncio.to_thread(
+                db.get_ticket_by_message,
+                message.chat.id,
+                message.reply_to_message.message_id,
+            )
+            if not ticket:
+                await message.answer(
+                    "⚠️ Это сообщение не связано с обращением в поддержку."
+                )
+                return
+
+            await send_answer(message, ticket.id, message.text)
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_reply: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось отправить ответ.")
+
+    # -------------------- Очередь обращений --------------------
+    @dp.message_handler(commands=["admin_tickets"])
+    async def admin_tickets(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            tickets = await asyncio.to_thread(db.get_open_tickets, OPEN_TICKETS_LIMIT)
+            if not tickets:
+                await message.answer("✅ Открытых обращений нет.")
+                return
+
+            total = await asyncio.to_thread(db.count_open_tickets)
+            text = f"📬 Открытые обращения: {total}"
+            if total > len(tickets):
+                text += f" (показаны {len(tickets)} самых старых)"
+            text += "\n━━━━━━━━━━━━━━━\n\n"
+            for t in tickets:
+                preview = t.text or ""
+                if len(preview) > PREVIEW_LENGTH:
+                    preview = preview[:PREVIEW_LENGTH] + "…"
+                text += (
+                    f"#{t.id} • {t.created_at.strftime('%d.%m %H:%M')} • "
+                    f"{ticket_author(t)}\n{preview}\n\n"
+                )
+            text += "Ответить: /reply <id> <текст>\nЗакрыть: /ticket_close <id>"
+
+            await message.answer(text[:4096])
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_tickets: {e}", exc_info=True)
+            await message.answer("⚠️ Ошибка получения обращений.")
+
+    @dp.message_handler(commands=["reply"])
+    async def admin_reply_command(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            parts = message.text.split(maxsplit=2)
+            if len(parts) < 3 or not parts[1].isdigit():
+                await message.answer("Использование: /reply <id обращения> <текст>")
+                return
+
+            await send_answer(message, int(parts[1]), parts[2])
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_reply_command: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось отправить ответ.")
+
+    @dp.message_handler(commands=["ticket_close"])
+    async def admin_ticket_close(message: types.Message):
+        try:
+            if not is_admin(message.from_user.id):
+                return
+
+            parts = message.text.split()
+            if len(parts) < 2 or not parts[1].isdigit():
+                await message.answer("Укажи ID обращения: /ticket_close <id>")
+                return
+
+            if await asyncio.to_thread(db.close_ticket, int(parts[1])):
+                await message.answer(f"✅ Обращение #{parts[1]} закрыто.")
+            else:
+                await message.answer("Открытое обращение с таким ID не найдено.")
+        except Exception as e:
+            logging.error(f"❌ Ошибка в admin_ticket_close: {e}", exc_info=True)
+            await message.answer("⚠️ Не удалось закрыть обращение.")
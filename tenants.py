@@ -0,0 +1,91 @@
+import os
+import json
+import logging
+
+from database import DEFAULT_TENANT
+from info import about_text
+
+
+class TenantConfig:
+    """Настройки одного клуба: бот, канал, админы, тексты и цены"""
+
+    __slots__ = (
+        "tenant_id",
+        "bot_token",
+        "provider_token",
+        "channel_id",
+        "support_user_id",
+        "dev_user_id",
+        "about_text",
+        "month_price",
+        "full_price",
+    )
+
+    def __init__(
+        self,
+        tenant_id,
+        bot_token,
+        provider_token,
+        channel_id,
+        support_user_id,
+        dev_user_id,
+        about_text=about_text,
+        month_price=50000,
+        full_price=150000,
+    ):
+        self.tenant_id = tenant_id
+        self.bot_token = bot_token
+        self.provider_token = provider_token
+        self.channel_id = int(channel_id)
+        self.support_user_id = int(support_user_id)
+        self.dev_user_id = int(dev_user_id)
+        self.about_text = about_text
+        self.month_price = int(month_price)
+        self.full_price = int(full_price)
+
+    @property
+    def admin_ids(self):
+        return (self.support_user_id, self.dev_user_id)
+
+    def __repr__(self):
+        return f"<TenantConfig {self.tenant_id} channel={self.channel_id}>"
+
+
+def load_tenants():
+    """
+    Клубы из TENANTS_FILE (JSON-список объектов с полями TenantConfig;
+    вместо about_text можно указать about_file). Без файла — один клуб
+    "default" из переменных окружения, как раньше.
+    """
+    path = os.getenv("TENANTS_FILE")
+    if not path:
+        return [
+            TenantConfig(
+                DEFAULT_TENANT,
+                bot_token=os.getenv("BOT_TOKEN"),
+                provider_token=os.getenv("PROVIDER_TOKEN"),
+                channel_id=os.getenv("CHANNEL_ID"),
+                support_user_id=os.getenv("SUPPORT_USER_ID"),
+                dev_user_id=os.getenv("DEV_USER_ID"),
+                month_price=os.getenv("MONTH_PRICE", "50000"),
+                full_price=os.getenv("FULL_PRICE", "150000"),
+            )
+        ]
+
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    tenants = []
+    for entry in entries:
+        about_file = entry.pop("about_file", None)
+        if about_file:
+            with open(about_file, encoding="utf-8") as f:
+                entry["about_text"] = f.read()
+        tenants.append(TenantConfig(**entry))
+
+    ids = [t.tenant_id for t in tenants]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Повторяющиеся tenant_id в {path}: {ids}")
+
+    logging.info(f"✅ Загружено клубов: {len(tenants)} ({', '.join(ids)})")
+    return tenants
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import os
+import random
+import ssl
+import time
+
+import aiohttp
+import certifi
+from aiogram import Bot
+from aiogram.utils import exceptions
+
+from metrics import metrics
+
+# ---------- Пул соединений ----------
+POOL_SIZE = int(os.getenv("BOT_POOL_SIZE", "100"))
+KEEPALIVE_TIMEOUT = 60  # держим соединения с api.telegram.org открытыми между запросами
+DNS_CACHE_TTL = 600
+
+# Один пул на все боты процесса: у каждого клуба свой токен, но хост один —
+# лишний бот не держит собственных соединений и DNS-кэша
+_shared_connector = None
+
+
+def shared_connector():
+    global _shared_connector
+    if _shared_connector is None or _shared_connector.closed:
+        _shared_connector = aiohttp.TCPConnector(
+            limit=POOL_SIZE,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            enable_cleanup_closed=True,
+            ssl=ssl.create_default_context(cafile=certifi.where()),
+        )
+    return _shared_connector
+
+
+async def close_shared_connector():
+    if _shared_connector is not None and not _shared_connector.closed:
+        await _shared_connector.close()
+
+
+# ---------- Таймауты по методам (секунды) ----------
+DEFAULT_TIMEOUT = 15
+CONNECT_TIMEOUT = 5
+METHOD_TIMEOUTS = {
+    "answerCallbackQuery": 5,
+    "answerPreCheckoutQuery": 5,  # Telegram ждёт ответ не больше 10 секунд
+    "sendMessage": 10,
+    "editMessageText": 10,
+    "deleteMessage": 10,
+    "sendInvoice": 10,
+    "createChatInviteLink": 10,
+    "banChatMember": 10,
+    "unbanChatMember": 10,
+    "getChatMember": 10,
+    "sendDocument": 60,
+    "sendAudio": 60,
+    "sendVoice": 60,
+    "sendVideo": 60,
+}
+POLLING_TIMEOUT_MARGIN = 10  # getUpdates: long polling + запас
+
+# Общий бюджет времени на метод вместе с повторами: ответ на pre_checkout
+# Telegram ждёт 10 секунд, опоздавший ответ — это несостоявшаяся оплата
+METHOD_BUDGETS = {
+    "answerPreCheckoutQuery": 8,
+}
+MIN_ATTEMPT_TIME = 1  # меньше этого на попытку не оставляем — не повторяем
+
+# ---------- Повторы ----------
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 5
+MAX_RETRY_AFTER = 10  # дольше flood control ждать в обработчике нет смысла
+
+# Повтор этих методов безопасен: они либо идемпотентны, либо дубль ничего не ломает
+# (лишняя одноразовая ссылка-приглашение просто не будет использована)
+IDEMPOTENT_METHODS = {
+    "getMe",
+    "getUpdates",
+    "getChat",
+    "getChatMember",
+    "getFile",
+    "answerCallbackQuery",
+    "answerPreCheckoutQuery",
+    "editMessageText",
+    "deleteMessage",
+    "banChatMember",
+    "unbanChatMember",
+    "createChatInviteLink",
+}
+
+# ---------- Circuit breaker ----------
+BREAKER_THRESHOLD = int(os.getenv("BOT_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BOT_BREAKER_COOLDOWN", "30"))
+
+
+class CircuitOpen(exceptions.NetworkError):
+    """Bot API недоступен — запрос отклонён без попытки отправки"""
+
+
+class CircuitBreaker:
+    """
+    closed → (BREAKER_THRESHOLD сбоев подряд) → open → (cooldown) → half-open.
+    В half-open пропускается один пробный запрос: успех закрывает цепь, сбой
+    снова открывает её на cooldown.
+    """
+
+    def __init__(
+        self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, name=None
+    ):
+        # Метрика состояния своя у каждого бота: bot_api.breaker_state.<name>
+        self.metric = (
+            f"bot_api.breaker_state.{name}" if name else "bot_api.breaker_state"
+        )
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self._set_state("half-open")
+        if self.state == "half-open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self._probe_in_flight = False
+        if self.state != "closed":
+            logging.info(
+                f"✅ Bot API снова доступен, circuit breaker закрыт ({self.metric})"
+            )
+            self._set_state("closed")
+
+    def failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half-open" or (
+            self.state == "closed" and self.failures >= self.threshold
+        ):
+            logging.error(
+                f"❌ Bot API деградировал ({self.failures} сбоев подряд), "
+                f"circuit breaker открыт на {self.cooldown:.0f} сек."
+            )
+            metrics.inc("bot_api.breaker_trips")
+            self.opened_at = time.monotonic()
+            self._set_state("open")
+
+    def release(self):
+        """Пробный запрос отменён, не завершившись"""
+        self._probe_in_flight = False
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set(self.metric, state)
+
+
+def is_transient(error):
+    """Сбой инфраструктуры (а не ошибка в самом запросе)"""
+    return isinstance(
+        error,
+        (asyncio.TimeoutError, exceptions.NetworkError, exceptions.RestartingTelegram),
+    )
+
+
+def is_connect_error(error):
+    """Соединение не установлено — запрос гарантированно не дошёл до Telegram"""
+    return isinstance(error, exceptions.NetworkError) and "ClientConnector" in str(
+        error
+    )
+
+
+def backoff(attempt):
+    """Экспоненциальная задержка с джиттером"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)
+    return random.uniform(delay / 2, delay)
+
+
+class ResilientBot(Bot):
+    """
+    Bot с настроенным пулом соединений, таймаутами по методам, повторами
+    с джиттером и circuit breaker. Все вызовы отражаются в метриках bot_api.*
+
+    Соединения общие для всех ботов процесса (shared_connector); circuit
+    breaker у каждого бота свой — name различает их в метриках.
+    """
+
+    def __init__(self, token, name=None, **kwargs):
+        kwargs.setdefault("connections_limit", POOL_SIZE)
+        super().__init__(token, **kwargs)
+        self.breaker = CircuitBreaker(name=name)
+        metrics.set(self.breaker.metric, self.breaker.state)
+
+    async def get_new_session(self):
+        return aiohttp.ClientSession(
+            connector=shared_connector(),
+            connector_owner=False,  # закрытие сессии бота не рвёт соединения остальных
+            timeout=aiohttp.ClientTimeout(
+                total=DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT
+            ),
+        )
+
+    def _timeout_for(self, method, data):
+        if method == "getUpdates":
+            return (data or {}).get("timeout", 0) + POLLING_TIMEOUT_MARGIN
+        return METHOD_TIMEOUTS.get(method, DEFAULT_TIMEOUT)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        retryable = method in IDEMPOTENT_METHODS and not files
+        budget = METHOD_BUDGETS.get(method)
+        deadline = time.monotonic() + budget if budget else None
+
+        def out_of_budget(delay):
+            return (
+                deadline is not None
+                and time.monotonic() + delay + MIN_ATTEMPT_TIME > deadline
+            )
+
+        for attempt in range(MAX_ATTEMPTS):
+            if not self.breaker.allow():
+                metrics.inc(f"bot_api.rejected.{method}")
+                raise CircuitOpen(f"Bot API недоступен, запрос {method} отклонён")
+
+            started = time.monotonic()
+            timeout = self._timeout_for(method, data)
+            if deadline is not None:
+                timeout = min(timeout, deadline - started)
+            try:
+                with self.request_timeout(timeout):
+                    result = await super().request(method, data, files, **kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except exceptions.RetryAfter as e:
+                # Flood control — не сбой API, но ждать можно только недолго
+                self.breaker.success()
+                metrics.inc(f"bot_api.flood.{method}")
+                if (
+                    e.timeout > MAX_RETRY_AFTER
+                    or attempt == MAX_ATTEMPTS - 1
+                    or out_of_budget(e.timeout)
+                ):
+                    raise
+                await asyncio.sleep(e.timeout)
+                continue
+            except Exception as e:
+                metrics.observe(f"bot_api.{method}", time.monotonic() - started)
+                if not is_transient(e):
+                    # Ошибка в самом запросе (BadRequest, BotBlocked...) — API живо
+                    self.breaker.success()
+                    metrics.inc(f"bot_api.errors.{type(e).__name__}")
+                    raise
+
+                self.breaker.failure()
+                metrics.inc(f"bot_api.failures.{method}")
+                delay = backoff(attempt)
+                if (
+                    attempt == MAX_ATTEMPTS - 1
+                    or not (retryable or is_connect_error(e))
+                    or out_of_budget(delay)
+                ):
+                    raise
+
+                metrics.inc(f"bot_api.retries.{method}")
+                logging.warning(
+                    f"⚠️ {method}: {type(e).__name__}: {e}. Повтор через {delay:.1f} сек."
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.success()
+            metrics.observe(f"bot_api.{method}", time.monotonic() - started)
+            return result